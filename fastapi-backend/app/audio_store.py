@@ -0,0 +1,49 @@
+from typing import Optional
+import hashlib
+import mmap
+import os
+import tempfile
+
+from app.config import settings
+
+# Raw uploads kept on local disk so voice turns can be re-transcribed later.
+# Files are named by the SHA-256 of their bytes, so identical uploads are
+# stored once, and sharded two levels deep (ab/cd/abcd...) to keep
+# directories small. Voice rows reference the hash, not a path, so the store
+# can be moved by changing AUDIO_STORE_DIR.
+
+
+def enabled() -> bool:
+    return bool(settings.AUDIO_STORE_DIR)
+
+
+def path_for(digest: str, root: Optional[str] = None) -> str:
+    root = root or settings.AUDIO_STORE_DIR
+    return os.path.join(root, digest[:2], digest[2:4], digest)
+
+
+def put(data: bytes, root: Optional[str] = None) -> str:
+    """Store data if it is not there yet and return its hash"""
+    digest = hashlib.sha256(data).hexdigest()
+    path = path_for(digest, root)
+    if os.path.exists(path):
+        return digest
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Write aside and rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return digest
+
+
+def open_mapped(digest: str, root: Optional[str] = None) -> mmap.mmap:
+    """Read-only memory map of a stored file; the caller closes it"""
+    with open(path_for(digest, root), "rb") as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
@@ -0,0 +1,131 @@
+from typing import Optional
+import zlib
+
+import brotli
+from starlette.datastructures import Headers, MutableHeaders
+
+from app.config import settings
+
+# Negotiated response compression: brotli when the client accepts it, else
+# gzip. Only textual payloads (COMPRESSION_MEDIA_TYPES) at least
+# COMPRESSION_MIN_BYTES long are compressed; below that the framing costs
+# more than it saves. Streamed responses such as exports are compressed
+# chunk by chunk and flushed after each one, so rows still arrive as they
+# are produced. History ETags are weak, so they stay valid across encodings.
+
+ENCODINGS = ("br", "gzip")
+
+
+def negotiate(accept_encoding: Optional[str]) -> Optional[str]:
+    """Preferred supported encoding from an Accept-Encoding header, None for identity"""
+    if not accept_encoding:
+        return None
+    weights = {}
+    for part in accept_encoding.split(","):
+        coding, _, params = part.strip().partition(";")
+        weight = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for encoding in ENCODINGS:
+        weight = weights.get(encoding, weights.get("*", 0.0))
+        if weight > best_weight:
+            best, best_weight = encoding, weight
+    return best
+
+
+class _Compressor:
+    def __init__(self, encoding: str):
+        if encoding == "br":
+            self._brotli = brotli.Compressor(quality=settings.COMPRESSION_BROTLI_QUALITY)
+            self._zlib = None
+        else:
+            self._brotli = None
+            # wbits 31: gzip container
+            self._zlib = zlib.compressobj(settings.COMPRESSION_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def chunk(self, data: bytes) -> bytes:
+        """Compress data and flush it, so the client can decode it right away"""
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.flush()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self, data: bytes = b"") -> bytes:
+        if self._brotli is not None:
+            return self._brotli.process(data) + self._brotli.finish()
+        return self._zlib.compress(data) + self._zlib.flush(zlib.Z_FINISH)
+
+
+def _compressible(headers: Headers, status: int) -> bool:
+    if status < 200 or status in (204, 304) or "content-encoding" in headers:
+        return False
+    media_type = headers.get("content-type", "").split(";")[0].strip().lower()
+    return media_type in settings.COMPRESSION_MEDIA_TYPES
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.RESPONSE_COMPRESSION:
+            await self.app(scope, receive, send)
+            return
+
+        encoding = negotiate(Headers(scope=scope).get("accept-encoding"))
+        start_message = None
+        compressor: Optional[_Compressor] = None
+
+        async def compressing_send(message):
+            nonlocal start_message, compressor
+            if message["type"] == "http.response.start":
+                # Held until the first body chunk shows whether compressing pays off
+                start_message = {**message, "headers": list(message.get("headers", []))}
+                return
+            if message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if start_message is not None:
+                start, start_message = start_message, None
+                headers = MutableHeaders(raw=start["headers"])
+                if not _compressible(headers, start["status"]):
+                    await send(start)
+                    await send(message)
+                    return
+                # The body depends on Accept-Encoding whether or not this one is compressed
+                headers.add_vary_header("Accept-Encoding")
+                if encoding is None or (not more_body and len(body) < settings.COMPRESSION_MIN_BYTES):
+                    await send(start)
+                    await send(message)
+                    return
+
+                compressor = _Compressor(encoding)
+                headers["Content-Encoding"] = encoding
+                if more_body:
+                    del headers["Content-Length"]
+                    body = compressor.chunk(body)
+                else:
+                    body = compressor.finish(body)
+                    headers["Content-Length"] = str(len(body))
+                await send(start)
+                await send({"type": "http.response.body", "body": body, "more_body": more_body})
+                return
+
+            if compressor is None:
+                await send(message)
+            elif more_body:
+                await send({"type": "http.response.body", "body": compressor.chunk(body), "more_body": True})
+            else:
+                await send({"type": "http.response.body", "body": compressor.finish(body)})
+
+        await self.app(scope, receive, compressing_send)
@@ -16,8 +16,126 @@ class Settings:
     POSTGRES_PASSWORD: str = os.getenv("DB_PASSWORD", "yomal")
     DATABASE_URI: str = f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_SERVER}:{POSTGRES_PORT}/{POSTGRES_DB}"
     
+    # Optional streaming replica for read-only endpoints (same credentials and database name)
+    REPLICA_SERVER: str = os.getenv("DB_REPLICA_HOST", "")
+    REPLICA_PORT: str = os.getenv("DB_REPLICA_PORT", POSTGRES_PORT)
+    READ_REPLICA_URI: str = (
+        f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{REPLICA_SERVER}:{REPLICA_PORT}/{POSTGRES_DB}"
+        if REPLICA_SERVER else ""
+    )
+    REPLICA_MAX_LAG_SECONDS: float = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+    REPLICA_LAG_CHECK_INTERVAL_SECONDS: float = float(os.getenv("DB_REPLICA_LAG_CHECK_INTERVAL_SECONDS", "2"))
+    # Reads for a user/session written within this window go to the primary
+    READ_YOUR_WRITES_SECONDS: float = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+    
+    # Connection pool of each engine (primary, replica) in every worker process
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_RECYCLE_SECONDS: int = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "3600"))
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+    # Fast-fail: a checkout waiting longer than this, or finding this many checkouts already
+    # waiting (0 = no limit), ends the request with 503 instead of queueing it
+    DB_POOL_TIMEOUT_SECONDS: float = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "30"))
+    DB_POOL_MAX_WAITING: int = int(os.getenv("DB_POOL_MAX_WAITING", "0"))
+    # Checkouts that waited longer than this are logged
+    DB_POOL_SLOW_CHECKOUT_SECONDS: float = float(os.getenv("DB_POOL_SLOW_CHECKOUT_SECONDS", "0.5"))
+    # DB_HOST points at PgBouncer in transaction pooling mode: no pre-ping (PgBouncer checks
+    # server connections itself), and session-level features such as LISTEN go to DB_DIRECT_HOST
+    DB_PGBOUNCER: bool = os.getenv("DB_PGBOUNCER", "false").lower() == "true"
+    DB_DIRECT_HOST: str = os.getenv("DB_DIRECT_HOST", POSTGRES_SERVER)
+    DB_DIRECT_PORT: str = os.getenv("DB_DIRECT_PORT", POSTGRES_PORT)
+    
     # External service URLs
     AI_AGENTS_URL: str = os.getenv("AI_AGENTS_URL", "http://localhost:8001")
     WHISPER_SERVICE_URL: str = os.getenv("WHISPER_SERVICE_URL", "http://localhost:9000")
+    
+    # Search settings
+    # Trigram indexes enable typo-tolerant search (fuzzy=true) and need the pg_trgm extension
+    SEARCH_TRIGRAM_INDEXES: bool = os.getenv("SEARCH_TRIGRAM_INDEXES", "false").lower() == "true"
+    
+    # Partitioning and retention for chats/voice (monthly range partitions on created_at)
+    PARTITION_MONTHS_AHEAD: int = int(os.getenv("PARTITION_MONTHS_AHEAD", "3"))
+    PARTITION_RETENTION_MONTHS: int = int(os.getenv("PARTITION_RETENTION_MONTHS", "0"))  # 0 keeps everything
+    PARTITION_ARCHIVE_DIR: str = os.getenv("PARTITION_ARCHIVE_DIR", "")  # empty: detach without exporting
+    PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = int(os.getenv("PARTITION_MAINTENANCE_INTERVAL_SECONDS", "86400"))
+    
+    # Default lookback for user history endpoints, lets queries prune old partitions (0 = unbounded)
+    HISTORY_WINDOW_DAYS: int = int(os.getenv("HISTORY_WINDOW_DAYS", "0"))
+    
+    # Conditional GET for session history: rendered bodies kept per session version (0 disables the cache)
+    HISTORY_CACHE_SIZE: int = int(os.getenv("HISTORY_CACHE_SIZE", "0"))
+    # Announce history changes to other workers (session WebSockets) with LISTEN/NOTIFY
+    HISTORY_VERSION_NOTIFY: bool = os.getenv("HISTORY_VERSION_NOTIFY", "true").lower() == "true"
+    
+    # Rows fetched per server-side cursor round trip by exports and imports
+    EXPORT_BATCH_SIZE: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    
+    # Most turns accepted by one POST /messages/batch
+    MESSAGE_BATCH_MAX_SIZE: int = int(os.getenv("MESSAGE_BATCH_MAX_SIZE", "500"))
+    
+    # /users/{id}/changes only returns rows stamped at least this long ago, so a write whose
+    # transaction commits a little after its updated_at is not skipped by a cursor already past it
+    CHANGES_SETTLE_SECONDS: float = float(os.getenv("CHANGES_SETTLE_SECONDS", "2"))
+    
+    # /ws/sessions/{id}: heartbeat interval, idle disconnect, outgoing frames buffered per
+    # connection and how long a reply may wait for room before a slow client is dropped
+    WS_HEARTBEAT_SECONDS: float = float(os.getenv("WS_HEARTBEAT_SECONDS", "20"))
+    WS_IDLE_TIMEOUT_SECONDS: float = float(os.getenv("WS_IDLE_TIMEOUT_SECONDS", "60"))
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "64"))
+    WS_SEND_TIMEOUT_SECONDS: float = float(os.getenv("WS_SEND_TIMEOUT_SECONDS", "10"))
+    WS_MAX_PENDING_TURNS: int = int(os.getenv("WS_MAX_PENDING_TURNS", "8"))
+    WS_MAX_AUDIO_BYTES: int = int(os.getenv("WS_MAX_AUDIO_BYTES", str(10 * 1024 * 1024)))
+    
+    # gzip/brotli for responses whose client accepts it; smaller bodies than COMPRESSION_MIN_BYTES go as is
+    RESPONSE_COMPRESSION: bool = os.getenv("RESPONSE_COMPRESSION", "true").lower() == "true"
+    COMPRESSION_MIN_BYTES: int = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+    COMPRESSION_GZIP_LEVEL: int = int(os.getenv("COMPRESSION_GZIP_LEVEL", "6"))
+    COMPRESSION_BROTLI_QUALITY: int = int(os.getenv("COMPRESSION_BROTLI_QUALITY", "4"))
+    COMPRESSION_MEDIA_TYPES: list = [
+        t.strip().lower()
+        for t in os.getenv("COMPRESSION_MEDIA_TYPES", "application/json,application/x-ndjson,text/csv,text/plain").split(",")
+        if t.strip()
+    ]
+    
+    # /admin/* endpoints require this in X-Admin-Token (empty: admin endpoints are disabled)
+    ADMIN_TOKEN: str = os.getenv("ADMIN_TOKEN", "")
+    # Sampling profiler: interval between stack samples, longest a session may run
+    # before stopping itself, and how many X-Profile request profiles are kept
+    PROFILER_INTERVAL_MS: float = float(os.getenv("PROFILER_INTERVAL_MS", "5"))
+    PROFILER_MAX_SECONDS: float = float(os.getenv("PROFILER_MAX_SECONDS", "300"))
+    PROFILER_KEEP_REQUEST_PROFILES: int = int(os.getenv("PROFILER_KEEP_REQUEST_PROFILES", "20"))
+    
+    # Per-user limits on the chat and voice endpoints (0 disables either one)
+    RATE_LIMIT_PER_MINUTE: int = int(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
+    RATE_LIMIT_BURST: int = int(os.getenv("RATE_LIMIT_BURST", "20"))
+    USER_MAX_CONCURRENT_REQUESTS: int = int(os.getenv("USER_MAX_CONCURRENT_REQUESTS", "4"))
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory or postgres (shared by workers)
+    RATE_LIMITED_PATHS: list = [p.strip() for p in os.getenv("RATE_LIMITED_PATHS", "/chat,/voice/").split(",") if p.strip()]
+    
+    # Upstream calls go through weighted fair queues with this many calls in flight per worker (0 = unlimited)
+    WHISPER_MAX_CONCURRENCY: int = int(os.getenv("WHISPER_MAX_CONCURRENCY", "4"))
+    AGENT_MAX_CONCURRENCY: int = int(os.getenv("AGENT_MAX_CONCURRENCY", "8"))
+    FAIR_QUEUE_WEIGHTS: str = os.getenv("FAIR_QUEUE_WEIGHTS", "")  # e.g. "42:2,7:0.5", default weight 1
+    
+    # Asynchronous transcription jobs (POST /voice/jobs, python -m app.transcription_worker)
+    TRANSCRIPTION_JOB_TIMEOUT_SECONDS: float = float(os.getenv("TRANSCRIPTION_JOB_TIMEOUT_SECONDS", "600"))
+    TRANSCRIPTION_JOB_LEASE_SECONDS: int = int(os.getenv("TRANSCRIPTION_JOB_LEASE_SECONDS", "900"))
+    TRANSCRIPTION_JOB_MAX_ATTEMPTS: int = int(os.getenv("TRANSCRIPTION_JOB_MAX_ATTEMPTS", "3"))
+    TRANSCRIPTION_WORKER_CONCURRENCY: int = int(os.getenv("TRANSCRIPTION_WORKER_CONCURRENCY", "2"))
+    TRANSCRIPTION_WORKER_POLL_SECONDS: float = float(os.getenv("TRANSCRIPTION_WORKER_POLL_SECONDS", "1"))
+    TRANSCRIPTION_JOB_MAX_WAIT_SECONDS: int = int(os.getenv("TRANSCRIPTION_JOB_MAX_WAIT_SECONDS", "60"))
+    
+    # Keep raw voice uploads on disk, content addressed, for later re-transcription (empty disables)
+    AUDIO_STORE_DIR: str = os.getenv("AUDIO_STORE_DIR", "")
+    
+    # Two-pass transcription: a fast draft (realtime decoding, on WHISPER_DRAFT_SERVICE_URL when
+    # set, e.g. a Whisper service running a smaller model) is used at once, then the full
+    # /transcribe pass refines it in the background and replaces the text if it changed enough
+    TRANSCRIPTION_TWO_PASS: bool = os.getenv("TRANSCRIPTION_TWO_PASS", "false").lower() == "true"
+    WHISPER_DRAFT_SERVICE_URL: str = os.getenv("WHISPER_DRAFT_SERVICE_URL", "")
+    WHISPER_REFINE_MAX_CONCURRENCY: int = int(os.getenv("WHISPER_REFINE_MAX_CONCURRENCY", "2"))
+    TRANSCRIPTION_REFINE_TIMEOUT_SECONDS: float = float(os.getenv("TRANSCRIPTION_REFINE_TIMEOUT_SECONDS", "120"))
+    # Fraction of words that must differ for the refined text to replace the draft (0 = any word)
+    TRANSCRIPTION_REFINE_MIN_CHANGE: float = float(os.getenv("TRANSCRIPTION_REFINE_MIN_CHANGE", "0"))
 
 settings = Settings()
\ No newline at end of file
@@ -1,11 +1,15 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, event, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.exc import SQLAlchemyError, TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
 import logging
 import time
 import psycopg2
 import sys
+import threading
+from typing import Any, Dict, List, Optional
+from fastapi import Request
 
 from app.config import settings
 
@@ -24,8 +28,8 @@ def ensure_database_exists():
     try:
         # Connect to the default database
         conn = psycopg2.connect(
-            host=settings.POSTGRES_SERVER,
-            port=settings.POSTGRES_PORT,
+            host=settings.DB_DIRECT_HOST,
+            port=settings.DB_DIRECT_PORT,
             user=settings.POSTGRES_USER,
             password=settings.POSTGRES_PASSWORD,
             database="postgres"  # Connect to default postgres DB first
@@ -51,21 +55,109 @@ def ensure_database_exists():
         logger.error(f"Failed to ensure database exists: {e}")
         return False
 
+# ===== CONNECTION POOL =====
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that counts checkouts, how long they waited and how many gave up"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_lock = threading.Lock()
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.invalidations = 0
+        self.connects = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    def _do_get(self):
+        with self._metrics_lock:
+            self.waiting += 1
+        start_time = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.count("timeouts")
+            raise
+        finally:
+            waited = time.perf_counter() - start_time
+            with self._metrics_lock:
+                self.waiting -= 1
+                self.checkouts += 1
+                self.wait_total += waited
+                self.wait_max = max(self.wait_max, waited)
+            if waited >= settings.DB_POOL_SLOW_CHECKOUT_SECONDS:
+                logger.warning(f"Waited {waited:.2f}s for a database connection ({self.status()})")
+
+    def count(self, metric: str):
+        with self._metrics_lock:
+            setattr(self, metric, getattr(self, metric) + 1)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._metrics_lock:
+            return {
+                "size": self.size(),
+                "maxOverflow": self._max_overflow,
+                "inUse": self.checkedout(),
+                "idle": self.checkedin(),
+                "overflow": max(0, self.overflow()),
+                "waiting": self.waiting,
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "invalidations": self.invalidations,
+                "connects": self.connects,
+                "avgWaitMs": round(1000 * self.wait_total / self.checkouts, 3) if self.checkouts else 0.0,
+                "maxWaitMs": round(1000 * self.wait_max, 3)
+            }
+
 # Create SQLAlchemy engine with connection pool settings
-engine = create_engine(
-    settings.DATABASE_URI,
-    pool_pre_ping=True,  # Enable connection health checks
-    pool_recycle=3600,   # Recycle connections after 1 hour
-    pool_size=5,         # Connection pool size
-    max_overflow=10,     # Maximum overflow connections
-    echo=False           # Set to True for SQL query logging
-)
-
-# Create session factory
+def _create_engine(uri):
+    engine = create_engine(
+        uri,
+        poolclass=InstrumentedQueuePool,
+        # Behind PgBouncer the round trip would only test the client side connection
+        pool_pre_ping=settings.DB_POOL_PRE_PING and not settings.DB_PGBOUNCER,
+        pool_recycle=settings.DB_POOL_RECYCLE_SECONDS,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT_SECONDS,
+        echo=False           # Set to True for SQL query logging
+    )
+
+    def count_invalidation(dbapi_connection, connection_record, exception):
+        engine.pool.count("invalidations")
+        logger.warning(f"Database connection invalidated: {exception}")
+
+    event.listen(engine, "connect", lambda dbapi_connection, connection_record: engine.pool.count("connects"))
+    event.listen(engine, "invalidate", count_invalidation)
+    event.listen(engine, "soft_invalidate", count_invalidation)
+    return engine
+
+engine = _create_engine(settings.DATABASE_URI)
+
+# Optional read replica engine for read-only endpoints
+read_engine = _create_engine(settings.READ_REPLICA_URI) if settings.READ_REPLICA_URI else None
+
+def pool_stats() -> Dict[str, Any]:
+    stats = {"primary": engine.pool.stats()}
+    if read_engine is not None:
+        stats["replica"] = read_engine.pool.stats()
+    return stats
+
+def check_pool_capacity(bind):
+    """Fast-fail before queueing behind DB_POOL_MAX_WAITING other checkouts"""
+    if settings.DB_POOL_MAX_WAITING and bind.pool.waiting >= settings.DB_POOL_MAX_WAITING:
+        bind.pool.count("timeouts")
+        raise PoolTimeoutError(f"{bind.pool.waiting} requests already waiting for a database connection")
+
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine) if read_engine else None
 
 # Dependency to get DB session
 def get_db():
+    check_pool_capacity(engine)
     db = SessionLocal()
     try:
         yield db
@@ -76,6 +168,101 @@ def get_db():
     finally:
         db.close()
 
+# ===== READ REPLICA ROUTING =====
+
+# Last write time per "user:<id>" / "session:<id>" key, for read-your-writes
+_recent_writes: Dict[str, float] = {}
+_recent_writes_lock = threading.Lock()
+
+# Cached replica lag: (checked_at, lag_seconds or None when unreachable)
+_replica_lag = (0.0, None)
+_replica_lag_lock = threading.Lock()
+
+def _write_keys(user_id=None, session_id=None) -> List[str]:
+    keys = []
+    if user_id is not None:
+        keys.append(f"user:{user_id}")
+    if session_id:
+        keys.append(f"session:{session_id}")
+    return keys
+
+def record_write(user_id=None, session_id=None):
+    """Remember a write so the writer's next reads see it on the primary"""
+    if read_engine is None:
+        return
+    now = time.monotonic()
+    with _recent_writes_lock:
+        for key in _write_keys(user_id, session_id):
+            _recent_writes[key] = now
+        # Forget entries that have left the stickiness window
+        if len(_recent_writes) > 10000:
+            cutoff = now - settings.READ_YOUR_WRITES_SECONDS
+            for key in [key for key, written_at in _recent_writes.items() if written_at < cutoff]:
+                del _recent_writes[key]
+
+def _recently_written(keys: List[str]) -> bool:
+    cutoff = time.monotonic() - settings.READ_YOUR_WRITES_SECONDS
+    with _recent_writes_lock:
+        return any(_recent_writes.get(key, 0.0) >= cutoff for key in keys)
+
+def replica_lag_seconds() -> Optional[float]:
+    """Replication lag of the read replica, refreshed at most every few seconds"""
+    global _replica_lag
+    checked_at, lag = _replica_lag
+    if time.monotonic() - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL_SECONDS:
+        return lag
+
+    with _replica_lag_lock:
+        checked_at, lag = _replica_lag
+        if time.monotonic() - checked_at < settings.REPLICA_LAG_CHECK_INTERVAL_SECONDS:
+            return lag
+        try:
+            with read_engine.connect() as connection:
+                # A replica that has replayed everything it received is caught up
+                # even if the primary has been idle for a while
+                lag = connection.execute(text("""
+                    SELECT CASE
+                        WHEN NOT pg_is_in_recovery() THEN 0
+                        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                    END
+                """)).scalar()
+                lag = float(lag)
+        except SQLAlchemyError as e:
+            logger.warning(f"Read replica unavailable, using primary: {e}")
+            lag = None
+        _replica_lag = (time.monotonic(), lag)
+        return lag
+
+def _use_replica(request: Request) -> bool:
+    if read_engine is None:
+        return False
+    if request.headers.get("X-Read-Consistency", "").lower() == "strong":
+        return False
+
+    params = {**request.query_params, **request.path_params}
+    keys = _write_keys(params.get("userId"), params.get("sessionId"))
+    if keys and _recently_written(keys):
+        return False
+
+    lag = replica_lag_seconds()
+    return lag is not None and lag <= settings.REPLICA_MAX_LAG_SECONDS
+
+# Dependency to get a DB session for read-only endpoints: the replica when it
+# is configured and fresh enough, otherwise the primary
+def get_read_db(request: Request):
+    use_replica = _use_replica(request)
+    check_pool_capacity(read_engine if use_replica else engine)
+    db = ReadSessionLocal() if use_replica else SessionLocal()
+    try:
+        yield db
+    except SQLAlchemyError as e:
+        logger.error(f"Database error: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
 def test_db_connection():
     """Test database connection with retry logic"""
     max_retries = 5
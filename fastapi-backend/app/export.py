@@ -0,0 +1,411 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import datetime
+from typing import IO, Dict, Iterable, Iterator, List, Optional
+import argparse
+import csv
+import io
+import logging
+import sys
+
+import orjson
+
+from app.database import SessionLocal, ReadSessionLocal
+from app.config import settings
+from app.partitions import create_month_partition
+from app.services.analytics_service import ERROR_RESPONSE
+from app.services.search_service import SOURCES
+
+logger = logging.getLogger(__name__)
+
+# Export and import share one row shape for chats and voice, tagged with the
+# source table; the per-table column names come from search_service.SOURCES.
+# The agent metadata columns are named alike in both tables.
+METADATA_COLUMNS = ("agent_type", "emotional_state", "confidence_score", "requires_immediate_attention", "recommendations")
+EXPORT_COLUMNS = ("source", "id", "user_id", "session_id", "user_text", "agent_text", "created_at", "updated_at",
+                  *METADATA_COLUMNS)
+EXPORT_FORMATS = {
+    "ndjson": "application/x-ndjson",
+    "csv": "text/csv"
+}
+
+
+def _export_query(sources: List[str], filters: List[str]) -> str:
+    where = " AND ".join(["t.user_id = :user_id"] + filters)
+    selects = [
+        f"""
+        SELECT '{source}' AS source,
+               t.{columns['id']} AS id,
+               t.user_id,
+               t.session_id,
+               t.{columns['user_text']} AS user_text,
+               t.{columns['agent_text']} AS agent_text,
+               t.created_at,
+               t.updated_at,
+               {', '.join(f't.{column}' for column in METADATA_COLUMNS)}
+        FROM {columns['table']} t
+        WHERE {where}
+        """
+        for source, columns in ((source, SOURCES[source]) for source in sources)
+    ]
+    # Both branches are index ordered on (user_id, created_at) so Postgres
+    # merges them without sorting the whole history
+    return " UNION ALL ".join(selects) + " ORDER BY created_at, source, id"
+
+
+def export_batches(
+    db: Session,
+    user_id: int,
+    sources: Optional[List[str]] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    batch_size: Optional[int] = None
+) -> Iterator[List[Dict]]:
+    """
+    All of a user's chat and voice rows, oldest first, in batches
+
+    Rows are read through a server-side cursor so memory stays bounded by
+    batch_size however long the history is.
+    """
+    sources = [source for source in (sources or list(SOURCES)) if source in SOURCES]
+    if not sources:
+        return
+
+    params = {"user_id": user_id}
+    filters = []
+    if since:
+        filters.append("t.created_at >= :since")
+        params["since"] = since
+    if until:
+        filters.append("t.created_at < :until")
+        params["until"] = until
+
+    batch_size = batch_size or settings.EXPORT_BATCH_SIZE
+    result = db.execute(
+        text(_export_query(sources, filters)),
+        params,
+        execution_options={"stream_results": True, "yield_per": batch_size}
+    )
+    for batch in result.mappings().partitions():
+        yield [dict(row) for row in batch]
+
+
+def _flat(value):
+    """recommendations as JSON text, for the formats without nested values"""
+    if isinstance(value, (list, dict)):
+        return orjson.dumps(value).decode("utf-8")
+    return value
+
+
+def iter_ndjson(batches: Iterable[List[Dict]]) -> Iterator[bytes]:
+    """One JSON object per line, one chunk per batch"""
+    for batch in batches:
+        yield b"".join(orjson.dumps(row) + b"\n" for row in batch)
+
+
+def iter_csv(batches: Iterable[List[Dict]]) -> Iterator[bytes]:
+    """
+    CSV with a header row, one chunk per batch
+
+    CSV cannot tell a NULL agent_text from an empty one; use NDJSON when that
+    difference matters.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for batch in batches:
+        for row in batch:
+            writer.writerow([_flat(row[column]) for column in EXPORT_COLUMNS])
+        yield buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+    # Header only, for a user without history
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def stream_export(user_id: int, format: str = "ndjson", **filters) -> Iterator[bytes]:
+    """
+    Encoded export with its own session, for StreamingResponse
+
+    The request's dependency session is closed before a streamed body is
+    sent, so the generator opens (and always closes) a session of its own,
+    on the read replica when one is configured.
+    """
+    db = ReadSessionLocal() if ReadSessionLocal else SessionLocal()
+    try:
+        batches = export_batches(db, user_id, **filters)
+        encode = iter_csv if format == "csv" else iter_ndjson
+        yield from encode(batches)
+    finally:
+        db.close()
+
+
+class _ChunkReader:
+    """Minimal file object over an iterator of bytes, as COPY FROM STDIN wants"""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _copy_text_value(value) -> str:
+    if value is None:
+        return "\\N"
+    return (str(_flat(value)).replace("\\", "\\\\").replace("\t", "\\t")
+            .replace("\n", "\\n").replace("\r", "\\r"))
+
+
+def _ndjson_as_copy_text(lines: Iterable[bytes], batch_size: int) -> Iterator[bytes]:
+    """Re-encode NDJSON export lines as COPY text format rows"""
+    rows = []
+    for line in lines:
+        if not line.strip():
+            continue
+        record = orjson.loads(line)
+        rows.append("\t".join(_copy_text_value(record.get(column)) for column in EXPORT_COLUMNS))
+        if len(rows) >= batch_size:
+            yield ("\n".join(rows) + "\n").encode("utf-8")
+            rows = []
+    if rows:
+        yield ("\n".join(rows) + "\n").encode("utf-8")
+
+
+def import_file(db: Session, source_file: IO[bytes], format: str = "ndjson", keep_ids: bool = False) -> Dict[str, int]:
+    """
+    Bulk load an export file into chats and voice
+
+    The file is streamed into a temporary staging table with COPY, the
+    partitions its months need are created, and each table is filled with a
+    single INSERT ... SELECT. With keep_ids the exported ids are kept (rows
+    already present are skipped) and the id sequences are moved past them;
+    otherwise new ids are assigned. Exported updated_at values are kept (the
+    stamping trigger only fills in missing ones), so imported history does
+    not reappear in change feeds. Referenced users must already exist.
+    The sessions index and the daily analytics rollups are updated from the
+    rows actually inserted, in the same transaction.
+    """
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.execute("""
+            CREATE TEMP TABLE import_staging (
+                source TEXT NOT NULL,
+                id INTEGER,
+                user_id INTEGER,
+                session_id TEXT,
+                user_text TEXT,
+                agent_text TEXT,
+                created_at TIMESTAMP,
+                updated_at TIMESTAMP,
+                agent_type TEXT,
+                emotional_state TEXT,
+                confidence_score INTEGER,
+                requires_immediate_attention BOOLEAN,
+                recommendations JSONB
+            ) ON COMMIT DROP
+        """)
+        columns = ", ".join(EXPORT_COLUMNS)
+        if format == "csv":
+            cursor.copy_expert(
+                f"COPY import_staging ({columns}) FROM STDIN "
+                f"WITH (FORMAT csv, HEADER true, FORCE_NOT_NULL (user_text, session_id))",
+                source_file
+            )
+        else:
+            reader = _ChunkReader(_ndjson_as_copy_text(source_file, settings.EXPORT_BATCH_SIZE))
+            cursor.copy_expert(f"COPY import_staging ({columns}) FROM STDIN", reader)
+        logger.info(f"Staged {cursor.rowcount} rows for import")
+    finally:
+        cursor.close()
+
+    # Old months may predate the partitions maintenance keeps around
+    months = db.execute(text("""
+        SELECT DISTINCT date_trunc('month', coalesce(created_at, CURRENT_TIMESTAMP))::date
+        FROM import_staging
+    """)).scalars().all()
+    for source, columns in SOURCES.items():
+        for month in months:
+            create_month_partition(db, columns["table"], month)
+
+    # Rows that made it in, so skipped duplicates are not counted as turns
+    db.execute(text("""
+        CREATE TEMP TABLE import_inserted (
+            modality TEXT NOT NULL,
+            user_id INTEGER,
+            session_id TEXT,
+            user_text TEXT,
+            created_at TIMESTAMP,
+            answered BOOLEAN NOT NULL,
+            emotional_state TEXT,
+            confidence_score INTEGER,
+            requires_immediate_attention BOOLEAN
+        ) ON COMMIT DROP
+    """))
+
+    counts = {}
+    for source, columns in SOURCES.items():
+        id_column = columns["id"]
+        target = [columns["user_text"], columns["agent_text"], "user_id", "session_id", "created_at", "updated_at",
+                  *METADATA_COLUMNS]
+        values = ["user_text", "agent_text", "user_id", "session_id",
+                  "coalesce(created_at, CURRENT_TIMESTAMP)", "updated_at", *METADATA_COLUMNS]
+        if keep_ids:
+            target.insert(0, id_column)
+            values.insert(0, "id")
+
+        result = db.execute(text(f"""
+            WITH inserted AS (
+                INSERT INTO {columns['table']} ({', '.join(target)})
+                SELECT {', '.join(values)} FROM import_staging WHERE source = :source
+                {'ON CONFLICT DO NOTHING' if keep_ids else ''}
+                RETURNING user_id, session_id, {columns['user_text']}, created_at,
+                          coalesce({columns['agent_text']} <> :error_response, false),
+                          emotional_state, confidence_score, requires_immediate_attention
+            )
+            INSERT INTO import_inserted (
+                modality, user_id, session_id, user_text, created_at,
+                answered, emotional_state, confidence_score, requires_immediate_attention
+            )
+            SELECT :source, * FROM inserted
+        """), {"source": source, "error_response": ERROR_RESPONSE})
+        counts[source] = result.rowcount
+
+        if keep_ids:
+            db.execute(text(f"""
+                SELECT setval(
+                    pg_get_serial_sequence('{columns['table']}', '{id_column}'),
+                    greatest((SELECT max({id_column}) FROM {columns['table']}), 1)
+                )
+            """))
+
+    # Same aggregation as the migration 6 backfill, merged into existing sessions
+    db.execute(text("""
+        INSERT INTO sessions (
+            session_id, user_id, first_activity_at, last_activity_at,
+            chat_turns, voice_turns, last_message_preview, last_modality
+        )
+        SELECT session_id,
+               (array_agg(user_id ORDER BY created_at DESC))[1],
+               min(created_at),
+               max(created_at),
+               count(*) FILTER (WHERE modality = 'chat'),
+               count(*) FILTER (WHERE modality = 'voice'),
+               (array_agg(left(user_text, 200) ORDER BY created_at DESC))[1],
+               (array_agg(modality ORDER BY created_at DESC))[1]
+        FROM import_inserted
+        GROUP BY session_id
+        ON CONFLICT (session_id) DO UPDATE SET
+            user_id = coalesce(sessions.user_id, EXCLUDED.user_id),
+            first_activity_at = least(sessions.first_activity_at, EXCLUDED.first_activity_at),
+            last_activity_at = greatest(sessions.last_activity_at, EXCLUDED.last_activity_at),
+            chat_turns = sessions.chat_turns + EXCLUDED.chat_turns,
+            voice_turns = sessions.voice_turns + EXCLUDED.voice_turns,
+            last_message_preview = CASE WHEN EXCLUDED.last_activity_at >= sessions.last_activity_at
+                                        THEN EXCLUDED.last_message_preview ELSE sessions.last_message_preview END,
+            last_modality = CASE WHEN EXCLUDED.last_activity_at >= sessions.last_activity_at
+                                 THEN EXCLUDED.last_modality ELSE sessions.last_modality END
+    """))
+
+    # Answered turns into the daily rollups, counted as record_turn counts them
+    db.execute(text("""
+        INSERT INTO user_daily_stats
+            (user_id, day, chat_turns, voice_turns, attention_flags, confidence_total, confidence_count)
+        SELECT user_id,
+               created_at::date,
+               count(*) FILTER (WHERE modality = 'chat'),
+               count(*) FILTER (WHERE modality = 'voice'),
+               count(*) FILTER (WHERE requires_immediate_attention),
+               coalesce(sum(confidence_score), 0),
+               count(confidence_score)
+        FROM import_inserted
+        WHERE answered AND user_id IS NOT NULL
+        GROUP BY user_id, created_at::date
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            chat_turns = user_daily_stats.chat_turns + EXCLUDED.chat_turns,
+            voice_turns = user_daily_stats.voice_turns + EXCLUDED.voice_turns,
+            attention_flags = user_daily_stats.attention_flags + EXCLUDED.attention_flags,
+            confidence_total = user_daily_stats.confidence_total + EXCLUDED.confidence_total,
+            confidence_count = user_daily_stats.confidence_count + EXCLUDED.confidence_count
+    """))
+    db.execute(text("""
+        INSERT INTO user_daily_emotions (user_id, day, emotional_state, turns)
+        SELECT user_id, created_at::date, emotional_state, count(*)
+        FROM import_inserted
+        WHERE answered AND user_id IS NOT NULL AND emotional_state <> ''
+        GROUP BY user_id, created_at::date, emotional_state
+        ON CONFLICT (user_id, day, emotional_state) DO UPDATE SET
+            turns = user_daily_emotions.turns + EXCLUDED.turns
+    """))
+
+    logger.info(f"Imported {counts}")
+    return counts
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Export or bulk import chat and voice history")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("export", help="Write a user's history to stdout or a file")
+    export_parser.add_argument("user_id", type=int)
+    export_parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="ndjson")
+    export_parser.add_argument("--types", default="chat,voice")
+    export_parser.add_argument("--since", type=datetime.fromisoformat)
+    export_parser.add_argument("--until", type=datetime.fromisoformat)
+    export_parser.add_argument("--output", help="File to write instead of stdout")
+
+    import_parser = commands.add_parser("import", help="Load an export file with COPY")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default=None,
+                               help="Defaults to the file extension")
+    import_parser.add_argument("--keep-ids", action="store_true", help="Keep exported ids instead of assigning new ones")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        chunks = stream_export(
+            args.user_id, args.format,
+            sources=[source.strip() for source in args.types.split(",")],
+            since=args.since,
+            until=args.until
+        )
+        output = open(args.output, "wb") if args.output else sys.stdout.buffer
+        try:
+            for chunk in chunks:
+                output.write(chunk)
+        finally:
+            if args.output:
+                output.close()
+        return
+
+    format = args.format or ("csv" if args.path.endswith(".csv") else "ndjson")
+    db = SessionLocal()
+    try:
+        with open(args.path, "rb") as source_file:
+            import_file(db, source_file, format, keep_ids=args.keep_ids)
+        db.commit()
+    except SQLAlchemyError as e:
+        db.rollback()
+        logger.error(f"Import failed: {e}")
+        sys.exit(1)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    # python -m app.export export 42 --format csv > user-42.csv
+    # python -m app.export import user-42.csv --keep-ids
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,97 @@
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import heapq
+import itertools
+import logging
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """FAIR_QUEUE_WEIGHTS format: "userId:weight,userId:weight" """
+    weights = {}
+    for item in value.split(","):
+        key, _, weight = item.partition(":")
+        if key.strip() and weight.strip():
+            weights[key.strip()] = float(weight)
+    return weights
+
+
+class FairQueue:
+    """
+    Weighted fair queue in front of an upstream with limited concurrency
+
+    Start-time fair queuing: each waiting call gets a virtual start tag of
+    max(virtual clock, the previous finish tag of its user), and the next
+    free slot goes to the smallest tag. A user who queues many calls only
+    pushes their own tags further out, so other users keep getting slots at
+    their weighted share however deep the backlog is.
+    """
+
+    def __init__(self, name: str, concurrency: int, weights: Optional[Dict[str, float]] = None):
+        self.name = name
+        self.concurrency = concurrency
+        self.weights = weights or {}
+        self.in_flight = 0
+        self._virtual_time = 0.0
+        self._finish_tags: Dict[str, float] = {}
+        self._waiting: List[Tuple[float, int, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    def _tag(self, key: str) -> float:
+        start = max(self._virtual_time, self._finish_tags.get(key, 0.0))
+        self._finish_tags[key] = start + 1.0 / self.weights.get(key, 1.0)
+        return start
+
+    def _dispatch(self):
+        while self._waiting and self.in_flight < self.concurrency:
+            start, _, waiter = heapq.heappop(self._waiting)
+            if waiter.done():
+                # Cancelled while waiting
+                continue
+            self._virtual_time = start
+            self.in_flight += 1
+            waiter.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, user_key=None):
+        """Hold one upstream slot for the duration of the block"""
+        if self.concurrency <= 0:
+            yield
+            return
+
+        key = str(user_key) if user_key is not None else "anonymous"
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (self._tag(key), next(self._order), waiter))
+        self._dispatch()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot was granted just as the caller gave up
+                self.in_flight -= 1
+                self._dispatch()
+            raise
+
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+            if not self._waiting and self.in_flight == 0:
+                # Idle: forget finish tags so the dict does not grow forever
+                self._finish_tags.clear()
+            self._dispatch()
+
+    def stats(self) -> Dict[str, int]:
+        return {"inFlight": self.in_flight, "waiting": len(self._waiting), "concurrency": self.concurrency}
+
+
+# One queue per upstream service, shared by all requests of this worker
+_weights = parse_weights(settings.FAIR_QUEUE_WEIGHTS)
+whisper_queue = FairQueue("whisper", settings.WHISPER_MAX_CONCURRENCY, _weights)
+agent_queue = FairQueue("agents", settings.AGENT_MAX_CONCURRENCY, _weights)
+# Background refinement passes queue separately so they never delay drafts
+whisper_refine_queue = FairQueue("whisper-refine", settings.WHISPER_REFINE_MAX_CONCURRENCY, _weights)
@@ -0,0 +1,203 @@
+from fastapi import Request, Response
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import threading
+import zlib
+
+import orjson
+
+from app.config import settings
+from app.database import record_write
+from app import notifications
+
+logger = logging.getLogger(__name__)
+
+# Conditional GET for the history endpoints. The validator of a session's
+# history is read from the database (row count and newest updated_at), so
+# every worker computes the same ETag and an unchanged poll gets a 304 from
+# one small aggregate instead of the whole history. Writes are still
+# announced after commit, locally and to other workers through NOTIFY on
+# this channel, for listeners such as the session WebSockets.
+NOTIFY_CHANNEL = "history_versions"
+
+# Tables a session history is served from
+HISTORY_TABLES = ("chats", "voice")
+
+
+class ResponseCache:
+    """Small LRU of rendered history bodies, valid for one history validator"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[str, bytes]]" = OrderedDict()
+
+    def get(self, kind: str, session_id: str, variant: str, version: str) -> Optional[bytes]:
+        if self.capacity <= 0:
+            return None
+        key = (kind, session_id, variant)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, kind: str, session_id: str, variant: str, version: str, body: bytes):
+        if self.capacity <= 0:
+            return
+        key = (kind, session_id, variant)
+        with self._lock:
+            self._entries[key] = (version, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+response_cache = ResponseCache(settings.HISTORY_CACHE_SIZE)
+
+# Called with (kind, session_id) on every change, local or from another
+# worker, from whichever thread saw it; e.g. open WebSockets of the session
+_change_listeners: List[Callable[[str, str], None]] = []
+
+
+def add_change_listener(listener: Callable[[str, str], None]):
+    _change_listeners.append(listener)
+
+
+def _changed(kind: str, session_id: str):
+    for listener in _change_listeners:
+        try:
+            listener(kind, session_id)
+        except Exception as e:
+            logger.error(f"History change listener error: {e}")
+
+
+def mark_changed(db: Session, kind: str, session_id: str):
+    """
+    Record that a session's history changes in the current transaction
+
+    Call before commit: the NOTIFY is delivered with the commit and local
+    listeners are called once the commit has succeeded.
+    """
+    db.info.setdefault("history_changes", set()).add((kind, session_id))
+    if settings.HISTORY_VERSION_NOTIFY:
+        db.execute(text("SELECT pg_notify(:channel, :payload)"),
+                   {"channel": NOTIFY_CHANNEL, "payload": f"{kind}:{session_id}"})
+
+
+@event.listens_for(Session, "after_commit")
+def _announce_after_commit(session):
+    for kind, session_id in session.info.pop("history_changes", ()):
+        _changed(kind, session_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop("history_changes", None)
+
+
+def _validator(db: Session, kind: str, session_id: str) -> Tuple[str, Optional[datetime]]:
+    """
+    (version, last_modified) of a session's history, the same in every worker
+
+    Rows are only ever added, updated (which moves updated_at) or dropped
+    with their partition (which lowers the count), so the pair changes with
+    every change to the history. updated_at is a timestamp without time
+    zone written in the database session's time zone; it is converted in
+    SQL so Last-Modified is a real UTC instant.
+    """
+    if kind not in HISTORY_TABLES:
+        raise ValueError(f"Unknown history table {kind}")
+    count, newest, last_modified = db.execute(text(f"""
+        SELECT count(*),
+               to_char(max(updated_at), 'YYYYMMDDHH24MISSUS'),
+               max(updated_at) AT TIME ZONE current_setting('TimeZone')
+        FROM {kind}
+        WHERE session_id = :session_id
+    """), {"session_id": session_id}).one()
+    if last_modified is None:
+        return f"{count}-0", None
+    return f"{count}-{newest}", last_modified.astimezone(timezone.utc)
+
+
+def _etag(kind: str, version: str, variant: str) -> str:
+    # Sparse fieldsets are separate representations of the same version
+    if variant:
+        return f'W/"{kind}-{version}-{zlib.crc32(variant.encode()):08x}"'
+    return f'W/"{kind}-{version}"'
+
+
+def _not_modified(request: Request, etag: str, last_modified: Optional[datetime]) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def _headers(etag: str, last_modified: Optional[datetime]) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+    return headers
+
+
+def conditional_response(
+    request: Request,
+    db: Session,
+    kind: str,
+    session_id: str,
+    load: Callable[[], Any],
+    variant: str = ""
+) -> Response:
+    """
+    Serve a session history response with ETag/Last-Modified support
+
+    load() queries the database and returns the payload; it is only called
+    when neither a 304 nor a cached body can be returned. The payload is
+    encoded with orjson, so it must be plain dicts/lists. variant tells
+    apart representations of the same data, e.g. sparse fieldsets.
+    """
+    version, last_modified = _validator(db, kind, session_id)
+    etag = _etag(kind, version, variant)
+
+    if _not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=_headers(etag, last_modified))
+
+    body = response_cache.get(kind, session_id, variant, version)
+    if body is None:
+        body = orjson.dumps(load())
+        response_cache.put(kind, session_id, variant, version, body)
+
+    return Response(content=body, media_type="application/json", headers=_headers(etag, last_modified))
+
+
+def _handle_notification(payload: str):
+    kind, _, session_id = payload.partition(":")
+    _changed(kind, session_id)
+    # Keep this session's reads on the primary until replicas have the write
+    record_write(session_id=session_id)
+
+
+def subscribe():
+    """Follow history changes published by other workers, once notifications.start_listener() runs"""
+    if not settings.HISTORY_VERSION_NOTIFY:
+        return
+    notifications.subscribe(NOTIFY_CHANNEL, _handle_notification)
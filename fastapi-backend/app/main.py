@@ -1,14 +1,22 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Request, Body
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, BackgroundTasks, Request, Body, Header, Query, WebSocket
+from fastapi.responses import ORJSONResponse, StreamingResponse, PlainTextResponse
 from sqlalchemy.orm import Session
+from pydantic import ValidationError
 import logging
+import os
 import uuid
 import json
+import asyncio
 import httpx  # Add this missing import
+from datetime import date, datetime, timedelta
 from typing import Optional, List, Dict, Any
 
-from app.database import get_db
+from app.database import get_db, get_read_db, pool_stats, PoolTimeoutError
 from app.migrations import apply_migrations
+from app import partitions, history_cache, export, notifications, session_socket, profiler
+from app.fair_queue import whisper_queue, agent_queue, whisper_refine_queue
+from app.rate_limit import RateLimitMiddleware
+from app.compression import CompressionMiddleware
 from app.config import settings
 
 # Import models
@@ -19,11 +27,13 @@ from app.schemas import (
     UserCreate, UserResponse,
     ChatRequest, ChatResponse, ChatHistoryResponse, 
     MessageSaveRequest, MessageResponseUpdate,
-    VoiceTranscribeResponse, VoiceChatResponse, VoiceHistoryResponse
+    MessageBatchItem, MessageBatchRequest, MessageBatchResult, MessageBatchResponse,
+    VoiceTranscribeResponse, VoiceChatResponse, VoiceHistoryResponse,
+    SearchResponse
 )
 
 # Import services
-from app.services import user_service, chat_service, voice_service
+from app.services import user_service, chat_service, voice_service, search_service, timeline_service, analytics_service, session_service, transcription_job_service, changes_service
 
 # Configure logging
 logging.basicConfig(
@@ -32,7 +42,50 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="MindBridge FastAPI Backend")
+# orjson for every response; history endpoints also skip Pydantic and return
+# ORJSONResponse directly so rows go from the cursor to bytes in one step
+app = FastAPI(title="MindBridge FastAPI Backend", default_response_class=ORJSONResponse)
+
+# Per-user token bucket and concurrency cap on /chat and /voice/*
+app.add_middleware(RateLimitMiddleware)
+# gzip/brotli on JSON and export responses, negotiated with Accept-Encoding
+app.add_middleware(CompressionMiddleware)
+# X-Profile: 1 with the admin token samples one request (outermost, so it covers the whole stack)
+app.add_middleware(profiler.RequestProfilerMiddleware)
+
+
+# No database connection within DB_POOL_TIMEOUT_SECONDS: shed the request
+# rather than let it queue, so clients back off while the pool drains
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    logger.warning(f"Database pool exhausted on {request.url.path}: {exc}")
+    return ORJSONResponse(
+        status_code=503,
+        content={"error": "Database busy, please retry", "success": False},
+        headers={"Retry-After": "1"}
+    )
+
+
+def history_window_start() -> Optional[datetime]:
+    """Lower created_at bound for user history when HISTORY_WINDOW_DAYS is set"""
+    if settings.HISTORY_WINDOW_DAYS <= 0:
+        return None
+    return datetime.now() - timedelta(days=settings.HISTORY_WINDOW_DAYS)
+
+
+def parse_fields(fields: Optional[str], allowed: tuple) -> tuple:
+    """Sparse fieldset from a comma separated ?fields= value, all fields when omitted"""
+    if not fields:
+        return allowed
+    requested = tuple(dict.fromkeys(field.strip() for field in fields.split(",") if field.strip()))
+    unknown = [field for field in requested if field not in allowed]
+    if unknown or not requested:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown fields {unknown}; choose from {list(allowed)}"
+        )
+    return requested
+
 
 # Apply database migrations on startup
 @app.on_event("startup")
@@ -59,6 +112,15 @@ async def startup_event():
         import sys
         sys.exit(1)
     
+    # Keep monthly chats/voice partitions created ahead and apply retention
+    asyncio.create_task(partitions.maintenance_loop())
+    
+    # Follow session history changes made by other workers and finished
+    # transcription jobs, over one shared LISTEN connection
+    history_cache.subscribe()
+    transcription_job_service.subscribe()
+    notifications.start_listener()
+    
     logger.info("FastAPI backend startup completed successfully")
 
 
@@ -72,6 +134,13 @@ async def health_check():
         "whisper_service_url": settings.WHISPER_SERVICE_URL,
         "database_host": settings.POSTGRES_SERVER,
         "database_name": settings.POSTGRES_DB,
+        "upstream_queues": {
+            "whisper": whisper_queue.stats(),
+            "agents": agent_queue.stats(),
+            "whisper_refine": whisper_refine_queue.stats()
+        },
+        "db_pool": pool_stats(),
+        "websocket_connections": session_socket.hub.connection_count(),
         "timestamp": "2025-08-19"
     }
 
@@ -124,9 +193,15 @@ async def transcribe_voice(
     sessionId: str = Form(None),
     userId: int = Form(1),
     format: str = Form("wav"),
+    audioEncoding: Optional[str] = Header(None, alias="X-Audio-Encoding"),
+    sampleRate: int = Header(16000, alias="X-Sample-Rate"),
     db: Session = Depends(get_db)
 ):
     try:
+        # Raw PCM uploads may declare their encoding in a header instead of the form
+        if audioEncoding:
+            format = audioEncoding
+        
         # Generate session ID if not provided
         if not sessionId:
             sessionId = str(uuid.uuid4())
@@ -135,18 +210,23 @@ async def transcribe_voice(
         audio_data = await audio.read()
         
         if len(audio_data) == 0:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=400,
                 content={"error": "No audio data provided"}
             )
+        format = voice_service.resolve_format(audio_data, format)
         
         logger.info(f"Processing voice transcription for session: {sessionId}")
         
-        # Send to Whisper service
-        success, result = await voice_service.transcribe_audio(audio_data, format)
+        # Send to Whisper service; in two-pass mode only the fast draft is awaited
+        two_pass = voice_service.two_pass_enabled()
+        if two_pass:
+            success, result = await voice_service.transcribe_draft(audio_data, format, sampleRate, userId)
+        else:
+            success, result = await voice_service.transcribe_audio(audio_data, format, sampleRate, userId)
         
         if not success:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content=VoiceTranscribeResponse(
                     voiceId=0,
@@ -155,7 +235,7 @@ async def transcribe_voice(
                     duration=0.0,
                     success=False,
                     error=result.get("error", "Unknown error")
-                ).dict()
+                ).model_dump()
             )
         
         transcribed_text = result.get("text", "")
@@ -164,20 +244,29 @@ async def transcribe_voice(
         logger.info(f"Transcription successful: {transcribed_text}")
         
         # Save to voice table
-        voice_record = voice_service.save_voice_transcription(db, userId, transcribed_text, sessionId)
+        stored_audio = await voice_service.store_audio(audio_data, format, sampleRate)
+        voice_record = voice_service.save_voice_transcription(
+            db, userId, transcribed_text, sessionId, stored_audio, draft=two_pass
+        )
+        if two_pass:
+            voice_service.start_refinement(voice_record.voice_id, transcribed_text, audio_data, format, sampleRate, userId)
         
         return VoiceTranscribeResponse(
             voiceId=voice_record.voice_id,
             transcribedText=transcribed_text,
             sessionId=sessionId,
             duration=duration,
+            transcriptStatus=voice_record.transcript_status,
+            transcriptVersion=voice_record.transcript_version,
             success=True,
             error=None
         )
         
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Voice transcription error: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content=VoiceTranscribeResponse(
                 voiceId=0,
@@ -186,7 +275,7 @@ async def transcribe_voice(
                 duration=0.0,
                 success=False,
                 error=str(e)
-            ).dict()
+            ).model_dump()
         )
 
 
@@ -197,9 +286,15 @@ async def voice_chat(
     sessionId: str = Form(None),
     userId: int = Form(1),
     format: str = Form("wav"),
+    audioEncoding: Optional[str] = Header(None, alias="X-Audio-Encoding"),
+    sampleRate: int = Header(16000, alias="X-Sample-Rate"),
     db: Session = Depends(get_db)
 ):
     try:
+        # Raw PCM uploads may declare their encoding in a header instead of the form
+        if audioEncoding:
+            format = audioEncoding
+        
         # Generate session ID if not provided
         if not sessionId:
             sessionId = str(uuid.uuid4())
@@ -208,18 +303,23 @@ async def voice_chat(
         audio_data = await audio.read()
         
         if len(audio_data) == 0:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=400,
                 content={"error": "No audio data provided"}
             )
+        format = voice_service.resolve_format(audio_data, format)
         
         logger.info(f"Processing complete voice chat for session: {sessionId}")
         
-        # Step 1: Transcribe audio
-        success, whisper_result = await voice_service.transcribe_audio(audio_data, format)
+        # Step 1: Transcribe audio; in two-pass mode the agent starts from the fast draft
+        two_pass = voice_service.two_pass_enabled()
+        if two_pass:
+            success, whisper_result = await voice_service.transcribe_draft(audio_data, format, sampleRate, userId)
+        else:
+            success, whisper_result = await voice_service.transcribe_audio(audio_data, format, sampleRate, userId)
         
         if not success:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content={"error": whisper_result.get("error", "Failed to transcribe audio")}
             )
@@ -230,7 +330,14 @@ async def voice_chat(
         logger.info(f"Voice transcription: {transcribed_text}")
         
         # Step 2: Save voice transcription
-        voice_record = voice_service.save_voice_transcription(db, userId, transcribed_text, sessionId)
+        stored_audio = await voice_service.store_audio(audio_data, format, sampleRate)
+        voice_record = voice_service.save_voice_transcription(
+            db, userId, transcribed_text, sessionId, stored_audio, draft=two_pass
+        )
+        transcript_status = voice_record.transcript_status
+        if two_pass:
+            # Refines while the agent call below runs
+            voice_service.start_refinement(voice_record.voice_id, transcribed_text, audio_data, format, sampleRate, userId)
         
         # Step 3: Send to AI agents
         agent_success, agent_result = await voice_service.process_with_ai_agent(
@@ -245,9 +352,9 @@ async def voice_chat(
             logger.error(error_msg)
             
             # Save error response
-            voice_service.save_voice_agent_response(db, voice_record.voice_id, "Error: Unable to process request")
+            voice_service.save_voice_agent_response(db, voice_record.voice_id, analytics_service.ERROR_RESPONSE)
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content=VoiceChatResponse(
                     voiceId=voice_record.voice_id,
@@ -261,7 +368,7 @@ async def voice_chat(
                     transcriptionDuration=transcription_duration,
                     success=False,
                     error=error_msg
-                ).dict()
+                ).model_dump()
             )
         
         # Extract AI agent response
@@ -271,7 +378,9 @@ async def voice_chat(
         logger.info(f"AI Agent response: {agent_response_text}")
         
         # Step 4: Save agent response to voice table
-        voice_service.save_voice_agent_response(db, voice_record.voice_id, agent_response_text)
+        voice_service.save_voice_agent_response(
+            db, voice_record.voice_id, agent_response_text, analytics_service.agent_metadata(result_json)
+        )
         
         # Step 5: Create successful response
         return VoiceChatResponse(
@@ -284,13 +393,16 @@ async def voice_chat(
             emotionalState=result_json.get("emotionalState", "neutral"),
             recommendations=result_json.get("recommendations", []),
             transcriptionDuration=transcription_duration,
+            transcriptStatus=transcript_status,
             success=True,
             error=None
         )
         
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Voice chat error: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content=VoiceChatResponse(
                 voiceId=0,
@@ -304,26 +416,90 @@ async def voice_chat(
                 transcriptionDuration=0.0,
                 success=False,
                 error=str(e)
-            ).dict()
+            ).model_dump()
         )
 
 
+# Queue audio for a transcription worker and return at once
+@app.post("/voice/jobs", status_code=202)
+async def create_transcription_job(
+    audio: UploadFile = File(...),
+    sessionId: str = Form(None),
+    userId: int = Form(1),
+    format: str = Form("wav"),
+    audioEncoding: Optional[str] = Header(None, alias="X-Audio-Encoding"),
+    sampleRate: int = Header(16000, alias="X-Sample-Rate"),
+    db: Session = Depends(get_db)
+):
+    if audioEncoding:
+        format = audioEncoding
+    if not sessionId:
+        sessionId = str(uuid.uuid4())
+    
+    audio_data = await audio.read()
+    if len(audio_data) == 0:
+        return ORJSONResponse(
+            status_code=400,
+            content={"error": "No audio data provided"}
+        )
+    format = voice_service.resolve_format(audio_data, format)
+    
+    try:
+        job = transcription_job_service.create_job(db, userId, sessionId, audio_data, format, sampleRate)
+        return ORJSONResponse(status_code=202, content={**job, "success": True, "error": None})
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        logger.error(f"Create transcription job error: {str(e)}")
+        return ORJSONResponse(
+            status_code=500,
+            content={"error": f"Failed to queue transcription: {str(e)}"}
+        )
+
+
+# Job status; with wait=N the request is held until the job finishes or N seconds pass
+@app.get("/voice/jobs/{jobId}")
+async def get_transcription_job(
+    jobId: str,
+    wait: float = Query(0, ge=0),
+    db: Session = Depends(get_db)
+):
+    try:
+        jobId = str(uuid.UUID(jobId))
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Job not found")
+    
+    job = await transcription_job_service.wait_for_job(
+        db, jobId, min(wait, settings.TRANSCRIPTION_JOB_MAX_WAIT_SECONDS)
+    )
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return ORJSONResponse({**job, "success": True, "error": None})
+
+
 # Get voice history for a user
 @app.get("/users/{userId}/voice")
 async def get_user_voice_history(
     userId: int,
     limit: int = 50,
-    db: Session = Depends(get_db)
+    since: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
+    columns = parse_fields(fields, voice_service.VOICE_FIELDS)
     try:
-        voices = voice_service.get_voice_history(db, userId, limit)
-        
-        return VoiceHistoryResponse(
-            voices=voices,
-            totalCount=len(voices),
-            success=True,
-            error=None
+        voices = voice_service.get_voice_rows(
+            db, user_id=userId, limit=limit, since=since or history_window_start(), fields=columns
         )
+        
+        return ORJSONResponse({
+            "voices": voices,
+            "totalCount": len(voices),
+            "success": True,
+            "error": None
+        })
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Get voice history error: {str(e)}")
         return VoiceHistoryResponse(
@@ -338,17 +514,27 @@ async def get_user_voice_history(
 @app.get("/sessions/{sessionId}/voice")
 async def get_session_voice_history(
     sessionId: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
+    columns = parse_fields(fields, voice_service.VOICE_FIELDS)
+
+    def load():
+        voices = voice_service.get_voice_rows(db, session_id=sessionId, fields=columns)
+        return {
+            "voices": voices,
+            "totalCount": len(voices),
+            "success": True,
+            "error": None
+        }
+
     try:
-        voices = voice_service.get_voice_by_session(db, sessionId)
-        
-        return VoiceHistoryResponse(
-            voices=voices,
-            totalCount=len(voices),
-            success=True,
-            error=None
+        return history_cache.conditional_response(
+            request, db, "voice", sessionId, load, variant=",".join(columns) if fields else ""
         )
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Get session voice error: {str(e)}")
         return VoiceHistoryResponse(
@@ -375,9 +561,11 @@ async def create_user(
             name=db_user.name,
             createdAt=str(db_user.created_at) if db_user.created_at else None
         )
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Create user error: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to create user: {str(e)}"}
         )
@@ -385,10 +573,12 @@ async def create_user(
 
 # Get all users
 @app.get("/users")
-async def get_all_users(db: Session = Depends(get_db)):
+async def get_all_users(db: Session = Depends(get_read_db)):
     try:
         users = user_service.get_all_users(db)
         return users
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Get all users error: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -396,13 +586,37 @@ async def get_all_users(db: Session = Depends(get_db)):
 
 # Get user by ID
 @app.get("/users/{userId}")
-async def get_user(userId: int, db: Session = Depends(get_db)):
+async def get_user(userId: int, db: Session = Depends(get_read_db)):
     user = user_service.get_user_by_id(db, userId)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     return user
 
 
+# List a user's sessions, most recently active first, keyset paginated
+@app.get("/users/{userId}/sessions")
+async def get_user_sessions(
+    userId: int,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    try:
+        page = session_service.get_user_sessions(db, userId, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        logger.error(f"Get user sessions error: {str(e)}")
+        return ORJSONResponse(
+            status_code=500,
+            content={"sessions": [], "nextCursor": None, "hasMore": False, "success": False, "error": str(e)}
+        )
+    
+    return ORJSONResponse({**page, "success": True, "error": None})
+
+
 # ===== CHAT ENDPOINTS =====
 
 # Chat endpoint with database integration
@@ -436,9 +650,9 @@ async def chat(
             logger.error(error_msg)
             
             # Save error response
-            chat_service.save_agent_response(db, message_record.message_id, "Error: Unable to process request")
+            chat_service.save_agent_response(db, message_record.message_id, analytics_service.ERROR_RESPONSE)
             
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=500,
                 content=ChatResponse(
                     messageId=message_record.message_id,
@@ -450,7 +664,7 @@ async def chat(
                     recommendations=[],
                     success=False,
                     error=error_msg
-                ).dict()
+                ).model_dump()
             )
         
         # Extract AI agent response
@@ -458,7 +672,9 @@ async def chat(
         agent_response_text = result_json.get("response", "")
         
         # Save agent response to database
-        chat_service.save_agent_response(db, message_record.message_id, agent_response_text)
+        chat_service.save_agent_response(
+            db, message_record.message_id, agent_response_text, analytics_service.agent_metadata(result_json)
+        )
         
         return ChatResponse(
             messageId=message_record.message_id,
@@ -472,9 +688,11 @@ async def chat(
             error=None
         )
         
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Chat endpoint error: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content=ChatResponse(
                 messageId=0,
@@ -486,7 +704,7 @@ async def chat(
                 recommendations=[],
                 success=False,
                 error=str(e)
-            ).dict()
+            ).model_dump()
         )
 
 
@@ -495,17 +713,24 @@ async def chat(
 async def get_user_chat_history(
     userId: int,
     limit: int = 50,
-    db: Session = Depends(get_db)
+    since: Optional[datetime] = None,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
+    columns = parse_fields(fields, chat_service.CHAT_FIELDS)
     try:
-        chats = chat_service.get_chat_history(db, userId, limit)
-        
-        return ChatHistoryResponse(
-            chats=chats,
-            totalCount=len(chats),
-            success=True,
-            error=None
+        chats = chat_service.get_chat_rows(
+            db, user_id=userId, limit=limit, since=since or history_window_start(), fields=columns
         )
+        
+        return ORJSONResponse({
+            "chats": chats,
+            "totalCount": len(chats),
+            "success": True,
+            "error": None
+        })
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Get chat history error: {str(e)}")
         return ChatHistoryResponse(
@@ -520,17 +745,27 @@ async def get_user_chat_history(
 @app.get("/sessions/{sessionId}/chats")
 async def get_session_chats(
     sessionId: str,
-    db: Session = Depends(get_db)
+    request: Request,
+    fields: Optional[str] = None,
+    db: Session = Depends(get_read_db)
 ):
+    columns = parse_fields(fields, chat_service.CHAT_FIELDS)
+
+    def load():
+        chats = chat_service.get_chat_rows(db, session_id=sessionId, fields=columns)
+        return {
+            "chats": chats,
+            "totalCount": len(chats),
+            "success": True,
+            "error": None
+        }
+
     try:
-        chats = chat_service.get_chats_by_session(db, sessionId)
-        
-        return ChatHistoryResponse(
-            chats=chats,
-            totalCount=len(chats),
-            success=True,
-            error=None
+        return history_cache.conditional_response(
+            request, db, "chats", sessionId, load, variant=",".join(columns) if fields else ""
         )
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Get session chats error: {str(e)}")
         return ChatHistoryResponse(
@@ -541,6 +776,61 @@ async def get_session_chats(
         )
 
 
+# Chat and voice of a session merged in chronological order, keyset paginated
+@app.get("/sessions/{sessionId}/timeline")
+async def get_session_timeline(
+    sessionId: str,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_read_db)
+):
+    try:
+        page = timeline_service.get_session_timeline(db, sessionId, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        logger.error(f"Get session timeline error: {str(e)}")
+        return ORJSONResponse(
+            status_code=500,
+            content={"items": [], "nextCursor": None, "hasMore": False, "success": False, "error": str(e)}
+        )
+    
+    return ORJSONResponse({**page, "success": True, "error": None})
+
+
+# Rows of a user inserted or updated since a cursor, for clients keeping a local copy
+@app.get("/users/{userId}/changes")
+async def get_user_changes(
+    userId: int,
+    since: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: Session = Depends(get_db)
+):
+    # Primary only: a lagging replica could let the cursor pass rows it has not replayed yet
+    try:
+        page = changes_service.get_user_changes(db, userId, since, limit, settings.CHANGES_SETTLE_SECONDS)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        logger.error(f"Get user changes error: {str(e)}")
+        return ORJSONResponse(
+            status_code=500,
+            content={"changes": [], "nextCursor": since, "hasMore": False, "success": False, "error": str(e)}
+        )
+    
+    return ORJSONResponse({**page, "success": True, "error": None})
+
+
+# Chat and voice turns over one connection, with pushes of the session's later writes
+@app.websocket("/ws/sessions/{sessionId}")
+async def session_websocket(websocket: WebSocket, sessionId: str, userId: int = 1):
+    await session_socket.serve(websocket, sessionId, userId)
+
+
 # Save user message endpoint (separate)
 @app.post("/messages", status_code=201)
 async def save_message(
@@ -556,14 +846,88 @@ async def save_message(
             "success": True,
             "message": "User message saved successfully"
         }
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Save message error: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to save message: {str(e)}"}
         )
 
 
+# Save many queued turns at once, e.g. from a client coming back online
+@app.post("/messages/batch", status_code=201)
+async def save_message_batch(
+    request: MessageBatchRequest,
+    db: Session = Depends(get_db)
+):
+    if len(request.messages) > settings.MESSAGE_BATCH_MAX_SIZE:
+        return ORJSONResponse(
+            status_code=413,
+            content={"error": f"At most {settings.MESSAGE_BATCH_MAX_SIZE} messages per batch"}
+        )
+    
+    # Validate every item first; invalid ones are reported, the rest are saved
+    results: List[MessageBatchResult] = []
+    items, positions = [], []
+    for index, raw in enumerate(request.messages):
+        try:
+            item = MessageBatchItem.model_validate(raw)
+            if not item.message.strip():
+                raise ValueError("message: must not be empty")
+        except (ValidationError, ValueError) as e:
+            if isinstance(e, ValidationError):
+                error = "; ".join(
+                    f"{'.'.join(map(str, err['loc']))}: {err['msg']}" if err["loc"] else err["msg"] for err in e.errors()
+                )
+            else:
+                error = str(e)
+            results.append(MessageBatchResult(index=index, success=False, error=error))
+            continue
+        
+        session_id = item.sessionId or str(uuid.uuid4())
+        results.append(MessageBatchResult(index=index, sessionId=session_id, success=True))
+        items.append({
+            "user_id": item.userId,
+            "message": item.message,
+            "session_id": session_id,
+            "response": item.response,
+            **analytics_service.agent_metadata(item.model_dump())
+        })
+        positions.append(index)
+    
+    try:
+        message_ids = chat_service.save_message_batch(db, items) if items else []
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        logger.error(f"Save message batch error: {str(e)}")
+        return ORJSONResponse(
+            status_code=500,
+            content={"error": f"Failed to save messages: {str(e)}"}
+        )
+    
+    for index, message_id in zip(positions, message_ids):
+        if message_id is None:
+            results[index].success = False
+            results[index].error = "userId: user not found"
+        else:
+            results[index].messageId = message_id
+    
+    failed = sum(1 for result in results if not result.success)
+    return ORJSONResponse(
+        status_code=400 if results and failed == len(results) else 201,
+        content=MessageBatchResponse(
+            results=results,
+            savedCount=len(results) - failed,
+            failedCount=failed,
+            success=failed == 0,
+            error=None if failed == 0 else f"{failed} of {len(results)} messages were not saved"
+        ).model_dump()
+    )
+
+
 # Save agent response endpoint (separate)
 @app.put("/messages/{messageId}/response")
 async def save_response(
@@ -572,10 +936,12 @@ async def save_response(
     db: Session = Depends(get_db)
 ):
     try:
-        success = chat_service.save_agent_response(db, messageId, request.response)
+        success = chat_service.save_agent_response(
+            db, messageId, request.response, analytics_service.agent_metadata(request.model_dump())
+        )
         
         if not success:
-            return JSONResponse(
+            return ORJSONResponse(
                 status_code=404,
                 content={"error": "Message not found"}
             )
@@ -584,14 +950,183 @@ async def save_response(
             "success": True,
             "message": "Agent response saved successfully"
         }
+    except PoolTimeoutError:
+        raise
     except Exception as e:
         logger.error(f"Save response error: {str(e)}")
-        return JSONResponse(
+        return ORJSONResponse(
             status_code=500,
             content={"error": f"Failed to save response: {str(e)}"}
         )
 
 
+
+# ===== ANALYTICS ENDPOINTS =====
+
+# Daily turn counts, attention flags and emotional states from the rollup tables
+@app.get("/users/{userId}/analytics")
+async def get_user_analytics(
+    userId: int,
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    db: Session = Depends(get_read_db)
+):
+    try:
+        days = analytics_service.get_user_analytics(db, userId, since, until)
+        
+        return ORJSONResponse({
+            "userId": userId,
+            "days": days,
+            "totals": {
+                "chatTurns": sum(day["chatTurns"] for day in days),
+                "voiceTurns": sum(day["voiceTurns"] for day in days),
+                "attentionFlags": sum(day["attentionFlags"] for day in days)
+            },
+            "success": True,
+            "error": None
+        })
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        logger.error(f"Get analytics error: {str(e)}")
+        return ORJSONResponse(
+            status_code=500,
+            content={"userId": userId, "days": [], "totals": {}, "success": False, "error": str(e)}
+        )
+
+
+# ===== EXPORT ENDPOINTS =====
+
+# Stream a user's full chat and voice history as NDJSON or CSV
+@app.get("/users/{userId}/export")
+async def export_user_history(
+    userId: int,
+    format: str = "ndjson",
+    types: str = "chat,voice",
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None
+):
+    if format not in export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format {format}; use ndjson or csv")
+    
+    chunks = export.stream_export(
+        userId, format,
+        sources=[source.strip() for source in types.split(",")],
+        since=since,
+        until=until
+    )
+    return StreamingResponse(
+        chunks,
+        media_type=export.EXPORT_FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="user-{userId}-history.{format}"'}
+    )
+
+
+# ===== SEARCH ENDPOINTS =====
+
+# Full-text search over chat and voice history
+@app.get("/search")
+async def search_history(
+    q: str = Query(..., min_length=1),
+    userId: Optional[int] = None,
+    sessionId: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    types: str = "chat,voice",
+    fuzzy: bool = False,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    db: Session = Depends(get_read_db)
+):
+    try:
+        if fuzzy and not (settings.SEARCH_TRIGRAM_INDEXES and search_service.trigram_available(db)):
+            raise HTTPException(status_code=400, detail="Fuzzy search requires SEARCH_TRIGRAM_INDEXES and pg_trgm")
+        
+        page = search_service.search_history(
+            db, q,
+            user_id=userId,
+            session_id=sessionId,
+            since=since,
+            until=until,
+            sources=[source.strip() for source in types.split(",")],
+            fuzzy=fuzzy,
+            limit=limit,
+            offset=offset
+        )
+        
+        return SearchResponse(
+            results=page["results"],
+            query=q,
+            limit=limit,
+            offset=offset,
+            hasMore=page["hasMore"],
+            success=True,
+            error=None
+        )
+    except HTTPException:
+        raise
+    except PoolTimeoutError:
+        raise
+    except Exception as e:
+        logger.error(f"Search error: {str(e)}")
+        return ORJSONResponse(
+            status_code=500,
+            content=SearchResponse(
+                results=[],
+                query=q,
+                limit=limit,
+                offset=offset,
+                hasMore=False,
+                success=False,
+                error=str(e)
+            ).model_dump()
+        )
+
+
+def require_admin(token: Optional[str] = Header(None, alias="X-Admin-Token")):
+    # Without ADMIN_TOKEN the admin endpoints do not exist
+    if not settings.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not profiler.admin_token_valid(token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+# Sampling profiler of the worker that answers; output is collapsed stacks for flamegraph tools
+@app.get("/admin/profiler", dependencies=[Depends(require_admin)])
+async def profiler_status():
+    return profiler.status()
+
+
+@app.post("/admin/profiler/start", dependencies=[Depends(require_admin)])
+async def start_profiler(
+    intervalMs: Optional[float] = Query(None, gt=0, le=1000),
+    maxSeconds: Optional[float] = Query(None, gt=0),
+    idle: bool = False
+):
+    try:
+        return {"pid": os.getpid(), **profiler.start(intervalMs, idle, maxSeconds)}
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+@app.post("/admin/profiler/stop", dependencies=[Depends(require_admin)])
+async def stop_profiler():
+    stacks = await asyncio.to_thread(profiler.stop)
+    if stacks is None:
+        raise HTTPException(status_code=409, detail="Profiler is not running")
+    return PlainTextResponse(stacks)
+
+
+@app.get("/admin/profiler/requests/{profileId}", dependencies=[Depends(require_admin)])
+async def get_request_profile(profileId: str, format: str = Query("collapsed", pattern="^(collapsed|json)$")):
+    profile = profiler.get_request_profile(profileId)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    if format == "json":
+        return profile
+    return PlainTextResponse(profile["collapsed"])
+
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run("app.main:app", host="0.0.0.0", port=8080, reload=True)
\ No newline at end of file
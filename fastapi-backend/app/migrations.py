@@ -2,9 +2,12 @@ from sqlalchemy import Column, Integer, DateTime, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.sql import func
 from sqlalchemy.exc import SQLAlchemyError
+from datetime import date
 import logging
 
 from app.database import engine, SessionLocal
+from app.config import settings
+from app.partitions import add_months, month_start, create_month_partition, ensure_partitions
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -48,8 +51,32 @@ def apply_migrations():
             apply_migration_1(db)
         if current_version < 2:
             apply_migration_2(db)
+        if current_version < 3:
+            apply_migration_3(db)
+        if current_version < 4:
+            apply_migration_4(db)
+        if current_version < 5:
+            apply_migration_5(db)
+        if current_version < 6:
+            apply_migration_6(db)
+        if current_version < 7:
+            apply_migration_7(db)
+        if current_version < 8:
+            apply_migration_8(db)
+        if current_version < 9:
+            apply_migration_9(db)
+        if current_version < 10:
+            apply_migration_10(db)
+        if current_version < 11:
+            apply_migration_11(db)
+        if current_version < 12:
+            apply_migration_12(db)
         # Add more migrations as needed
         
+        # Optional indexes that follow settings rather than schema versions
+        if settings.SEARCH_TRIGRAM_INDEXES:
+            ensure_trigram_indexes(db)
+        
         db.commit()
         logger.info("All migrations applied successfully")
         
@@ -111,4 +138,394 @@ def apply_migration_2(db):
     
     # Mark migration as applied
     db.execute(text("INSERT INTO schema_migrations (version) VALUES (2)"))
-    logger.info("Migration 2 applied successfully")
\ No newline at end of file
+    logger.info("Migration 2 applied successfully")
+
+def apply_migration_3(db):
+    logger.info("Applying migration 3: Full-text search columns")
+    
+    # Generated tsvector columns, user side weighted above the agent side
+    db.execute(text("""
+        ALTER TABLE chats ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(message, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(response, '')), 'B')
+        ) STORED
+    """))
+    db.execute(text("""
+        ALTER TABLE voice ADD COLUMN IF NOT EXISTS search_vector tsvector
+        GENERATED ALWAYS AS (
+            setweight(to_tsvector('english', coalesce(user_text, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(agent_response, '')), 'B')
+        ) STORED
+    """))
+    
+    # GIN indexes for the @@ match
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_chats_search_vector ON chats USING GIN (search_vector)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_voice_search_vector ON voice USING GIN (search_vector)"))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (3)"))
+    logger.info("Migration 3 applied successfully")
+
+def ensure_trigram_indexes(db):
+    """Create pg_trgm indexes for fuzzy search; skipped if the extension is unavailable"""
+    try:
+        with db.begin_nested():
+            db.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            db.execute(text("CREATE INDEX IF NOT EXISTS idx_chats_message_trgm ON chats USING GIN (message gin_trgm_ops)"))
+            db.execute(text("CREATE INDEX IF NOT EXISTS idx_chats_response_trgm ON chats USING GIN (response gin_trgm_ops)"))
+            db.execute(text("CREATE INDEX IF NOT EXISTS idx_voice_user_text_trgm ON voice USING GIN (user_text gin_trgm_ops)"))
+            db.execute(text("CREATE INDEX IF NOT EXISTS idx_voice_agent_response_trgm ON voice USING GIN (agent_response gin_trgm_ops)"))
+        logger.info("Trigram search indexes are in place")
+    except SQLAlchemyError as e:
+        logger.warning(f"Could not create trigram search indexes, fuzzy search disabled: {e}")
+
+# Column definitions for the partitioned chats/voice tables (migration 4)
+PARTITIONED_SCHEMAS = {
+    "chats": {
+        "id_column": "message_id",
+        "text_columns": ("message", "response"),
+        "columns": [
+            ("user_id", "INTEGER REFERENCES users(user_id)"),
+            ("message", "TEXT NOT NULL"),
+            ("response", "TEXT"),
+            ("session_id", "VARCHAR(255) NOT NULL"),
+        ]
+    },
+    "voice": {
+        "id_column": "voice_id",
+        "text_columns": ("user_text", "agent_response"),
+        "columns": [
+            ("user_id", "INTEGER REFERENCES users(user_id)"),
+            ("user_text", "TEXT NOT NULL"),
+            ("agent_response", "TEXT"),
+            ("session_id", "VARCHAR(255) NOT NULL"),
+        ]
+    }
+}
+
+def _create_partitioned_table(db, table, schema):
+    """Rename the heap table aside and create its partitioned replacement"""
+    legacy = f"{table}_unpartitioned"
+    id_column = schema["id_column"]
+    user_text, agent_text = schema["text_columns"]
+    column_sql = ",\n".join(f"{name} {definition}" for name, definition in schema["columns"])
+    
+    db.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    db.execute(text(f"ALTER TABLE {legacy} RENAME CONSTRAINT {table}_pkey TO {legacy}_pkey"))
+    
+    # The partition key has to be part of the primary key and cannot be null
+    db.execute(text(f"""
+        CREATE TABLE {table} (
+            {id_column} INTEGER NOT NULL DEFAULT nextval('{table}_{id_column}_seq'),
+            {column_sql},
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            search_vector tsvector GENERATED ALWAYS AS (
+                setweight(to_tsvector('english', coalesce({user_text}, '')), 'A') ||
+                setweight(to_tsvector('english', coalesce({agent_text}, '')), 'B')
+            ) STORED,
+            PRIMARY KEY ({id_column}, created_at)
+        ) PARTITION BY RANGE (created_at)
+    """))
+    # Keep the id sequence alive when the legacy table is dropped
+    db.execute(text(f"ALTER SEQUENCE {table}_{id_column}_seq OWNED BY {table}.{id_column}"))
+    
+    # One partition per past month that already holds rows
+    first = db.execute(text(f"SELECT min(coalesce(created_at, updated_at)) FROM {legacy}")).scalar()
+    if first is not None:
+        month = month_start(first)
+        while month < month_start(date.today()):
+            create_month_partition(db, table, month)
+            month = add_months(month, 1)
+    
+    return legacy
+
+def _copy_into_partitions(db, table, legacy, schema):
+    """Move the rows across; search_vector is regenerated on insert"""
+    names = [schema["id_column"]] + [name for name, _ in schema["columns"]]
+    columns = ", ".join(names + ["created_at", "updated_at"])
+    values = ", ".join(names + ["coalesce(created_at, updated_at, CURRENT_TIMESTAMP)", "updated_at"])
+    db.execute(text(f"INSERT INTO {table} ({columns}) SELECT {values} FROM {legacy}"))
+    db.execute(text(f"DROP TABLE {legacy}"))
+
+def apply_migration_4(db):
+    logger.info("Applying migration 4: Partition chats and voice by month")
+    
+    legacy_tables = {
+        table: _create_partitioned_table(db, table, schema)
+        for table, schema in PARTITIONED_SCHEMAS.items()
+    }
+    
+    # Current and upcoming months, then move the data across
+    ensure_partitions(db)
+    for table, legacy in legacy_tables.items():
+        _copy_into_partitions(db, table, legacy, PARTITIONED_SCHEMAS[table])
+    
+    # Indexes are declared on the parent and created on every partition.
+    # (user_id, created_at) and (session_id, created_at) let history queries
+    # read partitions newest-first and stop at the LIMIT.
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_chats_user_created ON chats (user_id, created_at)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_chats_session_created ON chats (session_id, created_at)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_chats_search_vector ON chats USING GIN (search_vector)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_voice_user_created ON voice (user_id, created_at)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_voice_session_created ON voice (session_id, created_at)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_voice_search_vector ON voice USING GIN (search_vector)"))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (4)"))
+    logger.info("Migration 4 applied successfully")
+
+def apply_migration_5(db):
+    logger.info("Applying migration 5: Agent metadata columns and daily rollups")
+    
+    # What the agent reported alongside each response
+    for table in ("chats", "voice"):
+        db.execute(text(f"""
+            ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS agent_type VARCHAR(50),
+                ADD COLUMN IF NOT EXISTS emotional_state VARCHAR(50),
+                ADD COLUMN IF NOT EXISTS confidence_score INTEGER,
+                ADD COLUMN IF NOT EXISTS requires_immediate_attention BOOLEAN,
+                ADD COLUMN IF NOT EXISTS recommendations JSONB
+        """))
+    
+    # Per user and day counters, incremented in the same transaction as the
+    # response that they count (see services/analytics_service.py)
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_daily_stats (
+            user_id INTEGER NOT NULL REFERENCES users(user_id),
+            day DATE NOT NULL,
+            chat_turns INTEGER NOT NULL DEFAULT 0,
+            voice_turns INTEGER NOT NULL DEFAULT 0,
+            attention_flags INTEGER NOT NULL DEFAULT 0,
+            confidence_total BIGINT NOT NULL DEFAULT 0,
+            confidence_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        )
+    """))
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS user_daily_emotions (
+            user_id INTEGER NOT NULL REFERENCES users(user_id),
+            day DATE NOT NULL,
+            emotional_state VARCHAR(50) NOT NULL,
+            turns INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day, emotional_state)
+        )
+    """))
+    
+    # Turns answered before this migration have no metadata but still count
+    db.execute(text("""
+        INSERT INTO user_daily_stats (user_id, day, chat_turns, voice_turns)
+        SELECT user_id, day, sum(chat_turns), sum(voice_turns)
+        FROM (
+            SELECT user_id, created_at::date AS day, count(*) AS chat_turns, 0 AS voice_turns
+            FROM chats WHERE response IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY user_id, created_at::date
+            UNION ALL
+            SELECT user_id, created_at::date, 0, count(*)
+            FROM voice WHERE agent_response IS NOT NULL AND user_id IS NOT NULL
+            GROUP BY user_id, created_at::date
+        ) turns
+        GROUP BY user_id, day
+        ON CONFLICT (user_id, day) DO NOTHING
+    """))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (5)"))
+    logger.info("Migration 5 applied successfully")
+
+def apply_migration_6(db):
+    logger.info("Applying migration 6: Sessions index table")
+    
+    # One row per session, upserted by every chat/voice write
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            session_id VARCHAR(255) PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            first_activity_at TIMESTAMP NOT NULL,
+            last_activity_at TIMESTAMP NOT NULL,
+            chat_turns INTEGER NOT NULL DEFAULT 0,
+            voice_turns INTEGER NOT NULL DEFAULT 0,
+            last_message_preview VARCHAR(200),
+            last_modality VARCHAR(10)
+        )
+    """))
+    
+    # Serves /users/{id}/sessions newest first with a keyset cursor
+    db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_sessions_user_last_activity
+        ON sessions (user_id, last_activity_at DESC, session_id DESC)
+    """))
+    
+    # Build rows for the sessions that already exist
+    db.execute(text("""
+        INSERT INTO sessions (
+            session_id, user_id, first_activity_at, last_activity_at,
+            chat_turns, voice_turns, last_message_preview, last_modality
+        )
+        SELECT session_id,
+               (array_agg(user_id ORDER BY created_at DESC))[1],
+               min(created_at),
+               max(created_at),
+               count(*) FILTER (WHERE modality = 'chat'),
+               count(*) FILTER (WHERE modality = 'voice'),
+               (array_agg(left(user_text, 200) ORDER BY created_at DESC))[1],
+               (array_agg(modality ORDER BY created_at DESC))[1]
+        FROM (
+            SELECT session_id, user_id, created_at, 'chat' AS modality, message AS user_text FROM chats
+            UNION ALL
+            SELECT session_id, user_id, created_at, 'voice', user_text FROM voice
+        ) turns
+        GROUP BY session_id
+        ON CONFLICT (session_id) DO NOTHING
+    """))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (6)"))
+    logger.info("Migration 6 applied successfully")
+
+def apply_migration_7(db):
+    logger.info("Applying migration 7: Rate limit buckets")
+    
+    # Shared token buckets for RATE_LIMIT_BACKEND=postgres; unlogged because
+    # losing them in a crash only resets everyone's allowance
+    db.execute(text("""
+        CREATE UNLOGGED TABLE IF NOT EXISTS rate_limit_buckets (
+            bucket_key VARCHAR(255) PRIMARY KEY,
+            tokens DOUBLE PRECISION NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL
+        )
+    """))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (7)"))
+    logger.info("Migration 7 applied successfully")
+
+def apply_migration_8(db):
+    logger.info("Applying migration 8: Transcription job queue")
+    
+    # Work queue for POST /voice/jobs, claimed by workers with SKIP LOCKED
+    db.execute(text("""
+        CREATE TABLE IF NOT EXISTS transcription_jobs (
+            job_id UUID PRIMARY KEY,
+            user_id INTEGER REFERENCES users(user_id),
+            session_id VARCHAR(255) NOT NULL,
+            status VARCHAR(16) NOT NULL DEFAULT 'queued',
+            format VARCHAR(32) NOT NULL,
+            sample_rate INTEGER NOT NULL DEFAULT 16000,
+            audio BYTEA,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            error TEXT,
+            voice_id INTEGER,
+            transcribed_text TEXT,
+            duration DOUBLE PRECISION,
+            created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP,
+            locked_until TIMESTAMP
+        )
+    """))
+    
+    # Only unfinished jobs are indexed, so the claim query stays small
+    db.execute(text("""
+        CREATE INDEX IF NOT EXISTS idx_transcription_jobs_runnable
+        ON transcription_jobs (available_at) WHERE status IN ('queued', 'running')
+    """))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (8)"))
+    logger.info("Migration 8 applied successfully")
+
+def apply_migration_9(db):
+    logger.info("Applying migration 9: Stored audio references on voice")
+    
+    # SHA-256 of the upload in AUDIO_STORE_DIR plus what is needed to decode it
+    db.execute(text("""
+        ALTER TABLE voice
+            ADD COLUMN IF NOT EXISTS audio_sha256 CHAR(64),
+            ADD COLUMN IF NOT EXISTS audio_format VARCHAR(32),
+            ADD COLUMN IF NOT EXISTS audio_sample_rate INTEGER
+    """))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (9)"))
+    logger.info("Migration 9 applied successfully")
+
+def apply_migration_10(db):
+    logger.info("Applying migration 10: Transcript version and status on voice")
+    
+    # Two-pass transcription saves a draft first and bumps the version when
+    # the refined text replaces it; existing rows are single-pass finals
+    db.execute(text("""
+        ALTER TABLE voice
+            ADD COLUMN IF NOT EXISTS transcript_version INTEGER NOT NULL DEFAULT 1,
+            ADD COLUMN IF NOT EXISTS transcript_status VARCHAR(10) NOT NULL DEFAULT 'final'
+    """))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (10)"))
+    logger.info("Migration 10 applied successfully")
+
+def apply_migration_11(db):
+    logger.info("Applying migration 11: updated_at trigger and change-feed indexes")
+    
+    # Rows from before updated_at was always set count as changed when created
+    for table in ("chats", "voice"):
+        db.execute(text(f"UPDATE {table} SET updated_at = created_at WHERE updated_at IS NULL"))
+    
+    # Every insert and update stamps updated_at, raw SQL included, so the
+    # /users/{id}/changes feed cannot miss a write. clock_timestamp() rather
+    # than now(): the stamp is taken at the write, not when a long transaction
+    # began, which keeps it close to the commit the feed waits for.
+    db.execute(text("""
+        CREATE OR REPLACE FUNCTION stamp_updated_at() RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := clock_timestamp();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    for table in ("chats", "voice"):
+        # Declared on the parent, so every partition, present and future, has it
+        db.execute(text(f"DROP TRIGGER IF EXISTS {table}_stamp_updated_at ON {table}"))
+        db.execute(text(f"""
+            CREATE TRIGGER {table}_stamp_updated_at
+            BEFORE INSERT OR UPDATE ON {table}
+            FOR EACH ROW EXECUTE FUNCTION stamp_updated_at()
+        """))
+    
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_chats_user_updated ON chats (user_id, updated_at)"))
+    db.execute(text("CREATE INDEX IF NOT EXISTS idx_voice_user_updated ON voice (user_id, updated_at)"))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (11)"))
+    logger.info("Migration 11 applied successfully")
+
+def apply_migration_12(db):
+    logger.info("Applying migration 12: keep supplied updated_at on insert")
+    
+    # The bulk import (app/export.py) inserts rows with their exported
+    # updated_at; stamping them would lose it and replay the whole imported
+    # history through every client's change feed. Without the column default
+    # a NULL updated_at means "not given", and only that, or an update, is
+    # stamped. Application inserts never set updated_at, so they still get
+    # clock_timestamp() from the trigger.
+    for table in ("chats", "voice"):
+        # Recurses into every partition
+        db.execute(text(f"ALTER TABLE {table} ALTER COLUMN updated_at DROP DEFAULT"))
+    db.execute(text("""
+        CREATE OR REPLACE FUNCTION stamp_updated_at() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'UPDATE' OR NEW.updated_at IS NULL THEN
+                NEW.updated_at := clock_timestamp();
+            END IF;
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql
+    """))
+    
+    # Mark migration as applied
+    db.execute(text("INSERT INTO schema_migrations (version) VALUES (12)"))
+    logger.info("Migration 12 applied successfully")
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Boolean
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.sql import func
 from app.database import Base
 
@@ -11,4 +12,11 @@ class Chat(Base):
     response = Column(Text, nullable=True)
     session_id = Column(String(255), nullable=False, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
\ No newline at end of file
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    
+    # Agent metadata returned with the response
+    agent_type = Column(String(50), nullable=True)
+    emotional_state = Column(String(50), nullable=True)
+    confidence_score = Column(Integer, nullable=True)
+    requires_immediate_attention = Column(Boolean, nullable=True)
+    recommendations = Column(JSONB, nullable=True)
\ No newline at end of file
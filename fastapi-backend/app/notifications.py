@@ -0,0 +1,81 @@
+from typing import Callable, Dict, List
+import logging
+import select
+import threading
+import time
+
+import psycopg2
+
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# One LISTEN connection per worker process, shared by every module that
+# reacts to NOTIFY: handlers subscribe to a channel before start_listener()
+_handlers: Dict[str, List[Callable[[str], None]]] = {}
+_reconnect_handlers: List[Callable[[], None]] = []
+_started = False
+_lock = threading.Lock()
+
+
+def subscribe(channel: str, handler: Callable[[str], None], on_reconnect: Callable[[], None] = None):
+    """
+    Call handler(payload) for every notification on channel
+
+    on_reconnect runs whenever the listener (re)connects, for state that may
+    have gone stale while notifications could not be received.
+    """
+    with _lock:
+        _handlers.setdefault(channel, []).append(handler)
+        if on_reconnect is not None:
+            _reconnect_handlers.append(on_reconnect)
+
+
+def _listen_forever():
+    while True:
+        conn = None
+        try:
+            # LISTEN needs a session of its own, which PgBouncer transaction pooling does not give
+            conn = psycopg2.connect(
+                host=settings.DB_DIRECT_HOST,
+                port=settings.DB_DIRECT_PORT,
+                user=settings.POSTGRES_USER,
+                password=settings.POSTGRES_PASSWORD,
+                database=settings.POSTGRES_DB
+            )
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            cursor = conn.cursor()
+            for channel in list(_handlers):
+                cursor.execute(f"LISTEN {channel}")
+            # Notifications may have been missed while disconnected
+            for handler in list(_reconnect_handlers):
+                handler()
+            logger.info(f"Listening for notifications on {', '.join(_handlers)}")
+
+            while True:
+                if select.select([conn], [], [], 30) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    for handler in _handlers.get(notify.channel, ()):
+                        try:
+                            handler(notify.payload)
+                        except Exception as e:
+                            logger.error(f"Notification handler error on {notify.channel}: {e}")
+        except Exception as e:
+            logger.error(f"Notification listener error: {e}")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+
+def start_listener():
+    """Start the listener thread once, if anything has subscribed"""
+    global _started
+    with _lock:
+        if _started or not _handlers:
+            return
+        _started = True
+    threading.Thread(target=_listen_forever, name="notification-listener", daemon=True).start()
@@ -0,0 +1,228 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from sqlalchemy.exc import SQLAlchemyError
+from datetime import date, datetime
+from contextlib import contextmanager
+from typing import List, Optional, Tuple
+import asyncio
+import gzip
+import logging
+import os
+import re
+import sys
+
+import psycopg2
+
+from app.database import SessionLocal, engine
+from app.config import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# chats and voice are range partitioned by month on created_at, one child
+# table per month named <table>_pYYYYMM
+PARTITIONED_TABLES = ("chats", "voice")
+PARTITION_NAME = re.compile(r"^(?P<table>\w+)_p(?P<year>\d{4})(?P<month>\d{2})$")
+# Advisory lock key held by the one worker doing maintenance at a time
+MAINTENANCE_LOCK_KEY = 0x70617274
+
+def month_start(value) -> date:
+    return date(value.year, value.month, 1)
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + (month.month - 1) + months
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_p{month.year:04d}{month.month:02d}"
+
+def list_partitions(db: Session, table: str) -> List[Tuple[str, date]]:
+    """Attached monthly partitions of a table as (name, month), oldest first"""
+    rows = db.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table
+    """), {"table": table}).all()
+
+    partitions = []
+    for (name,) in rows:
+        match = PARTITION_NAME.match(name)
+        if match and match.group("table") == table:
+            partitions.append((name, date(int(match.group("year")), int(match.group("month")), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+def create_month_partition(db: Session, table: str, month: date) -> bool:
+    """Create the partition holding one month of rows, returns False if it already exists"""
+    name = partition_name(table, month)
+    exists = db.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar()
+    if exists:
+        return False
+
+    db.execute(text(
+        f"CREATE TABLE {name} PARTITION OF {table} "
+        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+    ))
+    logger.info(f"Created partition {name}")
+    return True
+
+def ensure_partitions(db: Session, months_ahead: Optional[int] = None, today: Optional[date] = None) -> int:
+    """Make sure the current month and the next months_ahead months have partitions"""
+    months_ahead = settings.PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+    current = month_start(today or date.today())
+
+    created = 0
+    for table in PARTITIONED_TABLES:
+        for offset in range(months_ahead + 1):
+            if create_month_partition(db, table, add_months(current, offset)):
+                created += 1
+    return created
+
+def _fingerprint(db: Session, name: str) -> Tuple[int, Optional[datetime]]:
+    return tuple(db.execute(text(f"SELECT count(*), max(updated_at) FROM {name}")).one())
+
+def _archive_partition(db: Session, name: str, archive_dir: str) -> Tuple[str, Tuple]:
+    """
+    Export a partition to <archive_dir>/<name>.csv.gz with COPY
+
+    Returns the path and a (row count, latest updated_at) fingerprint taken
+    from the same snapshot as the export. Only the partition is read, so
+    the parent table stays fully usable meanwhile.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{name}.csv.gz")
+    tmp_path = f"{path}.tmp"
+
+    db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+    fingerprint = _fingerprint(db, name)
+    cursor = db.connection().connection.cursor()
+    try:
+        with gzip.open(tmp_path, "wb") as archive:
+            cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)", archive)
+    finally:
+        cursor.close()
+    db.commit()
+    os.replace(tmp_path, path)
+    return path, fingerprint
+
+def _detach_partition(table: str, name: str, pending: bool):
+    """
+    Detach without blocking the parent: CONCURRENTLY only takes a SHARE
+    UPDATE EXCLUSIVE lock, but cannot run inside a transaction block. A
+    detach interrupted half way is left pending and is finalized instead.
+    """
+    mode = "FINALIZE" if pending else "CONCURRENTLY"
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"ALTER TABLE {table} DETACH PARTITION {name} {mode}"))
+
+def _pending_detach(db: Session, table: str) -> List[str]:
+    return db.execute(text("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = :table AND pg_inherits.inhdetachpending
+    """), {"table": table}).scalars().all()
+
+def apply_retention(db: Session, retain_months: Optional[int] = None, archive_dir: Optional[str] = None,
+                    today: Optional[date] = None) -> List[str]:
+    """
+    Detach partitions older than retain_months
+
+    With an archive directory each partition is exported first, then
+    detached and dropped; without one it is only detached, so it leaves the
+    hot path but its data stays in the database.
+    """
+    retain_months = settings.PARTITION_RETENTION_MONTHS if retain_months is None else retain_months
+    archive_dir = settings.PARTITION_ARCHIVE_DIR if archive_dir is None else archive_dir
+    if retain_months <= 0:
+        return []
+
+    cutoff = add_months(month_start(today or date.today()), -retain_months)
+    detached = []
+    for table in PARTITIONED_TABLES:
+        expired = [name for name, month in list_partitions(db, table) if month < cutoff]
+        pending = set(_pending_detach(db, table))
+        # No transaction may stay open here: DETACH CONCURRENTLY waits for every one using the table
+        db.commit()
+        for name in expired:
+            # The long export runs while the partition is still attached and
+            # holds no lock on the parent; detaching is then a short step
+            path, fingerprint = _archive_partition(db, name, archive_dir) if archive_dir else (None, None)
+            _detach_partition(table, name, name in pending)
+
+            if archive_dir:
+                # Rows written between the export and the detach would be
+                # lost with the table; the detached copy is frozen, export again
+                if _fingerprint(db, name) != fingerprint:
+                    logger.warning(f"Partition {name} changed while archiving, exporting it again")
+                    db.commit()
+                    path, _ = _archive_partition(db, name, archive_dir)
+                db.execute(text(f"DROP TABLE {name}"))
+                db.commit()
+                logger.info(f"Archived partition {name} to {path}")
+            else:
+                logger.info(f"Detached partition {name}")
+            detached.append(name)
+    return detached
+
+@contextmanager
+def maintenance_lock():
+    """
+    Session advisory lock so only one worker runs maintenance at a time;
+    yields False when another one holds it. Taken on a direct connection,
+    since PgBouncer transaction pooling would not keep the session.
+    """
+    conn = psycopg2.connect(
+        host=settings.DB_DIRECT_HOST,
+        port=settings.DB_DIRECT_PORT,
+        user=settings.POSTGRES_USER,
+        password=settings.POSTGRES_PASSWORD,
+        database=settings.POSTGRES_DB
+    )
+    try:
+        conn.autocommit = True
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_try_advisory_lock(%s)", (MAINTENANCE_LOCK_KEY,))
+        yield cursor.fetchone()[0]
+    finally:
+        # Closing the session releases the lock
+        conn.close()
+
+def run_maintenance():
+    """Create upcoming partitions and apply retention, unless another worker is already at it"""
+    with maintenance_lock() as acquired:
+        if not acquired:
+            logger.info("Partition maintenance is running in another worker, skipping")
+            return 0, []
+
+        db = SessionLocal()
+        try:
+            created = ensure_partitions(db)
+            db.commit()
+            detached = apply_retention(db)
+            logger.info(f"Partition maintenance done: {created} created, {len(detached)} detached")
+            return created, detached
+        except SQLAlchemyError as e:
+            db.rollback()
+            logger.error(f"Partition maintenance error: {e}")
+            raise
+        finally:
+            db.close()
+
+async def maintenance_loop():
+    """Background task that keeps partitions ahead of time while the app runs"""
+    while True:
+        try:
+            await asyncio.to_thread(run_maintenance)
+        except Exception as e:
+            logger.error(f"Partition maintenance failed: {e}")
+        await asyncio.sleep(settings.PARTITION_MAINTENANCE_INTERVAL_SECONDS)
+
+if __name__ == "__main__":
+    # python -m app.partitions  ->  one maintenance run, e.g. from cron
+    try:
+        run_maintenance()
+    except SQLAlchemyError:
+        sys.exit(1)
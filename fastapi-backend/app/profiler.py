@@ -0,0 +1,247 @@
+from collections import Counter, OrderedDict
+from typing import Any, Callable, Dict, Optional
+import asyncio
+import os
+import secrets
+import sys
+import threading
+import time
+import uuid
+
+from app.config import settings
+
+# Sampling profiler for a running worker, driven from /admin/profiler.
+#
+# A background thread wakes every interval and records the Python stack of
+# each thread (sys._current_frames), so the profiled code pays nothing but
+# the GIL handoffs; there is no tracing hook. Stacks are aggregated in
+# collapsed form, one "frame;frame;frame count" line per distinct stack,
+# which flamegraph.pl, inferno and speedscope read as they are.
+#
+# A request sent with X-Profile: 1 (and the admin token) is profiled on its
+# own: only event loop samples taken while that request's task is running
+# count, so concurrent requests do not blur into it. Work it hands to worker
+# threads (asyncio.to_thread, sync dependencies) is not attributed.
+
+# Threads blocked in one of these are waiting, not working, and are left out
+# unless idle stacks are asked for
+IDLE_FRAMES = {
+    ("selectors.py", "select"),
+    ("threading.py", "wait"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+    ("profiler.py", "_run"),
+    # LISTEN connection parked in select.select
+    ("notifications.py", "_listen_forever")
+}
+
+_labels: Dict[Any, str] = {}
+
+
+def _label(code) -> str:
+    label = _labels.get(code)
+    if label is None:
+        filename = code.co_filename
+        for prefix in sorted(sys.path, key=len, reverse=True):
+            if prefix and filename.startswith(prefix + os.sep):
+                filename = filename[len(prefix) + 1:]
+                break
+        label = f"{code.co_name} ({filename}:{code.co_firstlineno})".replace(";", ",")
+        _labels[code] = label
+    return label
+
+
+def _is_idle(frame) -> bool:
+    return (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name) in IDLE_FRAMES
+
+
+def _collapse(frame, prefix: str = "") -> str:
+    labels = []
+    while frame is not None:
+        labels.append(_label(frame.f_code))
+        frame = frame.f_back
+    labels.reverse()
+    return prefix + ";".join(labels)
+
+
+class SamplingProfiler:
+    """Samples thread stacks on a background thread until stopped"""
+
+    def __init__(self, interval: float, idle: bool = False,
+                 accept: Optional[Callable[[int], bool]] = None, max_seconds: float = 0):
+        self.interval = interval
+        self.idle = idle
+        # Thread filter: called with each thread ident, None samples every thread
+        self.accept = accept
+        self.max_seconds = max_seconds
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started_at = time.time()
+        self.stopped_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+
+    def start(self) -> "SamplingProfiler":
+        self._thread.start()
+        return self
+
+    def stop(self) -> Counter:
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+        return self.stacks
+
+    @property
+    def running(self) -> bool:
+        return self._thread.is_alive()
+
+    def _run(self):
+        own_ident = threading.get_ident()
+        deadline = self.started_at + self.max_seconds if self.max_seconds > 0 else None
+        while not self._stop.wait(self.interval):
+            if deadline and time.time() >= deadline:
+                break
+            names = {thread.ident: thread.name for thread in threading.enumerate()} if self.accept is None else {}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident or (self.accept is not None and not self.accept(ident)):
+                    continue
+                if not self.idle and _is_idle(frame):
+                    continue
+                # Whole-process profiles are rooted at the thread name
+                prefix = f"{names.get(ident, ident)};" if self.accept is None else ""
+                self.stacks[_collapse(frame, prefix)] += 1
+            self.samples += 1
+        self.stopped_at = time.time()
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": self.running,
+            "startedAt": self.started_at,
+            "stoppedAt": self.stopped_at,
+            "intervalMs": round(self.interval * 1000, 3),
+            "idle": self.idle,
+            "samples": self.samples,
+            "stacks": len(self.stacks)
+        }
+
+
+def collapsed(stacks: Counter) -> str:
+    """Collapsed stack text, heaviest stacks first"""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+# ----- whole-worker profiling, one session at a time -----
+
+_lock = threading.Lock()
+_session: Optional[SamplingProfiler] = None
+
+
+def start(interval_ms: Optional[float] = None, idle: bool = False,
+          max_seconds: Optional[float] = None) -> Dict[str, Any]:
+    """Start sampling this worker; RuntimeError when a session is already running"""
+    global _session
+    with _lock:
+        if _session is not None and _session.running:
+            raise RuntimeError("Profiler is already running")
+        _session = SamplingProfiler(
+            (interval_ms or settings.PROFILER_INTERVAL_MS) / 1000.0,
+            idle=idle,
+            # Never longer than PROFILER_MAX_SECONDS, so a forgotten session stops by itself
+            max_seconds=min(max_seconds or settings.PROFILER_MAX_SECONDS, settings.PROFILER_MAX_SECONDS)
+        ).start()
+        return _session.status()
+
+
+def stop() -> Optional[str]:
+    """Stop the current session and return its collapsed stacks, None if there was none"""
+    global _session
+    with _lock:
+        session, _session = _session, None
+    if session is None:
+        return None
+    return collapsed(session.stop())
+
+
+def status() -> Dict[str, Any]:
+    with _lock:
+        session = _session
+        profile_ids = list(_request_profiles.keys())
+    return {
+        # Each worker process profiles itself; this tells which one answered
+        "pid": os.getpid(),
+        "session": session.status() if session else None,
+        "requestProfiles": profile_ids
+    }
+
+
+# ----- per-request profiling -----
+
+_request_profiles: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def get_request_profile(profile_id: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        return _request_profiles.get(profile_id)
+
+
+def _keep_request_profile(profile_id: str, profile: Dict[str, Any]):
+    with _lock:
+        _request_profiles[profile_id] = profile
+        while len(_request_profiles) > settings.PROFILER_KEEP_REQUEST_PROFILES:
+            _request_profiles.popitem(last=False)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope.get("headers", []):
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def admin_token_valid(token: Optional[str]) -> bool:
+    return bool(settings.ADMIN_TOKEN) and token is not None and secrets.compare_digest(token, settings.ADMIN_TOKEN)
+
+
+class RequestProfilerMiddleware:
+    """
+    Profiles requests sent with X-Profile: 1 and a valid X-Admin-Token; the
+    response carries X-Profile-Id, fetched from /admin/profiler/requests/{id}
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or _header(scope, b"x-profile") not in ("1", "true") \
+                or not admin_token_valid(_header(scope, b"x-admin-token")):
+            await self.app(scope, receive, send)
+            return
+
+        loop = asyncio.get_running_loop()
+        task = asyncio.current_task()
+        loop_thread = threading.get_ident()
+        profile_id = uuid.uuid4().hex[:16]
+
+        def accept(ident: int) -> bool:
+            return ident == loop_thread and asyncio.current_task(loop) is task
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        sampler = SamplingProfiler(
+            settings.PROFILER_INTERVAL_MS / 1000.0, accept=accept, max_seconds=settings.PROFILER_MAX_SECONDS
+        ).start()
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            stacks = sampler.stop()
+            _keep_request_profile(profile_id, {
+                "method": scope["method"],
+                "path": scope["path"],
+                "durationMs": round((time.perf_counter() - start_time) * 1000, 1),
+                "samples": sum(stacks.values()),
+                "collapsed": collapsed(stacks)
+            })
@@ -0,0 +1,173 @@
+"""
+Per-call cost of the chat_service hot paths against the ORM code they replaced
+
+Usage:
+    python -m app.query_benchmark
+    python -m app.query_benchmark --iterations 2000 --json
+
+Runs against the configured database: a throwaway user and session are
+created, and everything written for them is deleted afterwards. Both
+variants do the same session, cache and rollup bookkeeping, so the
+difference is the data access itself.
+"""
+from sqlalchemy import select, text
+from sqlalchemy.orm import Session
+from typing import Callable, Dict, List
+from datetime import datetime
+import argparse
+import json
+import statistics
+import time
+import uuid
+
+from app.database import SessionLocal
+from app.models.chat import Chat
+from app import history_cache
+from app.services import analytics_service, chat_service, session_service
+
+METADATA = {
+    "agent_type": "assistant",
+    "emotional_state": "calm",
+    "confidence_score": 80,
+    "requires_immediate_attention": False,
+    "recommendations": ["breathing exercise"]
+}
+
+
+# ORM baselines, as chat_service did it before the Core statements
+
+def orm_save_user_message(db: Session, user_id: int, message: str, session_id: str) -> Chat:
+    db_message = Chat(user_id=user_id, message=message, session_id=session_id)
+    db.add(db_message)
+    session_service.touch_session(db, session_id, user_id, "chat", message)
+    history_cache.mark_changed(db, "chats", session_id)
+    db.commit()
+    db.refresh(db_message)
+    return db_message
+
+
+def orm_save_agent_response(db: Session, message_id: int, response: str, metadata: Dict) -> bool:
+    db_message = db.query(Chat).filter(Chat.message_id == message_id).first()
+    if not db_message:
+        return False
+    first_response = db_message.response is None
+    db_message.response = response
+    for column, value in metadata.items():
+        if value is not None:
+            setattr(db_message, column, value)
+    if first_response and db_message.user_id is not None:
+        day = (db_message.created_at or datetime.now()).date()
+        analytics_service.record_turn(db, db_message.user_id, day, "chat", metadata)
+    history_cache.mark_changed(db, "chats", db_message.session_id)
+    db.commit()
+    return True
+
+
+def orm_get_chat_rows(db: Session, session_id: str, fields=chat_service.CHAT_FIELDS) -> List[Dict]:
+    columns = Chat.__table__.c
+    query = select(*[columns[field] for field in fields])
+    query = query.where(columns.session_id == session_id).order_by(columns.created_at.asc())
+    return [dict(row) for row in db.execute(query).mappings()]
+
+
+def time_calls(call: Callable[[int], None], iterations: int) -> Dict[str, float]:
+    timings = []
+    for i in range(iterations):
+        start_time = time.perf_counter()
+        call(i)
+        timings.append(time.perf_counter() - start_time)
+    timings.sort()
+    return {
+        "meanUs": round(statistics.fmean(timings) * 1e6, 1),
+        "p50Us": round(timings[len(timings) // 2] * 1e6, 1),
+        "p95Us": round(timings[int(len(timings) * 0.95)] * 1e6, 1)
+    }
+
+
+def compare(db: Session, name: str, orm_call: Callable[[int], None], core_call: Callable[[int], None],
+            iterations: int) -> Dict:
+    # One untimed call each so connection setup and first compiles are not measured
+    orm_call(0)
+    core_call(0)
+    db.rollback()
+
+    orm = time_calls(orm_call, iterations)
+    core = time_calls(core_call, iterations)
+    db.rollback()
+    return {
+        "function": name,
+        "orm": orm,
+        "core": core,
+        "speedup": round(orm["meanUs"] / core["meanUs"], 2) if core["meanUs"] else None
+    }
+
+
+def run(iterations: int) -> List[Dict]:
+    db = SessionLocal()
+    user_id = db.execute(
+        text("INSERT INTO users (name) VALUES (:name) RETURNING user_id"), {"name": "query-benchmark"}
+    ).scalar()
+    db.commit()
+    session_id = f"benchmark-{uuid.uuid4()}"
+
+    try:
+        results = [compare(
+            db, "save_user_message",
+            lambda i: orm_save_user_message(db, user_id, f"message {i}", session_id),
+            lambda i: chat_service.save_user_message(db, user_id, f"message {i}", session_id),
+            iterations
+        )]
+
+        # Every variant answers its own messages, so each pays for the first response
+        message_ids = db.execute(
+            text("SELECT message_id FROM chats WHERE session_id = :session_id ORDER BY message_id"),
+            {"session_id": session_id}
+        ).scalars().all()
+        orm_ids, core_ids = message_ids[:len(message_ids) // 2], message_ids[len(message_ids) // 2:]
+        results.append(compare(
+            db, "save_agent_response",
+            lambda i: orm_save_agent_response(db, orm_ids[i], "response", METADATA),
+            lambda i: chat_service.save_agent_response(db, core_ids[i], "response", METADATA),
+            iterations
+        ))
+
+        results.append(compare(
+            db, "get_chat_rows (session)",
+            lambda i: orm_get_chat_rows(db, session_id),
+            lambda i: chat_service.get_chat_rows(db, session_id=session_id),
+            iterations
+        ))
+        return results
+    finally:
+        db.rollback()
+        for table in ("chats", "sessions"):
+            db.execute(text(f"DELETE FROM {table} WHERE session_id = :session_id"), {"session_id": session_id})
+        for table in ("user_daily_stats", "user_daily_emotions", "users"):
+            db.execute(text(f"DELETE FROM {table} WHERE user_id = :user_id"), {"user_id": user_id})
+        db.commit()
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ORM and Core data access in chat_service")
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.iterations)
+
+    if args.json:
+        print(json.dumps({"iterations": args.iterations, "results": results}, indent=2))
+        return
+
+    print(f"{args.iterations} calls per variant, microseconds per call")
+    print(f"{'function':<26}{'orm mean':>10}{'core mean':>11}{'orm p95':>10}{'core p95':>10}{'speedup':>9}")
+    for result in results:
+        print(
+            f"{result['function']:<26}{result['orm']['meanUs']:>10}{result['core']['meanUs']:>11}"
+            f"{result['orm']['p95Us']:>10}{result['core']['p95Us']:>10}{result['speedup']:>8}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
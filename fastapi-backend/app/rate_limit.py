@@ -0,0 +1,230 @@
+from sqlalchemy import text
+from typing import Dict, Optional, Tuple
+import asyncio
+import json
+import logging
+import math
+import re
+import threading
+import time
+
+from app.config import settings
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+# The user is taken from X-User-Id, else from a userId field near the start
+# of the body (JSON or form), else the client address. Only this much of the
+# body is looked at; the rest streams through untouched.
+PEEK_BYTES = 64 * 1024
+USER_ID_PATTERNS = (
+    re.compile(rb'"userId"\s*:\s*"?(\d+)'),
+    re.compile(rb'name="userId"\r\n\r\n(\d+)')
+)
+
+
+class TokenBuckets:
+    """In-process token buckets, one per user key"""
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    def take(self, key: str) -> float:
+        """Take one token; returns 0 on success, else seconds until one is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            # Full buckets carry no state worth keeping
+            if len(self._buckets) > 10000:
+                self._prune(now)
+            return (1 - tokens) / self.rate
+
+    def _prune(self, now: float):
+        full_after = self.burst / self.rate
+        for key, (_, updated) in list(self._buckets.items()):
+            if now - updated > full_after:
+                del self._buckets[key]
+
+
+class PostgresTokenBuckets:
+    """
+    Token buckets in the rate_limit_buckets table, shared by every worker
+
+    Refill and take happen in one upsert, so concurrent workers cannot both
+    spend the last token.
+    """
+
+    def __init__(self, rate_per_second: float, burst: int):
+        self.rate = rate_per_second
+        self.burst = burst
+
+    def take(self, key: str) -> float:
+        db = SessionLocal()
+        try:
+            tokens = db.execute(text("""
+                INSERT INTO rate_limit_buckets AS b (bucket_key, tokens, updated_at)
+                VALUES (:key, :burst - 1, clock_timestamp())
+                ON CONFLICT (bucket_key) DO UPDATE SET
+                    tokens = least(:burst, b.tokens + extract(epoch FROM clock_timestamp() - b.updated_at) * :rate) - 1,
+                    updated_at = clock_timestamp()
+                WHERE least(:burst, b.tokens + extract(epoch FROM clock_timestamp() - b.updated_at) * :rate) >= 1
+                RETURNING tokens
+            """), {"key": key, "burst": self.burst, "rate": self.rate}).scalar()
+            if tokens is not None:
+                db.commit()
+                return 0.0
+
+            current = db.execute(text("""
+                SELECT least(:burst, tokens + extract(epoch FROM clock_timestamp() - updated_at) * :rate)
+                FROM rate_limit_buckets WHERE bucket_key = :key
+            """), {"key": key, "burst": self.burst, "rate": self.rate}).scalar() or 0
+            db.commit()
+            return (1 - float(current)) / self.rate
+        finally:
+            db.close()
+
+
+class ConcurrencyLimits:
+    """In-flight request count per user key, enforced per worker"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._in_flight: Dict[str, int] = {}
+
+    def acquire(self, key: str) -> bool:
+        with self._lock:
+            count = self._in_flight.get(key, 0)
+            if count >= self.limit:
+                return False
+            self._in_flight[key] = count + 1
+            return True
+
+    def release(self, key: str):
+        with self._lock:
+            count = self._in_flight.get(key, 1) - 1
+            if count > 0:
+                self._in_flight[key] = count
+            else:
+                self._in_flight.pop(key, None)
+
+
+def create_buckets():
+    """Token buckets per the RATE_LIMIT_* settings, None when rate limiting is off"""
+    rate = settings.RATE_LIMIT_PER_MINUTE / 60.0
+    if rate <= 0:
+        return None
+    bucket_class = PostgresTokenBuckets if settings.RATE_LIMIT_BACKEND == "postgres" else TokenBuckets
+    return bucket_class(rate, settings.RATE_LIMIT_BURST)
+
+
+def _limited_path(scope) -> bool:
+    if scope["type"] != "http" or scope["method"] != "POST":
+        return False
+    return any(scope["path"].startswith(prefix) for prefix in settings.RATE_LIMITED_PATHS)
+
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+class RateLimitMiddleware:
+    """
+    Token bucket rate limit plus a concurrent request cap per user on the
+    chat and voice endpoints; rejected requests get 429 with Retry-After
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.buckets = create_buckets()
+        self.concurrency = ConcurrencyLimits(settings.USER_MAX_CONCURRENT_REQUESTS) \
+            if settings.USER_MAX_CONCURRENT_REQUESTS > 0 else None
+
+    async def __call__(self, scope, receive, send):
+        if not (self.buckets or self.concurrency) or not _limited_path(scope):
+            await self.app(scope, receive, send)
+            return
+
+        key, receive = await self._identify(scope, receive)
+
+        if self.buckets:
+            try:
+                if isinstance(self.buckets, PostgresTokenBuckets):
+                    retry_after = await asyncio.to_thread(self.buckets.take, key)
+                else:
+                    retry_after = self.buckets.take(key)
+            except Exception as e:
+                # Fail open: a rate limiter outage must not take the API down
+                logger.error(f"Rate limit check failed: {e}")
+                retry_after = 0.0
+            if retry_after > 0:
+                await self._reject(send, "Rate limit exceeded", retry_after)
+                return
+
+        if self.concurrency and not self.concurrency.acquire(key):
+            await self._reject(send, "Too many concurrent requests", 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            if self.concurrency:
+                self.concurrency.release(key)
+
+    async def _identify(self, scope, receive):
+        """User key for the request, plus a receive that replays what was peeked"""
+        user_id = _header(scope, b"x-user-id")
+        if user_id:
+            return f"user:{user_id}", receive
+
+        peeked = []
+        size = 0
+        more_body = True
+        while more_body and size < PEEK_BYTES:
+            message = await receive()
+            peeked.append(message)
+            if message["type"] != "http.request":
+                break
+            size += len(message.get("body", b""))
+            more_body = message.get("more_body", False)
+
+        prefix = b"".join(message.get("body", b"") for message in peeked)[:PEEK_BYTES]
+        key = None
+        for pattern in USER_ID_PATTERNS:
+            match = pattern.search(prefix)
+            if match:
+                key = f"user:{match.group(1).decode()}"
+                break
+        if key is None:
+            client = scope.get("client")
+            key = f"ip:{client[0] if client else 'unknown'}"
+
+        async def replay():
+            if peeked:
+                return peeked.pop(0)
+            return await receive()
+
+        return key, replay
+
+    async def _reject(self, send, detail: str, retry_after: float):
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode())
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,211 @@
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque
+from typing import Dict, Iterator, List, Optional, Tuple
+import argparse
+import json
+import logging
+import os
+import sys
+
+import httpx
+
+from app import audio_store
+from app.config import settings
+from app.database import SessionLocal, engine
+from app.services import voice_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Re-runs Whisper over voice turns whose audio is in the audio store and
+# replaces their text, e.g. after a model upgrade:
+#
+#   python -m app.retranscribe --workers 8 --checkpoint retranscribe.json
+#
+# Rows are streamed in voice_id order and fanned out to a process pool; the
+# checkpoint records the highest voice_id below which everything is done, so
+# an interrupted run continues where it stopped when started again.
+
+# Per-process HTTP client, created by the pool initializer
+_client: Optional[httpx.Client] = None
+
+
+def _init_worker(timeout: float):
+    global _client
+    # Forked workers must not reuse the parent's pooled database connections
+    engine.dispose(close=False)
+    _client = httpx.Client(timeout=timeout)
+
+
+def _transcribe_stored(item: Dict, store_dir: str, url: str) -> Tuple[int, Optional[str], Optional[str]]:
+    """Runs in a pool process: returns (voice_id, text, error)"""
+    try:
+        mapped = audio_store.open_mapped(item["audio_sha256"], store_dir)
+    except (OSError, ValueError) as e:
+        return item["voice_id"], None, f"Audio not available: {e}"
+
+    try:
+        format = item["audio_format"] or "wav"
+        # The mapped file is streamed to Whisper in chunks, never copied whole
+        if voice_service.is_pcm_format(format):
+            response = _client.post(
+                url,
+                content=iter(lambda: mapped.read(1 << 20), b""),
+                headers={
+                    "Content-Type": "application/octet-stream",
+                    "X-Audio-Encoding": format,
+                    "X-Sample-Rate": str(item["audio_sample_rate"] or 16000)
+                }
+            )
+        else:
+            mime_type = voice_service.AUDIO_MIME_TYPES.get(format, "application/octet-stream")
+            response = _client.post(url, files={"audio": (f"audio.{format}", mapped, mime_type)})
+
+        if response.status_code != 200:
+            return item["voice_id"], None, f"Whisper service failed with status: {response.status_code}"
+        return item["voice_id"], response.json().get("text", ""), None
+    except Exception as e:
+        return item["voice_id"], None, str(e)
+    finally:
+        mapped.close()
+
+
+def stream_stored_voice(db: Session, after_id: int, voice_ids: Optional[List[int]] = None) -> Iterator[Dict]:
+    """Voice rows with stored audio, in voice_id order, through a server-side cursor"""
+    query = """
+        SELECT voice_id, user_text, audio_sha256, audio_format, audio_sample_rate
+        FROM voice
+        WHERE audio_sha256 IS NOT NULL AND voice_id > :after_id
+    """
+    params = {"after_id": after_id}
+    if voice_ids is not None:
+        query += " AND voice_id = ANY(:voice_ids)"
+        params["voice_ids"] = voice_ids
+    query += " ORDER BY voice_id"
+
+    result = db.execute(
+        text(query), params,
+        execution_options={"stream_results": True, "yield_per": settings.EXPORT_BATCH_SIZE}
+    )
+    for batch in result.mappings().partitions():
+        for row in batch:
+            yield dict(row)
+
+
+def load_checkpoint(path: Optional[str]) -> Dict:
+    if path and os.path.exists(path):
+        with open(path) as f:
+            return json.load(f)
+    return {"last_voice_id": 0, "updated": 0, "unchanged": 0, "failed": {}}
+
+
+def save_checkpoint(path: Optional[str], state: Dict):
+    if not path:
+        return
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+
+def run(workers: int, checkpoint: Optional[str], limit: int = 0, retry_failed: bool = False,
+        dry_run: bool = False, timeout: float = 600.0) -> Dict:
+    state = load_checkpoint(checkpoint)
+    url = f"{settings.WHISPER_SERVICE_URL}/transcribe"
+
+    # Completion order differs from submission order; the checkpoint only
+    # moves past a voice_id once it and everything before it are finished
+    in_order = deque()
+    finished = set()
+    pending = {}
+    completed = 0
+
+    reader = SessionLocal()
+    writer = SessionLocal()
+
+    def collect(futures):
+        nonlocal completed
+        for future in futures:
+            originals = pending.pop(future)
+            voice_id, new_text, error = future.result()
+            if error:
+                state["failed"][str(voice_id)] = error
+                logger.warning(f"Voice {voice_id}: {error}")
+            else:
+                state["failed"].pop(str(voice_id), None)
+                if new_text.strip() == (originals or "").strip():
+                    state["unchanged"] += 1
+                else:
+                    if not dry_run:
+                        voice_service.update_voice_transcription(writer, voice_id, new_text)
+                    state["updated"] += 1
+            finished.add(voice_id)
+            completed += 1
+
+        while in_order and in_order[0] in finished:
+            finished.discard(in_order[0])
+            state["last_voice_id"] = max(state["last_voice_id"], in_order.popleft())
+        if completed % 100 == 0:
+            save_checkpoint(checkpoint, state)
+
+    if retry_failed:
+        rows = stream_stored_voice(reader, 0, [int(voice_id) for voice_id in state["failed"]])
+    else:
+        rows = stream_stored_voice(reader, state["last_voice_id"])
+
+    pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(timeout,))
+    try:
+        submitted = 0
+        for item in rows:
+            if limit and submitted >= limit:
+                break
+            # Bounded in flight, so memory does not grow with the table
+            while len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+            future = pool.submit(_transcribe_stored, item, settings.AUDIO_STORE_DIR, url)
+            pending[future] = item["user_text"]
+            if not retry_failed:
+                in_order.append(item["voice_id"])
+            submitted += 1
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            collect(done)
+    except KeyboardInterrupt:
+        logger.warning("Interrupted, saving checkpoint")
+        pool.shutdown(wait=False, cancel_futures=True)
+        raise
+    finally:
+        save_checkpoint(checkpoint, state)
+        pool.shutdown(wait=True)
+        reader.close()
+        writer.close()
+
+    logger.info(
+        f"Re-transcription done up to voice ID {state['last_voice_id']}: {state['updated']} updated, "
+        f"{state['unchanged']} unchanged, {len(state['failed'])} failed"
+    )
+    return state
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-transcribe stored voice audio with the current Whisper model")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--checkpoint", default="retranscribe-checkpoint.json",
+                        help="Progress file; an existing one is resumed")
+    parser.add_argument("--limit", type=int, default=0, help="Stop after this many voice turns (0 = all)")
+    parser.add_argument("--retry-failed", action="store_true", help="Only re-run the turns the checkpoint lists as failed")
+    parser.add_argument("--dry-run", action="store_true", help="Transcribe and count changes without writing them")
+    parser.add_argument("--timeout", type=float, default=settings.TRANSCRIPTION_JOB_TIMEOUT_SECONDS)
+    args = parser.parse_args()
+
+    if not audio_store.enabled():
+        parser.error("AUDIO_STORE_DIR is not set")
+    try:
+        run(args.workers, args.checkpoint, args.limit, args.retry_failed, args.dry_run, args.timeout)
+    except KeyboardInterrupt:
+        sys.exit(130)
@@ -2,8 +2,10 @@
 from app.schemas.user import UserCreate, UserResponse
 from app.schemas.chat import (
     ChatRequest, ChatResponse, ChatHistoryResponse, 
-    MessageSaveRequest, MessageResponseUpdate
+    MessageSaveRequest, MessageResponseUpdate,
+    MessageBatchItem, MessageBatchRequest, MessageBatchResult, MessageBatchResponse
 )
 from app.schemas.voice import (
     VoiceTranscribeResponse, VoiceChatResponse, VoiceHistoryResponse
-)
\ No newline at end of file
+)
+from app.schemas.search import SearchResult, SearchResponse
\ No newline at end of file
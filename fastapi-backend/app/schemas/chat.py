@@ -26,6 +26,11 @@ class ChatInfo(BaseModel):
     session_id: str
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    agent_type: Optional[str] = None
+    emotional_state: Optional[str] = None
+    confidence_score: Optional[int] = None
+    requires_immediate_attention: Optional[bool] = None
+    recommendations: Optional[List[str]] = None
     
     class Config:
         from_attributes = True
@@ -42,4 +47,37 @@ class MessageSaveRequest(BaseModel):
     sessionId: Optional[str] = None
 
 class MessageResponseUpdate(BaseModel):
-    response: str
\ No newline at end of file
+    response: str
+    # Optional agent metadata, stored with the response when given
+    agentType: Optional[str] = None
+    emotionalState: Optional[str] = None
+    confidenceScore: Optional[int] = None
+    requiresImmediateAttention: Optional[bool] = None
+    recommendations: Optional[List[str]] = None
+
+class MessageBatchItem(MessageSaveRequest):
+    # An already answered turn carries its response and metadata along
+    response: Optional[str] = None
+    agentType: Optional[str] = None
+    emotionalState: Optional[str] = None
+    confidenceScore: Optional[int] = None
+    requiresImmediateAttention: Optional[bool] = None
+    recommendations: Optional[List[str]] = None
+
+class MessageBatchRequest(BaseModel):
+    # Items are validated one by one so a bad item does not reject the batch
+    messages: List[Any]
+
+class MessageBatchResult(BaseModel):
+    index: int
+    messageId: Optional[int] = None
+    sessionId: Optional[str] = None
+    success: bool
+    error: Optional[str] = None
+
+class MessageBatchResponse(BaseModel):
+    results: List[MessageBatchResult]
+    savedCount: int
+    failedCount: int
+    success: bool
+    error: Optional[str] = None
\ No newline at end of file
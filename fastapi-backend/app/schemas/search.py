@@ -0,0 +1,23 @@
+from pydantic import BaseModel
+from typing import List, Optional
+from datetime import datetime
+
+class SearchResult(BaseModel):
+    source: str
+    id: int
+    user_id: Optional[int] = None
+    session_id: str
+    user_text: str
+    agent_text: Optional[str] = None
+    created_at: Optional[datetime] = None
+    rank: float
+    snippet: Optional[str] = None
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+    query: str
+    limit: int
+    offset: int
+    hasMore: bool
+    success: bool
+    error: Optional[str] = None
@@ -7,6 +7,9 @@ class VoiceTranscribeResponse(BaseModel):
     transcribedText: str
     sessionId: str
     duration: float
+    # "draft" while a two-pass refinement is pending; the version bumps if it replaces the text
+    transcriptStatus: str = "final"
+    transcriptVersion: int = 1
     success: bool
     error: Optional[str] = None
 
@@ -20,6 +23,7 @@ class VoiceChatResponse(BaseModel):
     emotionalState: str
     recommendations: List[str]
     transcriptionDuration: float
+    transcriptStatus: str = "final"
     success: bool
     error: Optional[str] = None
 
@@ -31,6 +35,13 @@ class VoiceInfo(BaseModel):
     session_id: str
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
+    agent_type: Optional[str] = None
+    emotional_state: Optional[str] = None
+    confidence_score: Optional[int] = None
+    requires_immediate_attention: Optional[bool] = None
+    recommendations: Optional[List[str]] = None
+    transcript_version: Optional[int] = None
+    transcript_status: Optional[str] = None
     
     class Config:
         from_attributes = True
@@ -1,4 +1,10 @@
 # Import all services for easier access
 from app.services import user_service
 from app.services import chat_service
-from app.services import voice_service
\ No newline at end of file
+from app.services import voice_service
+from app.services import search_service
+from app.services import timeline_service
+from app.services import analytics_service
+from app.services import session_service
+from app.services import transcription_job_service
+from app.services import changes_service
\ No newline at end of file
@@ -0,0 +1,138 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import Table, bindparam, func, text
+from sqlalchemy.dialects.postgresql import JSONB
+from typing import List, Optional, Dict, Any
+from datetime import date
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Agent result keys and the chats/voice columns they are stored in
+AGENT_METADATA_COLUMNS = {
+    "agentType": "agent_type",
+    "emotionalState": "emotional_state",
+    "confidenceScore": "confidence_score",
+    "requiresImmediateAttention": "requires_immediate_attention",
+    "recommendations": "recommendations"
+}
+
+# Stored as the response when the agents fail; such a turn is not answered
+# and stays out of the rollups
+ERROR_RESPONSE = "Error: Unable to process request"
+
+def metadata_assignments(table: Table) -> Dict[str, Any]:
+    """
+    SET clauses for the agent metadata columns of chats or voice
+
+    Each column takes the new_<column> parameter unless it is None, so one
+    prepared UPDATE serves any subset of metadata.
+    """
+    assignments = {}
+    for column in AGENT_METADATA_COLUMNS.values():
+        type_ = table.c[column].type
+        if isinstance(type_, JSONB):
+            # None must stay SQL NULL for coalesce, not become JSON null
+            type_ = JSONB(none_as_null=True)
+        assignments[column] = func.coalesce(bindparam(f"new_{column}", type_=type_), table.c[column])
+    return assignments
+
+def metadata_params(metadata: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Parameters for metadata_assignments, None for anything not given"""
+    metadata = metadata or {}
+    return {f"new_{column}": metadata.get(column) for column in AGENT_METADATA_COLUMNS.values()}
+
+def agent_metadata(result: Dict[str, Any]) -> Dict[str, Any]:
+    """Column values for the metadata an agent returned, tolerant of missing or odd values"""
+    score = result.get("confidenceScore")
+    attention = result.get("requiresImmediateAttention")
+    recommendations = result.get("recommendations")
+    return {
+        "agent_type": str(result["agentType"])[:50] if result.get("agentType") else None,
+        "emotional_state": str(result["emotionalState"])[:50] if result.get("emotionalState") else None,
+        "confidence_score": int(score) if isinstance(score, (int, float)) else None,
+        "requires_immediate_attention": bool(attention) if attention is not None else None,
+        "recommendations": recommendations if isinstance(recommendations, list) else None
+    }
+
+# Built once, they run on every answered turn
+_COUNT_TURN = text("""
+    INSERT INTO user_daily_stats
+        (user_id, day, chat_turns, voice_turns, attention_flags, confidence_total, confidence_count)
+    VALUES (:user_id, :day, :chat, :voice, :attention, :score, :scored)
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        chat_turns = user_daily_stats.chat_turns + EXCLUDED.chat_turns,
+        voice_turns = user_daily_stats.voice_turns + EXCLUDED.voice_turns,
+        attention_flags = user_daily_stats.attention_flags + EXCLUDED.attention_flags,
+        confidence_total = user_daily_stats.confidence_total + EXCLUDED.confidence_total,
+        confidence_count = user_daily_stats.confidence_count + EXCLUDED.confidence_count
+""")
+
+_COUNT_EMOTION = text("""
+    INSERT INTO user_daily_emotions (user_id, day, emotional_state, turns)
+    VALUES (:user_id, :day, :state, 1)
+    ON CONFLICT (user_id, day, emotional_state) DO UPDATE SET
+        turns = user_daily_emotions.turns + 1
+""")
+
+def record_turn(db: Session, user_id: int, day: date, source: str, metadata: Optional[Dict[str, Any]] = None):
+    """
+    Count one answered turn in the daily rollups
+
+    Runs in the caller's transaction, so the counters commit or roll back
+    together with the response they describe.
+    """
+    metadata = metadata or {}
+    score = metadata.get("confidence_score")
+    db.execute(_COUNT_TURN, {
+        "user_id": user_id,
+        "day": day,
+        "chat": 1 if source == "chat" else 0,
+        "voice": 1 if source == "voice" else 0,
+        "attention": 1 if metadata.get("requires_immediate_attention") else 0,
+        "score": score or 0,
+        "scored": 1 if score is not None else 0
+    })
+
+    if metadata.get("emotional_state"):
+        db.execute(_COUNT_EMOTION, {"user_id": user_id, "day": day, "state": metadata["emotional_state"]})
+
+def get_user_analytics(db: Session, user_id: int, since: Optional[date] = None, until: Optional[date] = None) -> List[Dict[str, Any]]:
+    """Daily rollups for a user, oldest first, read from the precomputed tables only"""
+    params: Dict[str, Any] = {"user_id": user_id}
+    filters = ""
+    if since:
+        filters += " AND day >= :since"
+        params["since"] = since
+    if until:
+        filters += " AND day <= :until"
+        params["until"] = until
+
+    days = db.execute(text(f"""
+        SELECT day, chat_turns, voice_turns, attention_flags, confidence_total, confidence_count
+        FROM user_daily_stats
+        WHERE user_id = :user_id {filters}
+        ORDER BY day
+    """), params).mappings().all()
+    emotions = db.execute(text(f"""
+        SELECT day, emotional_state, turns
+        FROM user_daily_emotions
+        WHERE user_id = :user_id {filters}
+    """), params).all()
+
+    states_by_day: Dict[date, Dict[str, int]] = {}
+    for day, state, turns in emotions:
+        states_by_day.setdefault(day, {})[state] = turns
+
+    return [
+        {
+            "day": row["day"],
+            "chatTurns": row["chat_turns"],
+            "voiceTurns": row["voice_turns"],
+            "attentionFlags": row["attention_flags"],
+            "averageConfidence": (
+                round(row["confidence_total"] / row["confidence_count"], 2) if row["confidence_count"] else None
+            ),
+            "emotionalStates": states_by_day.get(row["day"], {})
+        }
+        for row in days
+    ]
@@ -0,0 +1,112 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import List, Optional, Dict, Any, Tuple
+from datetime import datetime
+import base64
+import logging
+
+import orjson
+
+from app.services.search_service import SOURCES
+
+logger = logging.getLogger(__name__)
+
+# Change feed for client sync: chats and voice rows of a user ordered by
+# (updated_at, modality, id). The cursor is the last row's key, so a client
+# stores it and later asks only for what was inserted or updated since.
+
+# Columns only one source has; the other selects NULL
+SOURCE_COLUMNS = {
+    "chat": {"transcript_version": "NULL::integer", "transcript_status": "NULL::varchar"},
+    "voice": {"transcript_version": "t.transcript_version", "transcript_status": "t.transcript_status"}
+}
+
+
+def encode_cursor(item: Dict[str, Any]) -> str:
+    key = [item["updated_at"].isoformat(), item["modality"], item["id"]]
+    return base64.urlsafe_b64encode(orjson.dumps(key)).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str, int]:
+    """Raises ValueError for anything that is not a cursor from encode_cursor"""
+    try:
+        updated_at, modality, item_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if modality not in SOURCES:
+            raise ValueError(modality)
+        return datetime.fromisoformat(updated_at), modality, int(item_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _branch(source: str, owner: str, after: bool) -> str:
+    columns = SOURCES[source]
+    extra = ", ".join(f"{expression} AS {name}" for name, expression in SOURCE_COLUMNS[source].items())
+    # The plain updated_at bound lets (user_id, updated_at) index the branch;
+    # the row comparison breaks ties within the same timestamp
+    keyset = (
+        f"AND t.updated_at >= :after_updated_at "
+        f"AND (t.updated_at, '{source}', t.{columns['id']}) > (:after_updated_at, :after_modality, :after_id)"
+        if after else ""
+    )
+    return f"""
+        (SELECT '{source}' AS modality,
+                t.{columns['id']} AS id,
+                t.user_id,
+                t.session_id,
+                t.{columns['user_text']} AS user_text,
+                t.{columns['agent_text']} AS agent_text,
+                t.agent_type,
+                t.emotional_state,
+                t.confidence_score,
+                t.requires_immediate_attention,
+                t.recommendations,
+                {extra},
+                t.created_at,
+                t.updated_at
+         FROM {columns['table']} t
+         WHERE t.{owner} = :owner
+           AND t.updated_at < LOCALTIMESTAMP - make_interval(secs => :settle) {keyset}
+         ORDER BY t.updated_at, t.{columns['id']}
+         LIMIT :limit)
+    """
+
+
+def get_user_changes(
+    db: Session,
+    user_id: int,
+    cursor: Optional[str] = None,
+    limit: int = 100,
+    settle_seconds: float = 0.0
+) -> Dict[str, Any]:
+    """
+    Chat and voice rows of a user inserted or updated after cursor, oldest change first
+
+    Rows stamped within the last settle_seconds are held back for a later
+    call. nextCursor is always the one to send next time, the given cursor
+    again when nothing changed.
+    """
+    params: Dict[str, Any] = {"owner": user_id, "limit": limit + 1, "settle": settle_seconds}
+    if cursor:
+        params["after_updated_at"], params["after_modality"], params["after_id"] = decode_cursor(cursor)
+
+    sql = " UNION ALL ".join(_branch(source, "user_id", cursor is not None) for source in SOURCES)
+    sql += " ORDER BY updated_at, modality, id LIMIT :limit"
+
+    rows = db.execute(text(sql), params).mappings().all()
+    changes: List[Dict[str, Any]] = [dict(row) for row in rows[:limit]]
+    return {
+        "changes": changes,
+        "nextCursor": encode_cursor(changes[-1]) if changes else cursor,
+        "hasMore": len(rows) > limit
+    }
+
+
+def get_session_changes(db: Session, session_id: str, since: datetime, limit: int = 200) -> List[Dict[str, Any]]:
+    """Rows of a session stamped at or after since, oldest change first, nothing held back"""
+    params = {
+        "owner": session_id, "limit": limit, "settle": 0,
+        "after_updated_at": since, "after_modality": "", "after_id": 0
+    }
+    sql = " UNION ALL ".join(_branch(source, "session_id", True) for source in SOURCES)
+    sql += " ORDER BY updated_at, modality, id LIMIT :limit"
+    return [dict(row) for row in db.execute(text(sql), params).mappings()]
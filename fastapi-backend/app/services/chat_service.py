@@ -1,44 +1,169 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import Select, bindparam, func, insert, literal_column, or_, select, text, update
+from sqlalchemy.engine import Row
 from app.models.chat import Chat
-from typing import List, Optional
+from app.database import record_write
+from app import history_cache
+from app.services import analytics_service, session_service
+from typing import List, Optional, Dict, Any, Sequence, Tuple
+from functools import lru_cache
+from datetime import datetime
 import logging
 import uuid
 
 logger = logging.getLogger(__name__)
 
-def save_user_message(db: Session, user_id: int, message: str, session_id: str) -> Chat:
-    """Save user message"""
-    db_message = Chat(
-        user_id=user_id,
-        message=message,
-        session_id=session_id
-    )
-    db.add(db_message)
+_chats = Chat.__table__
+
+# Hot paths run statements built once at import, so SQLAlchemy's compiled
+# cache goes straight to execution. Writes use RETURNING instead of an ORM
+# add/refresh or select-then-modify round trip.
+_INSERT_MESSAGE = insert(_chats).returning(_chats.c.message_id, _chats.c.created_at)
+
+_SAVE_RESPONSE = (
+    update(_chats)
+    .where(_chats.c.message_id == bindparam("target_id"))
+    .values(response=bindparam("new_response"), **analytics_service.metadata_assignments(_chats))
+    .returning(_chats.c.user_id, _chats.c.session_id, _chats.c.created_at)
+)
+# Only matches a turn that is not answered yet. A concurrent save blocked on
+# the same row re-checks this predicate against the committed version under
+# READ COMMITTED, so exactly one of them counts the turn.
+_SAVE_FIRST_RESPONSE = _SAVE_RESPONSE.where(or_(
+    _chats.c.response.is_(None), _chats.c.response == analytics_service.ERROR_RESPONSE
+))
+
+def save_user_message(db: Session, user_id: int, message: str, session_id: str) -> Row:
+    """Save user message, returning its message_id and created_at"""
+    row = db.execute(_INSERT_MESSAGE, {"user_id": user_id, "message": message, "session_id": session_id}).one()
+    session_service.touch_session(db, session_id, user_id, "chat", message)
+    history_cache.mark_changed(db, "chats", session_id)
     db.commit()
-    db.refresh(db_message)
-    logger.info(f"User message saved with ID: {db_message.message_id}")
-    return db_message
-
-def save_agent_response(db: Session, message_id: int, response: str) -> bool:
-    """Save agent response"""
-    db_message = db.query(Chat).filter(Chat.message_id == message_id).first()
-    if not db_message:
+    record_write(user_id, session_id)
+    logger.info(f"User message saved with ID: {row.message_id}")
+    return row
+
+def save_agent_response(db: Session, message_id: int, response: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+    """
+    Save agent response and the agent metadata columns, counting the turn in the daily rollups
+
+    A turn is counted once, when its first real response is saved; the
+    ERROR_RESPONSE placeholder and later overwrites are not counted.
+    """
+    params = {"target_id": message_id, "new_response": response, **analytics_service.metadata_params(metadata)}
+    answered = response != analytics_service.ERROR_RESPONSE
+    row = db.execute(_SAVE_FIRST_RESPONSE, params).first() if answered else None
+    if row and row.user_id is not None:
+        day = (row.created_at or datetime.now()).date()
+        analytics_service.record_turn(db, row.user_id, day, "chat", metadata)
+    elif not row:
+        # Already answered (or an error placeholder): overwrite without counting
+        row = db.execute(_SAVE_RESPONSE, params).first()
+    if not row:
         logger.error(f"Failed to save agent response - message not found: {message_id}")
         return False
         
-    db_message.response = response
+    history_cache.mark_changed(db, "chats", row.session_id)
     db.commit()
+    record_write(row.user_id, row.session_id)
     logger.info(f"Agent response saved for message ID: {message_id}")
     return True
 
-def get_chat_history(db: Session, user_id: int, limit: int = 50) -> List[Chat]:
-    """Get chat history for user"""
-    return db.query(Chat).filter(
-        Chat.user_id == user_id
-    ).order_by(Chat.created_at.desc()).limit(limit).all()
-
-def get_chats_by_session(db: Session, session_id: str) -> List[Chat]:
-    """Get chats by session ID"""
-    return db.query(Chat).filter(
-        Chat.session_id == session_id
-    ).order_by(Chat.created_at.asc()).all()
\ No newline at end of file
+# One multi-row INSERT for a whole batch (SQLAlchemy's insertmanyvalues),
+# ids returned in parameter order. Rows are spaced a microsecond apart so
+# the turns of a session keep their order in history sorted by created_at.
+_INSERT_BATCH = (
+    insert(_chats)
+    .values(created_at=func.localtimestamp() + bindparam("position") * literal_column("interval '1 microsecond'"))
+    .returning(_chats.c.message_id, _chats.c.created_at, sort_by_parameter_order=True)
+)
+
+def save_message_batch(db: Session, items: List[Dict[str, Any]]) -> List[Optional[int]]:
+    """
+    Save many user messages, optionally already answered, in one transaction
+
+    Items are dicts with user_id, message, session_id, response and the agent
+    metadata columns. Returns the message ids in item order, None for items
+    whose user does not exist; those are left out rather than failing the
+    whole statement on the foreign key.
+    """
+    user_ids = {item["user_id"] for item in items}
+    known_users = set(db.execute(
+        text("SELECT user_id FROM users WHERE user_id = ANY(:user_ids)"), {"user_ids": list(user_ids)}
+    ).scalars())
+    valid = [(index, item) for index, item in enumerate(items) if item["user_id"] in known_users]
+    message_ids: List[Optional[int]] = [None] * len(items)
+    if not valid:
+        return message_ids
+
+    rows = db.execute(_INSERT_BATCH, [
+        {
+            "user_id": item["user_id"],
+            "message": item["message"],
+            "session_id": item["session_id"],
+            "response": item.get("response"),
+            "position": position,
+            **{column: item.get(column) for column in analytics_service.AGENT_METADATA_COLUMNS.values()}
+        }
+        for position, (index, item) in enumerate(valid)
+    ]).all()
+
+    # Bookkeeping once per session, and once per answered turn for the rollups
+    sessions: Dict[str, Dict[str, Any]] = {}
+    for (index, item), row in zip(valid, rows):
+        message_ids[index] = row.message_id
+        session = sessions.setdefault(item["session_id"], {"user_id": item["user_id"], "turns": 0})
+        session["turns"] += 1
+        session["message"] = item["message"]
+        if item.get("response") is not None:
+            analytics_service.record_turn(db, item["user_id"], row.created_at.date(), "chat", item)
+    for session_id, session in sessions.items():
+        session_service.touch_session(db, session_id, session["user_id"], "chat", session["message"], session["turns"])
+        history_cache.mark_changed(db, "chats", session_id)
+    db.commit()
+
+    for session_id, session in sessions.items():
+        record_write(session["user_id"], session_id)
+    logger.info(f"Message batch saved: {len(valid)} of {len(items)} messages across {len(sessions)} sessions")
+    return message_ids
+
+# Columns the history endpoints expose, in response order
+CHAT_FIELDS = (
+    "message_id", "user_id", "message", "response", "session_id", "created_at", "updated_at",
+    "agent_type", "emotional_state", "confidence_score", "requires_immediate_attention", "recommendations"
+)
+
+def get_chat_rows(
+    db: Session,
+    user_id: Optional[int] = None,
+    session_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    since: Optional[datetime] = None,
+    fields: Sequence[str] = CHAT_FIELDS
+) -> List[Dict[str, Any]]:
+    """
+    Chat history as plain dicts, selected with Core so no ORM objects are built
+
+    User history is newest first, session history oldest first.
+    """
+    params = {"user_id": user_id, "session_id": session_id, "since": since, "limit": limit}
+    query = _rows_query(
+        tuple(fields), user_id is not None, session_id is not None, since is not None, limit is not None
+    )
+    # Plain tuples zipped with the field names, no Row mapping per column
+    return [dict(zip(fields, row)) for row in db.execute(query, params).tuples()]
+
+@lru_cache(maxsize=128)
+def _rows_query(fields: Tuple[str, ...], by_user: bool, by_session: bool, bounded: bool, limited: bool) -> Select:
+    columns = _chats.c
+    query = select(*[columns[field] for field in fields])
+    if by_user:
+        query = query.where(columns.user_id == bindparam("user_id"))
+    if by_session:
+        query = query.where(columns.session_id == bindparam("session_id"))
+    if bounded:
+        query = query.where(columns.created_at >= bindparam("since"))
+    query = query.order_by(columns.created_at.asc() if by_session else columns.created_at.desc())
+    if limited:
+        query = query.limit(bindparam("limit"))
+    return query
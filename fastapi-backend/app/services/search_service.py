@@ -0,0 +1,118 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import List, Optional, Dict, Any
+from datetime import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Per-source SQL fragments: both tables are exposed with the same column names
+# so one UNION ALL can rank chat and voice matches together
+SOURCES = {
+    "chat": {
+        "table": "chats",
+        "id": "message_id",
+        "user_text": "message",
+        "agent_text": "response"
+    },
+    "voice": {
+        "table": "voice",
+        "id": "voice_id",
+        "user_text": "user_text",
+        "agent_text": "agent_response"
+    }
+}
+
+# Cached result of the pg_trgm lookup, fuzzy search needs the extension
+_trigram_available: Optional[bool] = None
+
+def trigram_available(db: Session) -> bool:
+    """Whether pg_trgm is installed, checked once per process"""
+    global _trigram_available
+    if _trigram_available is None:
+        row = db.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first()
+        _trigram_available = row is not None
+    return _trigram_available
+
+def _source_query(source: str, filters: List[str], fuzzy: bool) -> str:
+    columns = SOURCES[source]
+    if fuzzy:
+        # Trigram word similarity, served by the gin_trgm_ops indexes
+        match = f"(:query <% t.{columns['user_text']} OR :query <% t.{columns['agent_text']})"
+        rank = (
+            f"GREATEST(word_similarity(:query, t.{columns['user_text']}), "
+            f"word_similarity(:query, coalesce(t.{columns['agent_text']}, '')))"
+        )
+    else:
+        match = "t.search_vector @@ websearch_to_tsquery('english', :query)"
+        rank = "ts_rank_cd(t.search_vector, websearch_to_tsquery('english', :query))"
+
+    where = " AND ".join([match] + filters)
+    return f"""
+        SELECT '{source}' AS source,
+               t.{columns['id']} AS id,
+               t.user_id,
+               t.session_id,
+               t.{columns['user_text']} AS user_text,
+               t.{columns['agent_text']} AS agent_text,
+               t.created_at,
+               {rank} AS rank
+        FROM {columns['table']} t
+        WHERE {where}
+    """
+
+def search_history(
+    db: Session,
+    query: str,
+    user_id: Optional[int] = None,
+    session_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    sources: Optional[List[str]] = None,
+    fuzzy: bool = False,
+    limit: int = 20,
+    offset: int = 0
+) -> Dict[str, Any]:
+    """Ranked full-text search over chat and voice history"""
+    sources = [source for source in (sources or list(SOURCES)) if source in SOURCES]
+    if not sources:
+        return {"results": [], "hasMore": False}
+
+    params: Dict[str, Any] = {"query": query, "limit": limit + 1, "offset": offset}
+    filters = []
+    if user_id is not None:
+        filters.append("t.user_id = :user_id")
+        params["user_id"] = user_id
+    if session_id:
+        filters.append("t.session_id = :session_id")
+        params["session_id"] = session_id
+    if since:
+        filters.append("t.created_at >= :since")
+        params["since"] = since
+    if until:
+        filters.append("t.created_at < :until")
+        params["until"] = until
+
+    matches = " UNION ALL ".join(_source_query(source, filters, fuzzy) for source in sources)
+
+    # Snippets are only built for the rows on the requested page
+    snippet = (
+        "left(page.user_text, 200)" if fuzzy else
+        "ts_headline('english', page.user_text || ' ' || coalesce(page.agent_text, ''), "
+        "websearch_to_tsquery('english', :query), 'MaxFragments=2, MaxWords=20, MinWords=5')"
+    )
+    sql = f"""
+        SELECT page.*, {snippet} AS snippet
+        FROM (
+            {matches}
+            ORDER BY rank DESC, created_at DESC
+            LIMIT :limit OFFSET :offset
+        ) page
+        ORDER BY page.rank DESC, page.created_at DESC
+    """
+
+    rows = db.execute(text(sql), params).mappings().all()
+    has_more = len(rows) > limit
+    results = [dict(row) for row in rows[:limit]]
+    logger.info(f"Search returned {len(results)} results (fuzzy={fuzzy})")
+    return {"results": results, "hasMore": has_more}
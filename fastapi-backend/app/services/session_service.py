@@ -0,0 +1,81 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import List, Optional, Dict, Any, Tuple
+from datetime import datetime
+import base64
+import logging
+
+import orjson
+
+logger = logging.getLogger(__name__)
+
+PREVIEW_LENGTH = 200
+
+# Built once, it runs on every chat and voice turn
+_TOUCH_SESSION = text("""
+    INSERT INTO sessions (
+        session_id, user_id, first_activity_at, last_activity_at,
+        chat_turns, voice_turns, last_message_preview, last_modality
+    )
+    VALUES (:session_id, :user_id, now(), now(), :chat, :voice, :preview, :modality)
+    ON CONFLICT (session_id) DO UPDATE SET
+        user_id = coalesce(EXCLUDED.user_id, sessions.user_id),
+        last_activity_at = greatest(sessions.last_activity_at, EXCLUDED.last_activity_at),
+        chat_turns = sessions.chat_turns + EXCLUDED.chat_turns,
+        voice_turns = sessions.voice_turns + EXCLUDED.voice_turns,
+        last_message_preview = EXCLUDED.last_message_preview,
+        last_modality = EXCLUDED.last_modality
+""")
+
+def touch_session(db: Session, session_id: str, user_id: Optional[int], modality: str, message: str, turns: int = 1):
+    """
+    Record new chat or voice turns in the sessions table, message being the latest
+
+    Runs in the caller's transaction, before its commit, so the sessions row
+    never disagrees with the history it summarises.
+    """
+    db.execute(_TOUCH_SESSION, {
+        "session_id": session_id,
+        "user_id": user_id,
+        "chat": turns if modality == "chat" else 0,
+        "voice": turns if modality == "voice" else 0,
+        "preview": (message or "")[:PREVIEW_LENGTH],
+        "modality": modality
+    })
+
+def encode_cursor(row: Dict[str, Any]) -> str:
+    key = [row["last_activity_at"].isoformat(), row["session_id"]]
+    return base64.urlsafe_b64encode(orjson.dumps(key)).decode("ascii")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Raises ValueError for anything that is not a cursor from encode_cursor"""
+    try:
+        last_activity_at, session_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(last_activity_at), str(session_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def get_user_sessions(db: Session, user_id: int, limit: int = 20, cursor: Optional[str] = None) -> Dict[str, Any]:
+    """A user's sessions, most recently active first, one index range scan per page"""
+    params: Dict[str, Any] = {"user_id": user_id, "limit": limit + 1}
+    keyset = ""
+    if cursor:
+        params["after_activity"], params["after_session"] = decode_cursor(cursor)
+        keyset = "AND (last_activity_at, session_id) < (:after_activity, :after_session)"
+
+    rows = db.execute(text(f"""
+        SELECT session_id, user_id, first_activity_at, last_activity_at,
+               chat_turns, voice_turns, last_message_preview, last_modality
+        FROM sessions
+        WHERE user_id = :user_id {keyset}
+        ORDER BY last_activity_at DESC, session_id DESC
+        LIMIT :limit
+    """), params).mappings().all()
+
+    sessions: List[Dict[str, Any]] = [dict(row) for row in rows[:limit]]
+    has_more = len(rows) > limit
+    return {
+        "sessions": sessions,
+        "nextCursor": encode_cursor(sessions[-1]) if has_more else None,
+        "hasMore": has_more
+    }
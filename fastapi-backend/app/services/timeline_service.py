@@ -0,0 +1,85 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import List, Optional, Dict, Any, Tuple
+from datetime import datetime
+import base64
+import logging
+
+import orjson
+
+from app.services.search_service import SOURCES
+
+logger = logging.getLogger(__name__)
+
+# Timeline items are ordered by (created_at, modality, id); the cursor is the
+# last item's key so the next page starts right after it without OFFSET
+
+
+def encode_cursor(item: Dict[str, Any]) -> str:
+    key = [item["created_at"].isoformat(), item["modality"], item["id"]]
+    return base64.urlsafe_b64encode(orjson.dumps(key)).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str, int]:
+    """Raises ValueError for anything that is not a cursor from encode_cursor"""
+    try:
+        created_at, modality, item_id = orjson.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        if modality not in SOURCES:
+            raise ValueError(modality)
+        return datetime.fromisoformat(created_at), modality, int(item_id)
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+def _branch(source: str, after: bool) -> str:
+    columns = SOURCES[source]
+    # The plain created_at bound lets (session_id, created_at) index the
+    # branch; the row comparison breaks ties within the same timestamp
+    keyset = (
+        f"AND t.created_at >= :after_created_at "
+        f"AND (t.created_at, '{source}', t.{columns['id']}) > (:after_created_at, :after_modality, :after_id)"
+        if after else ""
+    )
+    return f"""
+        (SELECT '{source}' AS modality,
+                t.{columns['id']} AS id,
+                t.user_id,
+                t.session_id,
+                t.{columns['user_text']} AS user_text,
+                t.{columns['agent_text']} AS agent_text,
+                t.created_at,
+                t.updated_at
+         FROM {columns['table']} t
+         WHERE t.session_id = :session_id {keyset}
+         ORDER BY t.created_at, t.{columns['id']}
+         LIMIT :limit)
+    """
+
+
+def get_session_timeline(
+    db: Session,
+    session_id: str,
+    limit: int = 50,
+    cursor: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Chat and voice turns of a session in one chronological page
+
+    Each branch is limited on its own before the merge, so a page reads at
+    most limit + 1 rows from each table.
+    """
+    params: Dict[str, Any] = {"session_id": session_id, "limit": limit + 1}
+    if cursor:
+        params["after_created_at"], params["after_modality"], params["after_id"] = decode_cursor(cursor)
+
+    sql = " UNION ALL ".join(_branch(source, cursor is not None) for source in SOURCES)
+    sql += " ORDER BY created_at, modality, id LIMIT :limit"
+
+    rows = db.execute(text(sql), params).mappings().all()
+    items: List[Dict[str, Any]] = [dict(row) for row in rows[:limit]]
+    has_more = len(rows) > limit
+    return {
+        "items": items,
+        "nextCursor": encode_cursor(items[-1]) if has_more else None,
+        "hasMore": has_more
+    }
@@ -0,0 +1,173 @@
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+from typing import List, Optional, Dict, Any, Tuple
+import asyncio
+import logging
+import threading
+import uuid
+
+from app import notifications
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Workers announce finished jobs here so long-polling requests wake up
+NOTIFY_CHANNEL = "transcription_jobs"
+
+FINISHED_STATUSES = ("done", "failed")
+
+JOB_COLUMNS = """
+    job_id, user_id, session_id, status, format, attempts, error,
+    voice_id, transcribed_text, duration, created_at, started_at, finished_at
+"""
+
+def _job(row) -> Dict[str, Any]:
+    job = dict(row)
+    job["job_id"] = str(job["job_id"])
+    return job
+
+def create_job(db: Session, user_id: int, session_id: str, audio: bytes, format: str, sample_rate: int) -> Dict[str, Any]:
+    """Queue audio for a transcription worker"""
+    job = db.execute(text(f"""
+        INSERT INTO transcription_jobs (job_id, user_id, session_id, format, sample_rate, audio)
+        VALUES (:job_id, :user_id, :session_id, :format, :sample_rate, :audio)
+        RETURNING {JOB_COLUMNS}
+    """), {
+        "job_id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "session_id": session_id,
+        "format": format,
+        "sample_rate": sample_rate,
+        "audio": audio
+    }).mappings().one()
+    db.commit()
+    logger.info(f"Queued transcription job {job['job_id']} for session {session_id}")
+    return _job(job)
+
+def get_job(db: Session, job_id: str) -> Optional[Dict[str, Any]]:
+    job = db.execute(
+        text(f"SELECT {JOB_COLUMNS} FROM transcription_jobs WHERE job_id = :job_id"),
+        {"job_id": job_id}
+    ).mappings().first()
+    return _job(job) if job else None
+
+def claim_job(db: Session) -> Optional[Dict[str, Any]]:
+    """
+    Take the oldest runnable job, or None
+
+    SKIP LOCKED lets any number of workers claim concurrently without
+    blocking on each other. A running job whose lease ran out (its worker
+    died) is runnable again.
+    """
+    job = db.execute(text("""
+        UPDATE transcription_jobs SET
+            status = 'running',
+            attempts = attempts + 1,
+            started_at = now(),
+            locked_until = now() + make_interval(secs => :lease)
+        WHERE job_id = (
+            SELECT job_id FROM transcription_jobs
+            WHERE (status = 'queued' AND available_at <= now())
+               OR (status = 'running' AND locked_until < now())
+            ORDER BY available_at
+            FOR UPDATE SKIP LOCKED
+            LIMIT 1
+        )
+        RETURNING job_id, user_id, session_id, format, sample_rate, audio, attempts
+    """), {"lease": settings.TRANSCRIPTION_JOB_LEASE_SECONDS}).mappings().first()
+    db.commit()
+    return _job(job) if job else None
+
+def finish_job(db: Session, job_id: str, attempts: int, transcribed_text: str, duration: float) -> bool:
+    """
+    Mark a job done without committing
+
+    The caller commits together with the voice row, so a job is never done
+    without its transcription saved, or saved twice after a retry. Returns
+    False when the attempt no longer owns the job (its lease ran out and
+    another worker claimed it), in which case nothing must be saved.
+    """
+    result = db.execute(text("""
+        UPDATE transcription_jobs SET
+            status = 'done', transcribed_text = :text, duration = :duration,
+            audio = NULL, error = NULL, finished_at = now(), locked_until = NULL
+        WHERE job_id = :job_id AND status = 'running' AND attempts = :attempts
+    """), {"job_id": job_id, "attempts": attempts, "text": transcribed_text, "duration": duration})
+    return result.rowcount > 0
+
+def set_voice_id(db: Session, job_id: str, voice_id: int):
+    """Link the saved voice row and wake anyone long-polling the job"""
+    db.execute(
+        text("UPDATE transcription_jobs SET voice_id = :voice_id WHERE job_id = :job_id"),
+        {"job_id": job_id, "voice_id": voice_id}
+    )
+    db.execute(text("SELECT pg_notify(:channel, :job_id)"), {"channel": NOTIFY_CHANNEL, "job_id": job_id})
+    db.commit()
+
+def fail_job(db: Session, job_id: str, attempts: int, error: str):
+    """Requeue with a growing delay, or give up after TRANSCRIPTION_JOB_MAX_ATTEMPTS"""
+    if attempts < settings.TRANSCRIPTION_JOB_MAX_ATTEMPTS:
+        db.execute(text("""
+            UPDATE transcription_jobs SET
+                status = 'queued', error = :error, locked_until = NULL,
+                available_at = now() + make_interval(secs => :delay)
+            WHERE job_id = :job_id AND status = 'running' AND attempts = :attempts
+        """), {"job_id": job_id, "attempts": attempts, "error": error, "delay": 10 * attempts})
+        logger.warning(f"Transcription job {job_id} attempt {attempts} failed, retrying: {error}")
+    else:
+        db.execute(text("""
+            UPDATE transcription_jobs SET
+                status = 'failed', error = :error, audio = NULL,
+                finished_at = now(), locked_until = NULL
+            WHERE job_id = :job_id AND status = 'running' AND attempts = :attempts
+        """), {"job_id": job_id, "attempts": attempts, "error": error})
+        db.execute(text("SELECT pg_notify(:channel, :job_id)"), {"channel": NOTIFY_CHANNEL, "job_id": job_id})
+        logger.error(f"Transcription job {job_id} failed after {attempts} attempts: {error}")
+    db.commit()
+
+# Long-poll waiters in this process, woken by the notification listener thread
+_waiters: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Event]]] = {}
+_waiters_lock = threading.Lock()
+
+def _handle_notification(job_id: str):
+    with _waiters_lock:
+        waiters = _waiters.pop(job_id, [])
+    for loop, event in waiters:
+        loop.call_soon_threadsafe(event.set)
+
+def _wake_all():
+    # A finish may have been missed while disconnected; waiters re-read the job
+    with _waiters_lock:
+        job_ids = list(_waiters)
+    for job_id in job_ids:
+        _handle_notification(job_id)
+
+def subscribe():
+    """Wake long-polls when workers finish jobs, once notifications.start_listener() runs"""
+    notifications.subscribe(NOTIFY_CHANNEL, _handle_notification, on_reconnect=_wake_all)
+
+async def wait_for_job(db: Session, job_id: str, timeout: float) -> Optional[Dict[str, Any]]:
+    """Current job state, waiting up to timeout seconds for it to finish"""
+    event = asyncio.Event()
+    waiter = (asyncio.get_running_loop(), event)
+    with _waiters_lock:
+        _waiters.setdefault(job_id, []).append(waiter)
+    try:
+        # Registered before reading, so a finish in between is not missed
+        job = get_job(db, job_id)
+        if job is None or job["status"] in FINISHED_STATUSES or timeout <= 0:
+            return job
+        # End the read transaction instead of holding it open while waiting
+        db.rollback()
+        try:
+            await asyncio.wait_for(event.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        return get_job(db, job_id)
+    finally:
+        with _waiters_lock:
+            waiters = _waiters.get(job_id)
+            if waiters and waiter in waiters:
+                waiters.remove(waiter)
+                if not waiters:
+                    del _waiters[job_id]
@@ -1,60 +1,235 @@
 from sqlalchemy.orm import Session
+from sqlalchemy import Select, Text, bindparam, case, func, insert, or_, select, update
+from sqlalchemy.engine import Row
 from app.models.voice import Voice
-from typing import List, Optional, Dict, Any, Tuple
+from app.database import SessionLocal, record_write
+from app import history_cache
+from app.services import analytics_service, session_service
+from typing import List, Optional, Dict, Any, Tuple, Sequence
+from functools import lru_cache
+from datetime import datetime
 import logging
+import asyncio
+import difflib
+import re
 import httpx
 import uuid
 from app.config import settings
+from app import audio_store
+from app.fair_queue import FairQueue, whisper_queue, agent_queue, whisper_refine_queue
 
 logger = logging.getLogger(__name__)
 
-def save_voice_transcription(db: Session, user_id: int, user_text: str, session_id: str) -> Voice:
-    """Save user voice transcription"""
-    db_voice = Voice(
-        user_id=user_id,
-        user_text=user_text,
-        session_id=session_id
+_voice = Voice.__table__
+
+# Built once, as in chat_service: RETURNING replaces ORM add/refresh and
+# select-then-modify on the hot write paths
+_INSERT_VOICE = insert(_voice).returning(
+    _voice.c.voice_id, _voice.c.created_at, _voice.c.transcript_status, _voice.c.transcript_version
+)
+
+_SAVE_RESPONSE = (
+    update(_voice)
+    .where(_voice.c.voice_id == bindparam("target_id"))
+    .values(agent_response=bindparam("new_response"), **analytics_service.metadata_assignments(_voice))
+    .returning(_voice.c.user_id, _voice.c.session_id, _voice.c.created_at)
+)
+# Unanswered turns only, so concurrent saves count the turn once (see chat_service)
+_SAVE_FIRST_RESPONSE = _SAVE_RESPONSE.where(or_(
+    _voice.c.agent_response.is_(None), _voice.c.agent_response == analytics_service.ERROR_RESPONSE
+))
+
+# None as new_text only finalises; a different text also bumps the version
+_new_text = bindparam("new_text", type_=Text)
+_UPDATE_TRANSCRIPT = (
+    update(_voice)
+    .where(_voice.c.voice_id == bindparam("target_id"))
+    .values(
+        user_text=func.coalesce(_new_text, _voice.c.user_text),
+        transcript_version=_voice.c.transcript_version + case(
+            (_voice.c.user_text != func.coalesce(_new_text, _voice.c.user_text), 1), else_=0
+        ),
+        transcript_status="final"
     )
-    db.add(db_voice)
+    .returning(_voice.c.user_id, _voice.c.session_id)
+)
+
+def save_voice_transcription(db: Session, user_id: int, user_text: str, session_id: str,
+                             audio: Optional[Dict[str, Any]] = None, draft: bool = False) -> Row:
+    """
+    Save user voice transcription, with the stored audio reference from store_audio if any
+
+    Returns the voice_id, created_at, transcript_status and transcript_version.
+    """
+    row = db.execute(_INSERT_VOICE, {
+        "user_id": user_id,
+        "user_text": user_text,
+        "session_id": session_id,
+        "transcript_status": "draft" if draft else "final",
+        **(audio or {})
+    }).one()
+    session_service.touch_session(db, session_id, user_id, "voice", user_text)
+    history_cache.mark_changed(db, "voice", session_id)
     db.commit()
-    db.refresh(db_voice)
-    logger.info(f"Voice transcription saved with ID: {db_voice.voice_id}")
-    return db_voice
-
-def save_voice_agent_response(db: Session, voice_id: int, agent_response: str) -> bool:
-    """Save agent voice response"""
-    db_voice = db.query(Voice).filter(Voice.voice_id == voice_id).first()
-    if not db_voice:
+    record_write(user_id, session_id)
+    logger.info(f"Voice transcription saved with ID: {row.voice_id}")
+    return row
+
+def save_voice_agent_response(db: Session, voice_id: int, agent_response: str, metadata: Optional[Dict[str, Any]] = None) -> bool:
+    """Save agent voice response and the agent metadata columns, counting the turn in the daily rollups"""
+    params = {"target_id": voice_id, "new_response": agent_response, **analytics_service.metadata_params(metadata)}
+    answered = agent_response != analytics_service.ERROR_RESPONSE
+    row = db.execute(_SAVE_FIRST_RESPONSE, params).first() if answered else None
+    if row and row.user_id is not None:
+        day = (row.created_at or datetime.now()).date()
+        analytics_service.record_turn(db, row.user_id, day, "voice", metadata)
+    elif not row:
+        # Already answered (or an error placeholder): overwrite without counting
+        row = db.execute(_SAVE_RESPONSE, params).first()
+    if not row:
         logger.error(f"Failed to save voice agent response - voice record not found: {voice_id}")
         return False
         
-    db_voice.agent_response = agent_response
+    history_cache.mark_changed(db, "voice", row.session_id)
     db.commit()
+    record_write(row.user_id, row.session_id)
     logger.info(f"Voice agent response saved for voice ID: {voice_id}")
     return True
 
-def get_voice_history(db: Session, user_id: int, limit: int = 50) -> List[Voice]:
-    """Get voice history for user"""
-    return db.query(Voice).filter(
-        Voice.user_id == user_id
-    ).order_by(Voice.created_at.desc()).limit(limit).all()
+def update_voice_transcription(db: Session, voice_id: int, user_text: Optional[str]) -> bool:
+    """
+    Replace the transcribed text of a voice turn and mark it final
 
-def get_voice_by_session(db: Session, session_id: str) -> List[Voice]:
-    """Get voice conversation by session"""
-    return db.query(Voice).filter(
-        Voice.session_id == session_id
-    ).order_by(Voice.created_at.asc()).all()
+    The transcript version is bumped when the text changes, so clients that
+    showed a draft can tell a refinement arrived. None only finalises.
+    """
+    row = db.execute(_UPDATE_TRANSCRIPT, {"target_id": voice_id, "new_text": user_text}).first()
+    if not row:
+        return False
+    # Bumps the session's history version, which is the change notification
+    history_cache.mark_changed(db, "voice", row.session_id)
+    db.commit()
+    record_write(row.user_id, row.session_id)
+    return True
 
-async def transcribe_audio(audio_data: bytes, format: str = "wav") -> Tuple[bool, Dict[str, Any]]:
-    """Send audio to Whisper service for transcription"""
+async def store_audio(audio_data: bytes, format: str, sample_rate: int) -> Optional[Dict[str, Any]]:
+    """Keep the upload in the audio store; returns the voice columns referencing it, None if disabled"""
+    if not audio_store.enabled():
+        return None
     try:
-        files = {"audio": (f"audio.{format}", audio_data, f"audio/{format}")}
-        
-        async with httpx.AsyncClient(timeout=30.0) as client:
-            response = await client.post(
-                f"{settings.WHISPER_SERVICE_URL}/transcribe-realtime",
-                files=files
-            )
+        digest = await asyncio.to_thread(audio_store.put, audio_data)
+    except OSError as e:
+        # Losing the copy only rules out re-transcription, never the request
+        logger.error(f"Could not store audio: {e}")
+        return None
+    return {"audio_sha256": digest, "audio_format": format.lower(), "audio_sample_rate": sample_rate}
+
+# Columns the history endpoints expose, in response order
+VOICE_FIELDS = (
+    "voice_id", "user_id", "user_text", "agent_response", "session_id", "created_at", "updated_at",
+    "agent_type", "emotional_state", "confidence_score", "requires_immediate_attention", "recommendations",
+    "transcript_version", "transcript_status"
+)
+
+def get_voice_rows(
+    db: Session,
+    user_id: Optional[int] = None,
+    session_id: Optional[str] = None,
+    limit: Optional[int] = None,
+    since: Optional[datetime] = None,
+    fields: Sequence[str] = VOICE_FIELDS
+) -> List[Dict[str, Any]]:
+    """Voice history as plain dicts, same ordering rules as chat_service.get_chat_rows"""
+    params = {"user_id": user_id, "session_id": session_id, "since": since, "limit": limit}
+    query = _rows_query(
+        tuple(fields), user_id is not None, session_id is not None, since is not None, limit is not None
+    )
+    return [dict(zip(fields, row)) for row in db.execute(query, params).tuples()]
+
+@lru_cache(maxsize=128)
+def _rows_query(fields: Tuple[str, ...], by_user: bool, by_session: bool, bounded: bool, limited: bool) -> Select:
+    columns = _voice.c
+    query = select(*[columns[field] for field in fields])
+    if by_user:
+        query = query.where(columns.user_id == bindparam("user_id"))
+    if by_session:
+        query = query.where(columns.session_id == bindparam("session_id"))
+    if bounded:
+        query = query.where(columns.created_at >= bindparam("since"))
+    query = query.order_by(columns.created_at.asc() if by_session else columns.created_at.desc())
+    if limited:
+        query = query.limit(bindparam("limit"))
+    return query
+
+# Raw little-endian PCM frames are forwarded as-is; Whisper reads them
+# straight into a NumPy array without a WAV container or ffmpeg decode
+PCM_FORMATS = {"pcm_s16le", "pcm_f32le"}
+
+# MIME types for encoded uploads. Compressed formats (Opus, FLAC, ...) are
+# forwarded in their original encoding and only decoded by Whisper's ffmpeg
+AUDIO_MIME_TYPES = {
+    "wav": "audio/wav",
+    "mp3": "audio/mpeg",
+    "m4a": "audio/mp4",
+    "mp4": "audio/mp4",
+    "webm": "audio/webm",
+    "ogg": "audio/ogg",
+    "opus": "audio/ogg",
+    "flac": "audio/flac"
+}
+
+def is_pcm_format(format: str) -> bool:
+    return bool(format) and format.lower() in PCM_FORMATS
+
+# Only labels uploads for storage and the MIME type sent on; whisper-service
+# sniffs the container again itself (detect_container in
+# whisper-service/audio.py), so change the two together
+def detect_format(audio_data: bytes) -> Optional[str]:
+    """Ogg/Opus, FLAC or WAV from the leading bytes of an encoded upload, None otherwise"""
+    head = audio_data[:64]
+    if head.startswith(b"OggS"):
+        return "opus" if b"OpusHead" in head else "ogg"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return "wav"
+    return None
+
+def resolve_format(audio_data: bytes, format: str) -> str:
+    """
+    The declared format, corrected from the upload's bytes
+
+    Upload forms default to "wav", so an Opus or FLAC file sent without a
+    format field would otherwise be labelled and stored as WAV.
+    """
+    if is_pcm_format(format):
+        return format.lower()
+    return detect_format(audio_data) or (format or "wav").lower()
+
+async def transcribe_audio(audio_data: bytes, format: str = "wav", sample_rate: int = 16000,
+                           user_id: Optional[int] = None, timeout: float = 30.0,
+                           url: Optional[str] = None, queue: FairQueue = whisper_queue) -> Tuple[bool, Dict[str, Any]]:
+    """Send audio to Whisper service for transcription, queued fairly per user"""
+    url = url or f"{settings.WHISPER_SERVICE_URL}/transcribe-realtime"
+    try:
+        async with queue.slot(user_id), httpx.AsyncClient(timeout=timeout) as client:
+            if is_pcm_format(format):
+                response = await client.post(
+                    url,
+                    content=audio_data,
+                    headers={
+                        "Content-Type": "application/octet-stream",
+                        "X-Audio-Encoding": format.lower(),
+                        "X-Sample-Rate": str(sample_rate)
+                    }
+                )
+            else:
+                mime_type = AUDIO_MIME_TYPES.get(format.lower(), "application/octet-stream")
+                files = {"audio": (f"audio.{format}", audio_data, mime_type)}
+                response = await client.post(
+                    url,
+                    files=files
+                )
             
         if response.status_code != 200:
             logger.error(f"Whisper service failed with status: {response.status_code}")
@@ -67,8 +242,68 @@ async def transcribe_audio(audio_data: bytes, format: str = "wav") -> Tuple[bool
         logger.error(f"Error transcribing audio: {str(e)}")
         return False, {"error": str(e)}
 
+def two_pass_enabled() -> bool:
+    return settings.TRANSCRIPTION_TWO_PASS
+
+async def transcribe_draft(audio_data: bytes, format: str = "wav", sample_rate: int = 16000,
+                           user_id: Optional[int] = None) -> Tuple[bool, Dict[str, Any]]:
+    """First pass: realtime decoding on the draft Whisper service (the main one if unset)"""
+    base_url = settings.WHISPER_DRAFT_SERVICE_URL or settings.WHISPER_SERVICE_URL
+    return await transcribe_audio(audio_data, format, sample_rate, user_id, url=f"{base_url}/transcribe-realtime")
+
+def _words(text: str) -> List[str]:
+    return re.findall(r"[\w']+", (text or "").lower())
+
+def material_change(draft: str, refined: str, min_change: float = 0.0) -> bool:
+    """Whether the refined text differs from the draft in more than case, punctuation and spacing"""
+    draft_words, refined_words = _words(draft), _words(refined)
+    if draft_words == refined_words:
+        return False
+    similarity = difflib.SequenceMatcher(None, draft_words, refined_words, autojunk=False).ratio()
+    return 1 - similarity >= min_change
+
+async def refine_transcription(voice_id: int, draft_text: str, audio_data: bytes, format: str,
+                               sample_rate: int, user_id: Optional[int] = None):
+    """Second pass: full /transcribe decoding, replacing the draft if it changed materially"""
+    success, result = await transcribe_audio(
+        audio_data, format, sample_rate, user_id,
+        timeout=settings.TRANSCRIPTION_REFINE_TIMEOUT_SECONDS,
+        url=f"{settings.WHISPER_SERVICE_URL}/transcribe",
+        queue=whisper_refine_queue
+    )
+    refined_text = result.get("text", "") if success else None
+    if not success:
+        # The draft stands; it is still marked final so clients stop waiting
+        logger.warning(f"Refinement of voice ID {voice_id} failed, keeping the draft: {result.get('error')}")
+    elif not material_change(draft_text, refined_text, settings.TRANSCRIPTION_REFINE_MIN_CHANGE):
+        refined_text = None
+
+    def save():
+        db = SessionLocal()
+        try:
+            update_voice_transcription(db, voice_id, refined_text)
+        finally:
+            db.close()
+
+    try:
+        await asyncio.to_thread(save)
+        if refined_text is not None:
+            logger.info(f"Refined transcription saved for voice ID: {voice_id}")
+    except Exception as e:
+        logger.error(f"Could not save refined transcription for voice ID {voice_id}: {e}")
+
+# Running refinements, referenced so they are not garbage collected mid-flight
+_refinements = set()
+
+def start_refinement(voice_id: int, draft_text: str, audio_data: bytes, format: str,
+                     sample_rate: int, user_id: Optional[int] = None):
+    """Run refine_transcription alongside the rest of the request, e.g. the agent call"""
+    task = asyncio.create_task(refine_transcription(voice_id, draft_text, audio_data, format, sample_rate, user_id))
+    _refinements.add(task)
+    task.add_done_callback(_refinements.discard)
+
 async def process_with_ai_agent(message: str, session_id: str, user_id: int, context: Dict = None) -> Tuple[bool, Dict[str, Any]]:
-    """Send text to AI agent for processing"""
+    """Send text to AI agent for processing, queued fairly per user"""
     if context is None:
         context = {"source": "fastapi_backend"}
         
@@ -81,7 +316,7 @@ async def process_with_ai_agent(message: str, session_id: str, user_id: int, con
     }
     
     try:
-        async with httpx.AsyncClient(timeout=30.0) as client:
+        async with agent_queue.slot(user_id), httpx.AsyncClient(timeout=30.0) as client:
             response = await client.post(
                 f"{settings.AI_AGENTS_URL}/process",
                 json=request_data
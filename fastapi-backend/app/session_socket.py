@@ -0,0 +1,415 @@
+from fastapi import WebSocket, WebSocketDisconnect
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Set, Tuple
+import asyncio
+import logging
+import threading
+
+import orjson
+from sqlalchemy import text
+
+from app import history_cache
+from app.config import settings
+from app.database import SessionLocal
+from app.rate_limit import PostgresTokenBuckets, create_buckets
+from app.services import analytics_service, changes_service, chat_service, voice_service
+
+logger = logging.getLogger(__name__)
+
+# One long-lived connection per client and session, /ws/sessions/{id}.
+# JSON text frames unless noted; requestId is echoed back on every reply.
+#
+#   client -> server
+#     {"type": "chat", "message": "...", "requestId": "..."}
+#     {"type": "voice_start", "format": "pcm_s16le", "sampleRate": 16000, "requestId": "..."}
+#     binary frames: audio chunks of the open voice turn
+#     {"type": "voice_end"}
+#     {"type": "ping"} / {"type": "pong"}
+#
+#   server -> client
+#     {"type": "ack", "requestId", "messageId"}                  chat turn saved
+#     {"type": "transcript", "requestId", "voiceId", "text", "transcriptStatus"}
+#     {"type": "agent_response", "requestId", "messageId" | "voiceId", "response", ...}
+#     {"type": "update", "changes": [...]}   rows of the session written elsewhere,
+#                                            e.g. a late response or refined transcript
+#     {"type": "error", "requestId", "error"}
+#     {"type": "ping"} / {"type": "pong"}
+#
+# Turns run one at a time in arrival order. Replies go through a bounded
+# outbox: a client that stops reading is disconnected once a reply has
+# waited WS_SEND_TIMEOUT_SECONDS for room, and update pushes coalesce while
+# it catches up.
+
+# Close codes: going away (idle), try again later (too slow to keep up)
+CLOSE_IDLE = 1001
+CLOSE_SLOW_CONSUMER = 1013
+
+
+class SlowConsumer(Exception):
+    pass
+
+
+class SessionHub:
+    """Open connections per session, woken when the session's history changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._connections: Dict[str, Set["SessionConnection"]] = {}
+
+    def register(self, connection: "SessionConnection"):
+        with self._lock:
+            self._connections.setdefault(connection.session_id, set()).add(connection)
+
+    def unregister(self, connection: "SessionConnection"):
+        with self._lock:
+            connections = self._connections.get(connection.session_id)
+            if connections is not None:
+                connections.discard(connection)
+                if not connections:
+                    del self._connections[connection.session_id]
+
+    def publish(self, kind: str, session_id: str):
+        # Called from any thread by history_cache
+        with self._lock:
+            connections = list(self._connections.get(session_id, ()))
+        for connection in connections:
+            connection.loop.call_soon_threadsafe(connection.changed.set)
+
+    def connection_count(self) -> int:
+        with self._lock:
+            return sum(len(connections) for connections in self._connections.values())
+
+
+hub = SessionHub()
+history_cache.add_change_listener(hub.publish)
+
+# Each turn takes a token, under the same RATE_LIMIT_* settings as the HTTP endpoints
+_buckets = create_buckets()
+
+
+class SessionConnection:
+    def __init__(self, websocket: WebSocket, session_id: str, user_id: int):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.outbox: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self.turns: asyncio.Queue = asyncio.Queue(maxsize=settings.WS_MAX_PENDING_TURNS)
+        self.changed = asyncio.Event()
+        # Voice turn being streamed: (requestId, format, sample rate, audio so far)
+        self.voice: Optional[Tuple[Any, str, int, bytearray]] = None
+        # What was already pushed, so overlapping change reads are not resent
+        self.watermark: Optional[datetime] = None
+        self.pushed: Dict[Tuple[str, int], datetime] = {}
+
+    async def send(self, message: Dict[str, Any]):
+        try:
+            await asyncio.wait_for(self.outbox.put(message), settings.WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise SlowConsumer()
+
+    def send_nowait(self, message: Dict[str, Any]):
+        # Heartbeats are skipped rather than queued behind a full outbox
+        try:
+            self.outbox.put_nowait(message)
+        except asyncio.QueueFull:
+            pass
+
+    async def error(self, request_id: Any, error: str, **extra):
+        await self.send({"type": "error", "requestId": request_id, "error": error, **extra})
+
+    # ----- tasks -----
+
+    async def sender(self):
+        while True:
+            message = await self.outbox.get()
+            await self.websocket.send_text(orjson.dumps(message).decode())
+
+    async def heartbeat(self):
+        while True:
+            await asyncio.sleep(settings.WS_HEARTBEAT_SECONDS)
+            self.send_nowait({"type": "ping"})
+
+    async def reader(self):
+        while True:
+            try:
+                message = await asyncio.wait_for(self.websocket.receive(), settings.WS_IDLE_TIMEOUT_SECONDS)
+            except asyncio.TimeoutError:
+                logger.info(f"WebSocket for session {self.session_id} idle, closing")
+                await self.websocket.close(code=CLOSE_IDLE)
+                return
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes") is not None:
+                await self.on_audio(message["bytes"])
+            elif message.get("text") is not None:
+                await self.on_text(message["text"])
+
+    async def worker(self):
+        while True:
+            turn = await self.turns.get()
+            try:
+                if turn["type"] == "chat":
+                    await self.chat_turn(turn)
+                else:
+                    await self.voice_turn(turn)
+            except SlowConsumer:
+                raise
+            except Exception as e:
+                logger.error(f"WebSocket turn error in session {self.session_id}: {e}")
+                await self.error(turn.get("requestId"), str(e))
+
+    async def pusher(self):
+        self.watermark = await asyncio.to_thread(self._database_now)
+        while True:
+            await self.changed.wait()
+            self.changed.clear()
+            changes = await asyncio.to_thread(self._load_changes)
+            if changes:
+                await self.send({"type": "update", "changes": changes})
+
+    # ----- inbound frames -----
+
+    async def on_text(self, raw: str):
+        try:
+            message = orjson.loads(raw)
+            kind = message["type"]
+        except (orjson.JSONDecodeError, KeyError, TypeError):
+            await self.error(None, "Invalid message")
+            return
+        request_id = message.get("requestId")
+
+        if kind == "ping":
+            await self.send({"type": "pong"})
+        elif kind == "pong":
+            pass
+        elif kind == "chat":
+            if not str(message.get("message") or "").strip():
+                await self.error(request_id, "Message is empty")
+                return
+            await self.queue_turn({"type": "chat", "requestId": request_id, "message": str(message["message"])})
+        elif kind == "voice_start":
+            try:
+                sample_rate = int(message.get("sampleRate") or 16000)
+            except (TypeError, ValueError, OverflowError):
+                sample_rate = 0
+            if sample_rate <= 0:
+                await self.error(request_id, "Invalid sampleRate")
+                return
+            self.voice = (request_id, str(message.get("format") or "pcm_s16le"), sample_rate, bytearray())
+        elif kind == "voice_end":
+            if self.voice is None:
+                await self.error(request_id, "No voice turn in progress")
+                return
+            request_id, format, sample_rate, audio = self.voice
+            self.voice = None
+            if not audio:
+                await self.error(request_id, "No audio data provided")
+                return
+            await self.queue_turn({
+                "type": "voice", "requestId": request_id,
+                "format": voice_service.resolve_format(audio, format),
+                "sampleRate": sample_rate, "audio": bytes(audio)
+            })
+        else:
+            await self.error(request_id, f"Unknown message type: {kind}")
+
+    async def on_audio(self, chunk: bytes):
+        if self.voice is None:
+            await self.error(None, "Audio received outside a voice turn")
+            return
+        request_id, _, _, audio = self.voice
+        if len(audio) + len(chunk) > settings.WS_MAX_AUDIO_BYTES:
+            self.voice = None
+            await self.error(request_id, f"Voice turn exceeds {settings.WS_MAX_AUDIO_BYTES} bytes")
+            return
+        audio.extend(chunk)
+
+    async def queue_turn(self, turn: Dict[str, Any]):
+        retry_after = await self._take_token()
+        if retry_after > 0:
+            await self.error(turn["requestId"], "Rate limit exceeded", retryAfter=round(retry_after, 1))
+            return
+        try:
+            self.turns.put_nowait(turn)
+        except asyncio.QueueFull:
+            await self.error(turn["requestId"], "Too many pending turns")
+
+    async def _take_token(self) -> float:
+        if _buckets is None:
+            return 0.0
+        try:
+            if isinstance(_buckets, PostgresTokenBuckets):
+                return await asyncio.to_thread(_buckets.take, f"user:{self.user_id}")
+            return _buckets.take(f"user:{self.user_id}")
+        except Exception as e:
+            # Fail open, like the HTTP middleware
+            logger.error(f"Rate limit check failed: {e}")
+            return 0.0
+
+    # ----- turns, persisted through the same services as /chat and /voice/chat -----
+
+    async def chat_turn(self, turn: Dict[str, Any]):
+        request_id, message = turn["requestId"], turn["message"]
+        db = SessionLocal()
+        try:
+            message_record = chat_service.save_user_message(db, self.user_id, message, self.session_id)
+            await self.send({"type": "ack", "requestId": request_id, "messageId": message_record.message_id})
+
+            success, agent_result = await voice_service.process_with_ai_agent(
+                message=message,
+                session_id=self.session_id,
+                user_id=self.user_id,
+                context={"source": "websocket"}
+            )
+            await self.agent_reply(
+                db, request_id, agent_result if success else None,
+                agent_result.get("error", "AI agents failed"),
+                save=lambda text, metadata=None: chat_service.save_agent_response(
+                    db, message_record.message_id, text, metadata
+                ),
+                ids={"messageId": message_record.message_id}
+            )
+        finally:
+            db.close()
+
+    async def voice_turn(self, turn: Dict[str, Any]):
+        request_id, audio_data = turn["requestId"], turn["audio"]
+        format, sample_rate = turn["format"], turn["sampleRate"]
+
+        two_pass = voice_service.two_pass_enabled()
+        if two_pass:
+            success, result = await voice_service.transcribe_draft(audio_data, format, sample_rate, self.user_id)
+        else:
+            success, result = await voice_service.transcribe_audio(audio_data, format, sample_rate, self.user_id)
+        if not success:
+            await self.error(request_id, result.get("error", "Failed to transcribe audio"))
+            return
+
+        transcribed_text = result.get("text", "")
+        stored_audio = await voice_service.store_audio(audio_data, format, sample_rate)
+        db = SessionLocal()
+        try:
+            voice_record = voice_service.save_voice_transcription(
+                db, self.user_id, transcribed_text, self.session_id, stored_audio, draft=two_pass
+            )
+            await self.send({
+                "type": "transcript",
+                "requestId": request_id,
+                "voiceId": voice_record.voice_id,
+                "text": transcribed_text,
+                "transcriptStatus": voice_record.transcript_status,
+                "duration": result.get("duration", 0.0)
+            })
+            if two_pass:
+                # The refined text arrives later as an update push
+                voice_service.start_refinement(
+                    voice_record.voice_id, transcribed_text, audio_data, format, sample_rate, self.user_id
+                )
+
+            success, agent_result = await voice_service.process_with_ai_agent(
+                message=transcribed_text,
+                session_id=self.session_id,
+                user_id=self.user_id,
+                context={"source": "websocket_voice", "voice_id": voice_record.voice_id}
+            )
+            await self.agent_reply(
+                db, request_id, agent_result if success else None,
+                agent_result.get("error", "AI agents failed"),
+                save=lambda text, metadata=None: voice_service.save_voice_agent_response(
+                    db, voice_record.voice_id, text, metadata
+                ),
+                ids={"voiceId": voice_record.voice_id}
+            )
+        finally:
+            db.close()
+
+    async def agent_reply(self, db, request_id: Any, agent_result: Optional[Dict[str, Any]], error: str,
+                          save, ids: Dict[str, int]):
+        if agent_result is None:
+            logger.error(error)
+            save(analytics_service.ERROR_RESPONSE)
+            await self.error(request_id, error, **ids)
+            return
+
+        result_json = agent_result.get("result", {})
+        agent_response_text = result_json.get("response", "")
+        save(agent_response_text, analytics_service.agent_metadata(result_json))
+        await self.send({
+            "type": "agent_response",
+            "requestId": request_id,
+            **ids,
+            "response": agent_response_text,
+            "agentType": result_json.get("agentType", "assistant"),
+            "confidenceScore": result_json.get("confidenceScore", 0),
+            "requiresImmediateAttention": result_json.get("requiresImmediateAttention", False),
+            "emotionalState": result_json.get("emotionalState", "neutral"),
+            "recommendations": result_json.get("recommendations", [])
+        })
+
+    # ----- pushes -----
+
+    def _database_now(self) -> datetime:
+        db = SessionLocal()
+        try:
+            return db.execute(text("SELECT LOCALTIMESTAMP")).scalar()
+        finally:
+            db.close()
+
+    def _load_changes(self):
+        # Re-read a settle window before the watermark: a write stamped
+        # earlier may commit after one already pushed
+        overlap = timedelta(seconds=settings.CHANGES_SETTLE_SECONDS)
+        db = SessionLocal()
+        try:
+            rows = changes_service.get_session_changes(db, self.session_id, self.watermark - overlap)
+        finally:
+            db.close()
+
+        changes = []
+        for row in rows:
+            key = (row["modality"], row["id"])
+            if self.pushed.get(key) == row["updated_at"]:
+                continue
+            self.pushed[key] = row["updated_at"]
+            changes.append(row)
+            self.watermark = max(self.watermark, row["updated_at"])
+        # Forget what the overlap window can no longer return
+        horizon = self.watermark - overlap
+        self.pushed = {key: updated_at for key, updated_at in self.pushed.items() if updated_at >= horizon}
+        return changes
+
+
+async def serve(websocket: WebSocket, session_id: str, user_id: int):
+    """Run one session connection until the client leaves, idles out or falls behind"""
+    await websocket.accept()
+    connection = SessionConnection(websocket, session_id, user_id)
+    hub.register(connection)
+    logger.info(f"WebSocket opened for session {session_id}, user {user_id}")
+
+    tasks = [
+        asyncio.create_task(connection.reader()),
+        asyncio.create_task(connection.sender()),
+        asyncio.create_task(connection.worker()),
+        asyncio.create_task(connection.pusher()),
+        asyncio.create_task(connection.heartbeat())
+    ]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.cancelled():
+                continue
+            error = task.exception()
+            if isinstance(error, SlowConsumer):
+                logger.warning(f"WebSocket for session {session_id} is not reading, closing")
+                await websocket.close(code=CLOSE_SLOW_CONSUMER)
+            elif error is not None and not isinstance(error, WebSocketDisconnect):
+                logger.error(f"WebSocket error in session {session_id}: {error}")
+    except Exception as e:
+        logger.debug(f"WebSocket close error in session {session_id}: {e}")
+    finally:
+        hub.unregister(connection)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info(f"WebSocket closed for session {session_id}")
@@ -0,0 +1,89 @@
+from typing import Optional
+import argparse
+import asyncio
+import logging
+
+from app.database import SessionLocal
+from app.config import settings
+from app.services import transcription_job_service, voice_service
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Runs queued /voice/jobs transcriptions. Start as many of these processes
+# as Whisper capacity allows; they coordinate only through the jobs table.
+
+
+async def run_job(job) -> None:
+    audio = bytes(job["audio"])
+    # Queued jobs get the full decoding pass, not the greedy realtime one
+    success, result = await voice_service.transcribe_audio(
+        audio, job["format"], job["sample_rate"], job["user_id"],
+        timeout=settings.TRANSCRIPTION_JOB_TIMEOUT_SECONDS,
+        url=f"{settings.WHISPER_SERVICE_URL}/transcribe"
+    )
+    stored_audio = await voice_service.store_audio(audio, job["format"], job["sample_rate"]) if success else None
+
+    db = SessionLocal()
+    try:
+        if not success:
+            transcription_job_service.fail_job(db, job["job_id"], job["attempts"], result.get("error", "Unknown error"))
+            return
+
+        transcribed_text = result.get("text", "")
+        if not transcription_job_service.finish_job(
+            db, job["job_id"], job["attempts"], transcribed_text, result.get("duration", 0.0)
+        ):
+            logger.warning(f"Transcription job {job['job_id']} was taken over by another worker, dropping result")
+            db.rollback()
+            return
+
+        # Commits the job update together with the voice row
+        voice_record = voice_service.save_voice_transcription(
+            db, job["user_id"], transcribed_text, job["session_id"], stored_audio
+        )
+        transcription_job_service.set_voice_id(db, job["job_id"], voice_record.voice_id)
+        logger.info(f"Transcription job {job['job_id']} done, voice ID {voice_record.voice_id}")
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Transcription job {job['job_id']} error: {e}")
+        transcription_job_service.fail_job(db, job["job_id"], job["attempts"], str(e))
+    finally:
+        db.close()
+
+
+def claim() -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        return transcription_job_service.claim_job(db)
+    finally:
+        db.close()
+
+
+async def worker_loop(worker_id: int):
+    while True:
+        try:
+            job = await asyncio.to_thread(claim)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} could not claim a job: {e}")
+            job = None
+
+        if job is None:
+            await asyncio.sleep(settings.TRANSCRIPTION_WORKER_POLL_SECONDS)
+            continue
+
+        logger.info(f"Worker {worker_id} running job {job['job_id']} (attempt {job['attempts']})")
+        await run_job(job)
+
+
+async def main(concurrency: int):
+    logger.info(f"Transcription worker started with {concurrency} concurrent jobs")
+    await asyncio.gather(*(worker_loop(i) for i in range(concurrency)))
+
+
+if __name__ == "__main__":
+    # python -m app.transcription_worker --concurrency 4
+    parser = argparse.ArgumentParser(description="Run queued transcription jobs")
+    parser.add_argument("--concurrency", type=int, default=settings.TRANSCRIPTION_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))
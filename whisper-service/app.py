@@ -1,7 +1,6 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query
+from fastapi import FastAPI, File, UploadFile, HTTPException, Form, Query, Header, Request
 from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-import whisper
 import uvicorn
 import tempfile
 import os
@@ -9,12 +8,86 @@ import logging
 from typing import Optional
 import time
 import gc
+import asyncio
+from contextlib import asynccontextmanager
+import numpy as np
+from whisper.audio import SAMPLE_RATE
+
+from audio import can_pipe, decode_pcm, detect_container, is_pcm
+from backends import TranscriptionBackend, load_backend
+from replica_pool import ReplicaPool
+from stage_timing import StageStats
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Whisper Speech-to-Text Service", version="1.0.0")
+# Model configuration
+model_name = os.environ.get("WHISPER_MODEL_SIZE", "small")
+model_cache_dir = os.environ.get("WHISPER_CACHE_DIR") or None
+mmap_weights = os.environ.get("WHISPER_MMAP_WEIGHTS", "false").lower() == "true"
+
+# Replica pool mode: share the loaded weights across N forked inference
+# processes instead of running several uvicorn workers with a model each.
+# Run uvicorn with a single worker when this is enabled.
+replica_count = int(os.environ.get("WHISPER_REPLICAS", "0"))
+threads_per_replica = int(os.environ.get("WHISPER_THREADS_PER_REPLICA", "0")) or None
+
+backend: Optional[TranscriptionBackend] = None
+replica_pool: Optional[ReplicaPool] = None
+ready = False
+
+# Per-stage timings of served requests (warm-up excluded), shown on /health
+stage_stats = StageStats()
+
+async def warm_up():
+    """Run synthetic full and realtime transcriptions so the first real request is not cold"""
+    global ready
+    silence = np.zeros(SAMPLE_RATE, dtype=np.float32)
+    start_time = time.time()
+    try:
+        if replica_pool is not None:
+            # Pinned to every replica: least-loaded routing would only reach one or two
+            await replica_pool.warm_up(silence, language="en")
+            await replica_pool.warm_up(silence, language="en", realtime=True)
+        else:
+            await run_transcription(silence, language="en")
+            await run_transcription(silence, language="en", realtime=True)
+        ready = True
+        logger.info(f"Warm-up completed in {time.time() - start_time:.2f} seconds, service is ready")
+    except Exception as e:
+        logger.error(f"Warm-up failed, service stays not ready: {str(e)}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    global backend, replica_pool, ready
+
+    # Load the Whisper backend selected by WHISPER_BACKEND (default openai-whisper)
+    backend = load_backend(
+        model_name=model_name,
+        cache_dir=model_cache_dir,
+        mmap=mmap_weights,
+        workers=max(1, replica_count),
+        threads=threads_per_replica or 0
+    )
+    logger.info("Whisper model loaded successfully!")
+
+    # Backends that cannot be forked parallelise internally over replica_count workers
+    if replica_count > 0 and backend.forkable:
+        replica_pool = ReplicaPool(backend, replica_count, threads_per_replica)
+        replica_pool.start()
+
+    # Warm up in the background so /health answers while /ready stays 503
+    warm_up_task = asyncio.create_task(warm_up())
+
+    yield
+
+    ready = False
+    warm_up_task.cancel()
+    if replica_pool is not None:
+        replica_pool.shutdown()
+
+app = FastAPI(title="Whisper Speech-to-Text Service", version="1.0.0", lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -25,11 +98,13 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# Load Whisper model based on environment variable or default to "small"
-model_name = os.environ.get("WHISPER_MODEL_SIZE", "small")
-logger.info(f"Loading Whisper {model_name} model...")
-model = whisper.load_model(model_name)
-logger.info("Whisper model loaded successfully!")
+async def run_transcription(audio, **options):
+    """Transcribe on the replica pool when enabled, otherwise in-process"""
+    if backend is None:
+        raise HTTPException(status_code=503, detail="Model is still loading")
+    if replica_pool is not None:
+        return await replica_pool.transcribe(audio, **options)
+    return await asyncio.to_thread(backend.transcribe, audio, **options)
 
 @app.get("/health")
 async def health_check():
@@ -37,19 +112,81 @@ async def health_check():
         "status": "healthy",
         "service": "Whisper Speech-to-Text",
         "model": model_name,
+        "backend": backend.describe() if backend else None,
+        "ready": ready,
+        "replicas": replica_pool.stats() if replica_pool else [],
+        "stages": stage_stats.snapshot(),
         "timestamp": time.time()
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness probe: only 200 once the model is loaded and warmed up"""
+    if not ready:
+        return JSONResponse(
+            status_code=503,
+            content={"status": "warming_up", "model": model_name}
+        )
+    return {"status": "ready", "model": model_name}
+
+async def read_upload(request: Request, audio: Optional[UploadFile]) -> bytes:
+    """Audio bytes from the multipart "audio" field, or the raw request body"""
+    if audio is not None:
+        audio_content = await audio.read()
+    else:
+        audio_content = await request.body()
+    if not audio_content or len(audio_content) == 0:
+        raise HTTPException(status_code=400, detail="Empty audio file")
+    return audio_content
+
+def prepare_audio(audio_content: bytes, encoding: Optional[str], sample_rate: int, channels: int):
+    """
+    Returns (audio input, temp file path)
+
+    Raw PCM goes straight into a NumPy array. Compressed formats ffmpeg can
+    read from a pipe (Opus/Ogg, FLAC, WebM, MP3, WAV) are passed on as bytes
+    and decoded by the backend, in the inference thread or replica. Only
+    containers that need seeking (MP4/M4A) are written to a temp file.
+    """
+    if is_pcm(encoding):
+        try:
+            return decode_pcm(audio_content, encoding, sample_rate, channels), None
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    if can_pipe(audio_content):
+        return audio_content, None
+
+    suffix = f".{detect_container(audio_content) or 'wav'}"
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        tmp_file.write(audio_content)
+        return tmp_file.name, tmp_file.name
+
+def request_timing(result, pcm_decode_seconds: float):
+    """Stage timings of one transcription, counting the PCM decode done before it"""
+    timing = dict(result.get("timing", {}))
+    if pcm_decode_seconds:
+        timing["decode_audio"] = timing.get("decode_audio", 0.0) + pcm_decode_seconds
+    stage_stats.record(timing)
+    return timing
+
 @app.post("/transcribe")
 async def transcribe_audio(
-    audio: UploadFile = File(...),
-    language: Optional[str] = Form(None)
+    request: Request,
+    audio: Optional[UploadFile] = File(None),
+    language: Optional[str] = Form(None),
+    audio_encoding: Optional[str] = Header(None, alias="X-Audio-Encoding"),
+    sample_rate: int = Header(SAMPLE_RATE, alias="X-Sample-Rate"),
+    channels: int = Header(1, alias="X-Audio-Channels")
 ):
     """
     Transcribe audio to text using Whisper AI
     
-    - **audio**: Audio file (wav, mp3, m4a, etc.)
+    - **audio**: Audio file (wav, opus/ogg, flac, webm, mp3, m4a, etc.), or raw PCM frames
     - **language**: Optional language code (e.g., "en", "es")
+    - **X-Audio-Encoding**: pcm_s16le or pcm_f32le for raw PCM uploads, sent
+      either as the "audio" field or as an application/octet-stream body
+    - **X-Sample-Rate**: Sample rate of raw PCM uploads (default 16000)
     
     Returns: JSON with transcribed text
     """
@@ -59,40 +196,43 @@ async def transcribe_audio(
     
     try:
         # Validate file
-        if not audio.filename:
+        if audio is not None and not audio.filename:
+            raise HTTPException(status_code=400, detail="No audio file provided")
+        if audio is None and not is_pcm(audio_encoding):
             raise HTTPException(status_code=400, detail="No audio file provided")
         
-        logger.info(f"Processing audio file: {audio.filename}")
+        logger.info(f"Processing audio file: {audio.filename if audio else audio_encoding}")
         
-        # Save uploaded file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            audio_content = await audio.read()
-            if not audio_content or len(audio_content) == 0:
-                raise HTTPException(status_code=400, detail="Empty audio file")
-            tmp_file.write(audio_content)
-            tmp_file_path = tmp_file.name
+        audio_content = await read_upload(request, audio)
+        decode_start = time.perf_counter()
+        audio_input, tmp_file_path = prepare_audio(audio_content, audio_encoding, sample_rate, channels)
+        pcm_decode_seconds = time.perf_counter() - decode_start if is_pcm(audio_encoding) else 0.0
         
         try:
             # Transcribe using Whisper
             logger.info("Starting transcription...")
-            result = model.transcribe(
-                tmp_file_path,
-                language=language,  # Use provided language or auto-detect
-                task="transcribe",
-                fp16=False,  # Use fp32 for better compatibility
-                verbose=False
+            result = await run_transcription(
+                audio_input,
+                language=language  # Use provided language or auto-detect
             )
             
             transcription_time = time.time() - start_time
-            logger.info(f"Transcription completed in {transcription_time:.2f} seconds")
+            timing = request_timing(result, pcm_decode_seconds)
+            logger.info(
+                f"Transcription completed in {transcription_time:.2f} seconds "
+                f"({', '.join(f'{stage} {seconds:.3f}s' for stage, seconds in timing.items())})"
+            )
             
             return JSONResponse(content={
                 "status": "success",
-                "text": result["text"].strip(),
+                "text": result["text"],
                 "language": result.get("language", "en"),
+                "segments": result["segments"],
                 "duration": transcription_time,
                 "confidence": "high",
-                "model": f"whisper-{model_name}"
+                "model": f"whisper-{model_name}",
+                "backend": backend.name,
+                "timing": timing
             })
             
         finally:
@@ -101,6 +241,9 @@ async def transcribe_audio(
                 os.remove(tmp_file_path)
                 logger.debug(f"Temporary file removed: {tmp_file_path}")
                 
+    except HTTPException:
+        # 400s for bad input and the 503 while loading keep their status
+        raise
     except Exception as e:
         logger.error(f"Transcription error: {str(e)}")
         return JSONResponse(
@@ -119,11 +262,17 @@ async def transcribe_audio(
 
 @app.post("/transcribe-realtime")
 async def transcribe_realtime(
-    audio: UploadFile = File(...),
-    language: Optional[str] = Form("en")
+    request: Request,
+    audio: Optional[UploadFile] = File(None),
+    language: Optional[str] = Form("en"),
+    audio_encoding: Optional[str] = Header(None, alias="X-Audio-Encoding"),
+    sample_rate: int = Header(SAMPLE_RATE, alias="X-Sample-Rate"),
+    channels: int = Header(1, alias="X-Audio-Channels")
 ):
     """
     Real-time transcription optimized for speed
+
+    Accepts the same raw PCM upload headers as /transcribe.
     """
     start_time = time.time()
     audio_content = None
@@ -132,41 +281,39 @@ async def transcribe_realtime(
     try:
         logger.info("Processing real-time audio chunk")
         
-        # Save uploaded chunk temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            audio_content = await audio.read()
-            if not audio_content or len(audio_content) == 0:
-                raise HTTPException(status_code=400, detail="Empty audio file")
-            tmp_file.write(audio_content)
-            tmp_file_path = tmp_file.name
+        if audio is None and not is_pcm(audio_encoding):
+            raise HTTPException(status_code=400, detail="No audio file provided")
+        
+        audio_content = await read_upload(request, audio)
+        decode_start = time.perf_counter()
+        audio_input, tmp_file_path = prepare_audio(audio_content, audio_encoding, sample_rate, channels)
+        pcm_decode_seconds = time.perf_counter() - decode_start if is_pcm(audio_encoding) else 0.0
         
         try:
             # Fast transcription settings
-            result = model.transcribe(
-                tmp_file_path,
+            result = await run_transcription(
+                audio_input,
                 language=language,
-                task="transcribe",
-                fp16=False,
-                verbose=False,
-                condition_on_previous_text=False,  # Faster processing
-                temperature=0,  # Deterministic output
-                best_of=1,  # Don't sample multiple times
-                beam_size=1  # Fastest beam search
+                realtime=True
             )
             
             transcription_time = time.time() - start_time
+            timing = request_timing(result, pcm_decode_seconds)
             
             return JSONResponse(content={
                 "status": "success",
                 "text": result["text"].strip(),
                 "duration": transcription_time,
-                "realtime": True
+                "realtime": True,
+                "timing": timing
             })
             
         finally:
             if tmp_file_path and os.path.exists(tmp_file_path):
                 os.remove(tmp_file_path)
                 
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Real-time transcription error: {str(e)}")
         return JSONResponse(
@@ -188,6 +335,7 @@ if __name__ == "__main__":
     print("Service will be available at http://localhost:9000")
     print("Endpoints:")
     print("  - GET  /health: Check service health")
+    print("  - GET  /ready: Readiness (model loaded and warmed up)")
     print("  - POST /transcribe: Transcribe audio file to text")
     print("  - POST /transcribe-realtime: Optimized for real-time audio chunks")
     uvicorn.run(app, host="0.0.0.0", port=9000)
\ No newline at end of file
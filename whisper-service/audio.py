@@ -0,0 +1,96 @@
+import subprocess
+from typing import Optional
+
+import numpy as np
+from whisper.audio import SAMPLE_RATE
+
+# Raw PCM uploads skip the temp file and ffmpeg: the bytes are viewed as a
+# NumPy array and handed to the backend as-is. Clients declare the encoding
+# with X-Audio-Encoding and the rate with X-Sample-Rate.
+PCM_ENCODINGS = {
+    "pcm_s16le": np.dtype("<i2"),
+    "pcm_f32le": np.dtype("<f4")
+}
+
+
+def is_pcm(encoding) -> bool:
+    return bool(encoding) and encoding.lower() in PCM_ENCODINGS
+
+
+def decode_pcm(data: bytes, encoding: str, sample_rate: int = SAMPLE_RATE, channels: int = 1) -> np.ndarray:
+    """Turn raw little-endian PCM frames into the float32 16 kHz mono array Whisper expects"""
+    dtype = PCM_ENCODINGS.get(encoding.lower())
+    if dtype is None:
+        raise ValueError(f"Unsupported PCM encoding {encoding}; expected one of {sorted(PCM_ENCODINGS)}")
+    if sample_rate <= 0 or channels <= 0:
+        raise ValueError("Sample rate and channel count must be positive")
+
+    frame_size = dtype.itemsize * channels
+    if len(data) % frame_size:
+        raise ValueError(f"PCM payload of {len(data)} bytes is not a whole number of {frame_size}-byte frames")
+
+    samples = np.frombuffer(data, dtype=dtype)
+    if dtype.kind == "i":
+        samples = samples.astype(np.float32) / 32768.0
+    elif dtype != np.float32:
+        samples = samples.astype(np.float32)
+
+    if channels > 1:
+        samples = samples.reshape(-1, channels).mean(axis=1, dtype=np.float32)
+
+    if sample_rate != SAMPLE_RATE:
+        samples = resample(samples, sample_rate)
+
+    return samples
+
+
+def resample(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """Linear-interpolation resample to 16 kHz for clients that cannot capture at 16 kHz"""
+    target_length = int(round(len(samples) * SAMPLE_RATE / sample_rate))
+    source_positions = np.arange(target_length, dtype=np.float64) * (sample_rate / SAMPLE_RATE)
+    return np.interp(source_positions, np.arange(len(samples)), samples).astype(np.float32)
+
+
+# Compressed uploads (Opus/Ogg, FLAC, WebM, MP3, WAV) are piped to ffmpeg's
+# stdin and decoded straight to float32 samples: no temp file and no
+# intermediate WAV. MP4/M4A keep their index at the end of the file and need
+# a seekable input, so they still go through a temp file.
+PIPE_CONTAINERS = {"ogg", "opus", "flac", "webm", "mp3", "wav"}
+
+
+# fastapi-backend's voice_service.detect_format recognises a subset of
+# these to label uploads; keep the shared checks in step
+def detect_container(data: bytes) -> Optional[str]:
+    """Container format from the leading bytes, None if unknown"""
+    head = data[:64]
+    if head.startswith(b"OggS"):
+        return "opus" if b"OpusHead" in head else "ogg"
+    if head.startswith(b"fLaC"):
+        return "flac"
+    if head.startswith(b"RIFF") and head[8:12] == b"WAVE":
+        return "wav"
+    if head.startswith(b"\x1aE\xdf\xa3"):
+        return "webm"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head.startswith(b"ID3") or (len(head) > 1 and head[0] == 0xFF and head[1] & 0xE0 == 0xE0):
+        return "mp3"
+    return None
+
+
+def can_pipe(data: bytes) -> bool:
+    return detect_container(data) in PIPE_CONTAINERS
+
+
+def decode_encoded(data: bytes) -> np.ndarray:
+    """Decode compressed audio bytes through ffmpeg's stdin to 16 kHz mono float32"""
+    command = [
+        "ffmpeg", "-loglevel", "error", "-threads", "0",
+        "-i", "pipe:0",
+        "-f", "f32le", "-ac", "1", "-acodec", "pcm_f32le", "-ar", str(SAMPLE_RATE),
+        "pipe:1"
+    ]
+    process = subprocess.run(command, input=data, capture_output=True)
+    if process.returncode != 0:
+        raise ValueError(f"Failed to decode audio: {process.stderr.decode(errors='replace').strip()[-500:]}")
+    return np.frombuffer(process.stdout, dtype=np.float32)
@@ -0,0 +1,193 @@
+import abc
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+import whisper.transcribe
+from whisper.audio import load_audio
+
+import stage_timing
+from audio import decode_encoded
+from model_loader import load_model, use_int8
+
+logger = logging.getLogger(__name__)
+
+# Decoding settings shared by every backend
+FULL_OPTIONS = {"task": "transcribe", "fp16": False, "verbose": False}
+REALTIME_OPTIONS = {
+    "task": "transcribe",
+    "fp16": False,
+    "verbose": False,
+    "condition_on_previous_text": False,  # Faster processing
+    "temperature": 0,  # Deterministic output
+    "best_of": 1,  # Don't sample multiple times
+    "beam_size": 1  # Fastest beam search
+}
+# openai-whisper's fallback schedule, retried at each step when decoding fails the thresholds
+WHISPER_TEMPERATURES = (0.0, 0.2, 0.4, 0.6, 0.8, 1.0)
+
+
+class TranscriptionBackend(abc.ABC):
+    """
+    Common transcription interface
+
+    transcribe() takes a file path, encoded audio bytes (decoded through
+    ffmpeg's stdin) or a 16 kHz mono float32 array and returns
+    {"text", "language", "segments": [{"start", "end", "text"}], "timing"},
+    timing holding the total "inference" seconds plus the stage_timing stages.
+    """
+
+    name = "base"
+    # Whether the loaded model can be shared with forked replica processes
+    forkable = True
+
+    def __init__(self, model_name: str, int8: bool = False):
+        self.model_name = model_name
+        self.int8 = int8
+
+    @abc.abstractmethod
+    def transcribe(self, audio, language: Optional[str] = None, realtime: bool = False) -> Dict[str, Any]:
+        """One clip in, the result described above out"""
+
+    def describe(self) -> Dict[str, Any]:
+        return {"backend": self.name, "model": self.model_name, "int8": self.int8}
+
+
+class OpenAIWhisperBackend(TranscriptionBackend):
+    """Reference PyTorch implementation from the openai-whisper package"""
+
+    name = "openai-whisper"
+
+    def __init__(self, model_name: str, int8: bool = False, cache_dir: Optional[str] = None,
+                 mmap: bool = False, **kwargs):
+        super().__init__(model_name, int8)
+        self.model = load_model(model_name, cache_dir=cache_dir, mmap=mmap, int8=int8)
+        self._hook_stages()
+
+    def _hook_stages(self):
+        # transcribe() computes the mel through its own module-level import
+        if not hasattr(whisper.transcribe.log_mel_spectrogram, "__wrapped__"):
+            whisper.transcribe.log_mel_spectrogram = stage_timing.timed(
+                "mel", whisper.transcribe.log_mel_spectrogram
+            )
+        stage_timing.hook_module("encode", self.model.encoder)
+        stage_timing.hook_module("decode", self.model.decoder)
+
+    def transcribe(self, audio, language: Optional[str] = None, realtime: bool = False) -> Dict[str, Any]:
+        options = REALTIME_OPTIONS if realtime else FULL_OPTIONS
+        start_time = time.time()
+        with stage_timing.measure() as timing:
+            # Decoded here rather than inside transcribe() so ffmpeg is timed on its own
+            if isinstance(audio, bytes):
+                with stage_timing.stage("decode_audio"):
+                    audio = decode_encoded(audio)
+            elif isinstance(audio, str):
+                with stage_timing.stage("decode_audio"):
+                    audio = load_audio(audio)
+            result = self.model.transcribe(audio, language=language, **options)
+        return {
+            "text": result["text"].strip(),
+            "language": result.get("language", language or "en"),
+            "segments": [
+                {"start": segment["start"], "end": segment["end"], "text": segment["text"].strip()}
+                for segment in result.get("segments", [])
+            ],
+            "timing": {"inference": time.time() - start_time, **timing}
+        }
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """CTranslate2 engine from the faster-whisper package, optimised for CPU"""
+
+    name = "faster-whisper"
+    # CTranslate2 keeps its own thread pools, so it parallelises with
+    # num_workers over one shared copy of the weights instead of forking
+    forkable = False
+
+    def __init__(self, model_name: str, int8: bool = False, cache_dir: Optional[str] = None,
+                 workers: int = 1, threads: int = 0, **kwargs):
+        super().__init__(model_name, int8)
+        from faster_whisper import WhisperModel
+
+        self.model = WhisperModel(
+            model_name,
+            device="cpu",
+            compute_type="int8" if int8 else "float32",
+            cpu_threads=threads,
+            num_workers=max(1, workers),
+            download_root=cache_dir
+        )
+        self._hook_stages()
+
+    def _hook_stages(self):
+        # WhisperModel calls these through self, so instance attributes take precedence
+        self.model.feature_extractor = stage_timing.TimedCallable("mel", self.model.feature_extractor)
+        self.model.encode = stage_timing.timed("encode", self.model.encode)
+        self.model.generate_with_fallback = stage_timing.timed("decode", self.model.generate_with_fallback)
+
+    @staticmethod
+    def _decoding_options(options: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        FULL_OPTIONS / REALTIME_OPTIONS in faster-whisper's terms
+
+        Anything the options leave out takes openai-whisper's default rather
+        than faster-whisper's (beam_size 5, best_of 5), so both backends run
+        the same decoding and benchmark against each other fairly.
+        """
+        return {
+            "task": options["task"],
+            # openai-whisper decodes greedily unless a beam size is given
+            "beam_size": options.get("beam_size") or 1,
+            "best_of": options.get("best_of") or 1,
+            "temperature": options.get("temperature", WHISPER_TEMPERATURES),
+            "condition_on_previous_text": options.get("condition_on_previous_text", True),
+            "compression_ratio_threshold": 2.4,
+            "log_prob_threshold": -1.0,
+            "no_speech_threshold": 0.6
+        }
+
+    def transcribe(self, audio, language: Optional[str] = None, realtime: bool = False) -> Dict[str, Any]:
+        from faster_whisper.audio import decode_audio
+
+        options = REALTIME_OPTIONS if realtime else FULL_OPTIONS
+        start_time = time.time()
+        with stage_timing.measure() as timing:
+            if isinstance(audio, bytes):
+                with stage_timing.stage("decode_audio"):
+                    audio = decode_encoded(audio)
+            elif isinstance(audio, str):
+                with stage_timing.stage("decode_audio"):
+                    audio = decode_audio(audio)
+            segments, info = self.model.transcribe(audio, language=language, **self._decoding_options(options))
+            # Segments are decoded lazily while the generator is consumed
+            segments = [
+                {"start": segment.start, "end": segment.end, "text": segment.text.strip()}
+                for segment in segments
+            ]
+        return {
+            "text": " ".join(segment["text"] for segment in segments).strip(),
+            "language": info.language,
+            "segments": segments,
+            "timing": {"inference": time.time() - start_time, **timing}
+        }
+
+
+BACKENDS = {
+    OpenAIWhisperBackend.name: OpenAIWhisperBackend,
+    FasterWhisperBackend.name: FasterWhisperBackend
+}
+
+
+def load_backend(name: Optional[str] = None, model_name: Optional[str] = None,
+                 int8: Optional[bool] = None, **kwargs) -> TranscriptionBackend:
+    """Instantiate the backend selected by WHISPER_BACKEND (default openai-whisper)"""
+    name = name or os.environ.get("WHISPER_BACKEND", OpenAIWhisperBackend.name)
+    model_name = model_name or os.environ.get("WHISPER_MODEL_SIZE", "small")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown Whisper backend {name}; available backends = {sorted(BACKENDS)}")
+    if int8 is None:
+        int8 = use_int8(model_name)
+
+    logger.info(f"Loading Whisper {model_name} model with the {name} backend...")
+    return BACKENDS[name](model_name, int8=int8, **kwargs)
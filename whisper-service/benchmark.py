@@ -0,0 +1,164 @@
+"""
+Accuracy and speed comparison of Whisper backends and inference modes on
+fixture audio
+
+Usage:
+    python -m benchmark --model small
+    python -m benchmark --model base --modes fp32 int8 --options realtime
+    python -m benchmark --backends openai-whisper faster-whisper --modes int8
+
+Fixtures live in fixtures/: every audio file (wav, flac, mp3, ogg) with a
+sidecar .txt holding its reference transcript. Clips without a reference
+are timed but left out of the WER column. A few synthesised clips ship
+there (see fixtures/README.md); --fixtures points at another directory.
+"""
+import argparse
+import glob
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+import torch
+import whisper
+from whisper.audio import SAMPLE_RATE
+from whisper.normalizers import EnglishTextNormalizer
+
+from backends import BACKENDS, OpenAIWhisperBackend, load_backend
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg")
+
+# Same decoding settings as the /transcribe and /transcribe-realtime endpoints
+DECODE_OPTIONS = {
+    "full": {"language": None, "realtime": False},
+    "realtime": {"language": "en", "realtime": True}
+}
+
+
+def load_fixtures(fixtures_dir: str) -> List[Dict]:
+    fixtures = []
+    for path in sorted(glob.glob(os.path.join(fixtures_dir, "*"))):
+        if not path.lower().endswith(AUDIO_EXTENSIONS):
+            continue
+        reference_path = os.path.splitext(path)[0] + ".txt"
+        reference = None
+        if os.path.exists(reference_path):
+            with open(reference_path) as f:
+                reference = f.read().strip()
+        fixtures.append({
+            "name": os.path.basename(path),
+            "audio": whisper.load_audio(path),
+            "reference": reference
+        })
+    return fixtures
+
+
+def word_error_rate(reference: str, hypothesis: str, normalizer) -> float:
+    """Word-level Levenshtein distance divided by the reference length"""
+    ref = normalizer(reference).split()
+    hyp = normalizer(hypothesis).split()
+    if not ref:
+        return 0.0 if not hyp else 1.0
+
+    previous = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, start=1):
+        current = [i] + [0] * len(hyp)
+        for j, hyp_word in enumerate(hyp, start=1):
+            current[j] = min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (ref_word != hyp_word)
+            )
+        previous = current
+    return previous[-1] / len(ref)
+
+
+def run_mode(backend_name: str, model_name: str, mode: str, fixtures: List[Dict], options: Dict,
+             cache_dir: Optional[str]) -> Dict:
+    load_start = time.time()
+    backend = load_backend(backend_name, model_name, int8=(mode == "int8"), cache_dir=cache_dir)
+    load_time = time.time() - load_start
+
+    # Untimed warm-up so lazy initialisation does not land on the first clip
+    backend.transcribe(fixtures[0]["audio"][:SAMPLE_RATE], **options)
+
+    normalizer = EnglishTextNormalizer()
+    clips = []
+    for fixture in fixtures:
+        start = time.time()
+        result = backend.transcribe(fixture["audio"], **options)
+        elapsed = time.time() - start
+        audio_seconds = len(fixture["audio"]) / SAMPLE_RATE
+
+        clip = {
+            "name": fixture["name"],
+            "seconds": round(elapsed, 3),
+            "rtf": round(elapsed / audio_seconds, 3) if audio_seconds else None,
+            "text": result["text"],
+            "wer": None
+        }
+        if fixture["reference"] is not None:
+            clip["wer"] = round(word_error_rate(fixture["reference"], result["text"], normalizer), 4)
+        clips.append(clip)
+
+    total_audio = sum(len(f["audio"]) for f in fixtures) / SAMPLE_RATE
+    total_time = sum(c["seconds"] for c in clips)
+    scored = [c["wer"] for c in clips if c["wer"] is not None]
+    return {
+        "backend": backend_name,
+        "mode": mode,
+        "load_seconds": round(load_time, 2),
+        "total_seconds": round(total_time, 3),
+        "rtf": round(total_time / total_audio, 3) if total_audio else None,
+        "mean_wer": round(sum(scored) / len(scored), 4) if scored else None,
+        "clips": clips
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare Whisper backends and inference modes on fixture audio")
+    parser.add_argument("--model", default=os.environ.get("WHISPER_MODEL_SIZE", "small"))
+    parser.add_argument("--backends", nargs="+", default=[OpenAIWhisperBackend.name], choices=sorted(BACKENDS))
+    parser.add_argument("--modes", nargs="+", default=["fp32", "int8"], choices=["fp32", "int8"])
+    parser.add_argument("--options", default="full", choices=sorted(DECODE_OPTIONS))
+    parser.add_argument("--fixtures", default=FIXTURES_DIR)
+    parser.add_argument("--cache-dir", default=os.environ.get("WHISPER_CACHE_DIR") or None)
+    parser.add_argument("--threads", type=int, default=0, help="torch intra-op threads (0 = torch default)")
+    parser.add_argument("--json", action="store_true", help="Print the full report as JSON")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    fixtures = load_fixtures(args.fixtures)
+    if not fixtures:
+        parser.error(f"No fixture audio found in {args.fixtures}")
+
+    reports = [
+        run_mode(backend_name, args.model, mode, fixtures, DECODE_OPTIONS[args.options], args.cache_dir)
+        for backend_name in args.backends
+        for mode in args.modes
+    ]
+
+    if args.json:
+        print(json.dumps({"model": args.model, "options": args.options, "reports": reports}, indent=2))
+        return
+
+    print(f"Whisper {args.model}, {args.options} decoding, {len(fixtures)} clips, {torch.get_num_threads()} threads")
+    print(f"{'backend':<16} {'mode':<6} {'load s':>8} {'total s':>8} {'RTF':>7} {'WER':>7}")
+    for report in reports:
+        wer = f"{report['mean_wer']:.2%}" if report["mean_wer"] is not None else "n/a"
+        print(f"{report['backend']:<16} {report['mode']:<6} {report['load_seconds']:>8} "
+              f"{report['total_seconds']:>8} {report['rtf']:>7} {wer:>7}")
+
+    if len(reports) > 1 and reports[0]["total_seconds"]:
+        baseline = reports[0]
+        for report in reports[1:]:
+            speedup = baseline["total_seconds"] / report["total_seconds"] if report["total_seconds"] else 0
+            print(f"{report['backend']} {report['mode']} vs {baseline['backend']} {baseline['mode']}: "
+                  f"{speedup:.2f}x speed")
+
+
+if __name__ == "__main__":
+    main()
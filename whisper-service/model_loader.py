@@ -0,0 +1,108 @@
+import logging
+import os
+from typing import Optional, Set
+
+import torch
+import whisper
+from whisper.model import ModelDimensions, Whisper
+
+logger = logging.getLogger(__name__)
+
+
+def default_cache_dir() -> str:
+    """Same download root openai-whisper uses when none is given"""
+    default = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(os.getenv("XDG_CACHE_HOME", default), "whisper")
+
+
+def _checkpoint_path(name: str, cache_dir: str) -> str:
+    """Resolve a model name to a checkpoint file, downloading it if needed"""
+    if name in whisper._MODELS:
+        return whisper._download(whisper._MODELS[name], cache_dir, False)
+    if os.path.isfile(name):
+        return name
+    raise RuntimeError(f"Model {name} not found; available models = {whisper.available_models()}")
+
+
+def int8_models() -> Set[str]:
+    """Models configured for int8 inference, e.g. WHISPER_INT8_MODELS=small,medium or *"""
+    value = os.environ.get("WHISPER_INT8_MODELS", "")
+    return {item.strip() for item in value.split(",") if item.strip()}
+
+
+def use_int8(name: str) -> bool:
+    configured = int8_models()
+    return "*" in configured or name in configured
+
+
+def quantize_int8(model: Whisper) -> Whisper:
+    """Apply dynamic int8 quantisation to every linear layer of the model"""
+    # Whisper's Linear subclass only casts its weights to the input dtype,
+    # which is a no-op in fp32; downcast it so quantize_dynamic recognises it
+    for module in model.modules():
+        if type(module) is whisper.model.Linear:
+            module.__class__ = torch.nn.Linear
+
+    return torch.ao.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True
+    )
+
+
+def load_model(name: str, cache_dir: Optional[str] = None, mmap: bool = False,
+               int8: Optional[bool] = None) -> Whisper:
+    """
+    Load a Whisper model on CPU
+
+    With mmap enabled the checkpoint in the cache directory is memory-mapped
+    rather than read into RAM, so boot is fast and the weight pages are shared
+    by every process that maps the same file. That holds for fp32
+    checkpoints only: fp16 ones (OpenAI's downloads) are cast to fp32 on
+    load into each process's private memory. int8 defaults to the
+    WHISPER_INT8_MODELS setting for this model.
+    """
+    if int8 is None:
+        int8 = use_int8(name)
+
+    model = _load_fp32(name, cache_dir or default_cache_dir(), mmap)
+    model.eval()
+
+    if int8:
+        model = quantize_int8(model)
+        logger.info(f"Whisper {name} quantised to dynamic int8")
+    return model
+
+
+def _load_fp32(name: str, cache_dir: str, mmap: bool) -> Whisper:
+    if not mmap:
+        return whisper.load_model(name, device="cpu", download_root=cache_dir)
+
+    checkpoint_path = _checkpoint_path(name, cache_dir)
+    try:
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True)
+    except RuntimeError as e:
+        # Legacy (non-zipfile) checkpoints cannot be memory-mapped
+        logger.warning(f"Cannot memory-map {checkpoint_path} ({e}), loading it into memory")
+        return whisper.load_model(name, device="cpu", download_root=cache_dir)
+
+    dims = ModelDimensions(**checkpoint["dims"])
+    model = Whisper(dims)
+    # assign=True keeps the mmap-backed tensors instead of copying into fresh
+    # ones. OpenAI's checkpoints are fp16, though, and the service runs with
+    # fp16=False, so they are cast to fp32 first; the cast copies them into
+    # private memory, which gives up most of the page sharing. Only an fp32
+    # checkpoint (saved once, then mapped) stays shared between processes.
+    state_dict = {
+        key: tensor.float() if tensor.is_floating_point() else tensor
+        for key, tensor in checkpoint["model_state_dict"].items()
+    }
+    model.load_state_dict(state_dict, assign=True)
+
+    wrong_dtypes = {str(parameter.dtype) for parameter in model.parameters() if parameter.dtype != torch.float32}
+    if wrong_dtypes:
+        raise RuntimeError(f"Memory-mapped Whisper {name} has {sorted(wrong_dtypes)} parameters, expected float32")
+
+    if name in whisper._ALIGNMENT_HEADS:
+        model.set_alignment_heads(whisper._ALIGNMENT_HEADS[name])
+
+    logger.info(f"Memory-mapped Whisper weights from {checkpoint_path}")
+    return model
@@ -0,0 +1,240 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Replica pool: the parent process loads the backend once and forks N inference
+# processes. Forked children share the weight pages copy-on-write, and since
+# inference never writes to the weights they stay shared for the whole run.
+# A replica that dies is forked again from the event loop (main) thread, not
+# from the router thread, and gets the warm-up payloads before it is routed
+# any traffic.
+
+
+def _replica_main(replica_id, backend, cores, threads, task_queue, result_queue):
+    """Inference loop running inside one replica process"""
+    import torch
+
+    # Pin the replica to its slice of cores and size torch's pool to match
+    if cores:
+        try:
+            os.sched_setaffinity(0, cores)
+        except (AttributeError, OSError) as e:
+            logger.warning(f"Replica {replica_id}: could not set CPU affinity: {e}")
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        # Already initialised in the parent before fork
+        pass
+
+    logger.info(f"Replica {replica_id} ready (pid={os.getpid()}, cores={sorted(cores)}, threads={threads})")
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+
+        task_id, audio, options = task
+        try:
+            result = backend.transcribe(audio, **options)
+            result_queue.put((replica_id, task_id, True, result))
+        except Exception as e:
+            result_queue.put((replica_id, task_id, False, str(e)))
+
+
+class ReplicaPool:
+    """Least-loaded router over forked Whisper inference processes"""
+
+    def __init__(self, backend, replicas: int, threads_per_replica: Optional[int] = None):
+        self.backend = backend
+        self.replicas = replicas
+        self.threads_per_replica = threads_per_replica
+        self._ctx = mp.get_context("fork")
+        self._result_queue = self._ctx.Queue()
+        self._processes: List[Any] = [None] * replicas
+        self._task_queues: List[Any] = [None] * replicas
+        self._inflight = [0] * replicas
+        self._completed = [0] * replicas
+        self._pending: Dict[int, tuple] = {}
+        self._lock = threading.Lock()
+        self._task_ids = itertools.count(1)
+        self._round_robin = itertools.count()
+        self._running = False
+        self._router_thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Replicas the router may pick; respawned ones join once warmed up
+        self._available = [False] * replicas
+        self._warm_up_payloads: List[tuple] = []
+        self._core_slices = self._plan_cores()
+
+    def _plan_cores(self) -> List[set]:
+        """Split the cores available to this process into one slice per replica"""
+        try:
+            cores = sorted(os.sched_getaffinity(0))
+        except AttributeError:
+            cores = list(range(os.cpu_count() or 1))
+
+        per_replica = max(1, len(cores) // self.replicas)
+        slices = []
+        for i in range(self.replicas):
+            start = (i * per_replica) % len(cores)
+            slices.append(set(cores[start:start + per_replica]))
+        return slices
+
+    def _spawn(self, replica_id: int):
+        cores = self._core_slices[replica_id]
+        threads = self.threads_per_replica or len(cores)
+        task_queue = self._ctx.Queue()
+        process = self._ctx.Process(
+            target=_replica_main,
+            args=(replica_id, self.backend, cores, threads, task_queue, self._result_queue),
+            name=f"whisper-replica-{replica_id}",
+            daemon=True
+        )
+        process.start()
+        self._task_queues[replica_id] = task_queue
+        self._processes[replica_id] = process
+
+    def start(self):
+        """Fork the replicas and start the router thread; call from the event loop"""
+        logger.info(f"Starting Whisper replica pool with {self.replicas} replicas")
+        self._loop = asyncio.get_running_loop()
+        for replica_id in range(self.replicas):
+            self._spawn(replica_id)
+            self._available[replica_id] = True
+
+        self._running = True
+        self._router_thread = threading.Thread(target=self._route_results, name="whisper-replica-router", daemon=True)
+        self._router_thread.start()
+
+    def _pick_replica(self) -> int:
+        """Least in-flight requests first, round-robin between ties"""
+        offset = next(self._round_robin)
+        order = [(offset + i) % self.replicas for i in range(self.replicas)]
+        # With every replica respawning, queue behind one rather than fail
+        candidates = [replica_id for replica_id in order if self._available[replica_id]] or order
+        return min(candidates, key=lambda replica_id: self._inflight[replica_id])
+
+    async def transcribe(self, audio, replica_id: Optional[int] = None, **options) -> Dict[str, Any]:
+        """Run backend.transcribe on the given replica, or the least-loaded one"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        with self._lock:
+            if replica_id is None:
+                replica_id = self._pick_replica()
+            task_id = next(self._task_ids)
+            self._pending[task_id] = (replica_id, loop, future)
+            self._inflight[replica_id] += 1
+
+        self._task_queues[replica_id].put((task_id, audio, options))
+        return await future
+
+    def _resolve(self, task_id: int, ok: bool, payload):
+        with self._lock:
+            entry = self._pending.pop(task_id, None)
+            if entry is None:
+                return
+            replica_id, loop, future = entry
+            self._inflight[replica_id] -= 1
+            self._completed[replica_id] += 1
+
+        def _set():
+            if future.done():
+                return
+            if ok:
+                future.set_result(payload)
+            else:
+                future.set_exception(RuntimeError(payload))
+
+        loop.call_soon_threadsafe(_set)
+
+    def _route_results(self):
+        """Hand results back to the event loop and replace dead replicas"""
+        while self._running:
+            try:
+                _, task_id, ok, payload = self._result_queue.get(timeout=1.0)
+                self._resolve(task_id, ok, payload)
+            except queue.Empty:
+                pass
+            except (EOFError, OSError):
+                break
+
+            for replica_id, process in enumerate(self._processes):
+                if self._running and process is not None and not process.is_alive():
+                    logger.error(f"Replica {replica_id} exited with code {process.exitcode}, respawning")
+                    with self._lock:
+                        self._available[replica_id] = False
+                        self._processes[replica_id] = None
+                        lost = [task_id for task_id, entry in self._pending.items() if entry[0] == replica_id]
+                    for task_id in lost:
+                        self._resolve(task_id, False, f"Replica {replica_id} crashed")
+                    # Forking here would copy a process whose other threads may
+                    # hold locks the child then waits on forever
+                    self._loop.call_soon_threadsafe(self._schedule_respawn, replica_id)
+
+    def _schedule_respawn(self, replica_id: int):
+        if self._running:
+            self._loop.create_task(self._respawn(replica_id))
+
+    async def _respawn(self, replica_id: int):
+        """Fork a replacement replica and warm it up before routing to it"""
+        self._spawn(replica_id)
+        process = self._processes[replica_id]
+        start_time = time.time()
+        try:
+            for audio, options in self._warm_up_payloads:
+                await self.transcribe(audio, replica_id=replica_id, **options)
+        except Exception as e:
+            logger.error(f"Replica {replica_id} warm-up failed: {e}")
+        with self._lock:
+            # A replica that died while warming up has been replaced again
+            if self._processes[replica_id] is process and process.is_alive():
+                self._available[replica_id] = True
+                logger.info(f"Replica {replica_id} respawned and warmed up in {time.time() - start_time:.2f} seconds")
+
+    async def warm_up(self, audio, **options):
+        """Run one transcription on every replica so none of them serves cold"""
+        # Replayed on replicas respawned later
+        self._warm_up_payloads.append((audio, options))
+        await asyncio.gather(*[
+            self.transcribe(audio, replica_id=replica_id, **options)
+            for replica_id in range(self.replicas)
+        ])
+
+    def stats(self) -> List[Dict[str, Any]]:
+        return [
+            {
+                "replica": replica_id,
+                "pid": process.pid if process else None,
+                "alive": bool(process and process.is_alive()),
+                "available": self._available[replica_id],
+                "cores": sorted(self._core_slices[replica_id]),
+                "inflight": self._inflight[replica_id],
+                "completed": self._completed[replica_id]
+            }
+            for replica_id, process in enumerate(self._processes)
+        ]
+
+    def shutdown(self, timeout: float = 10.0):
+        """Stop the router and let every replica drain its queue"""
+        self._running = False
+        for task_queue in self._task_queues:
+            if task_queue is not None:
+                task_queue.put(None)
+
+        deadline = time.time() + timeout
+        for process in self._processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.time()))
+                if process.is_alive():
+                    process.terminate()
+        logger.info("Whisper replica pool stopped")
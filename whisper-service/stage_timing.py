@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict
+
+# Wall time per transcription stage: decode_audio (ffmpeg or PCM), mel
+# (log-Mel spectrogram), encode (audio encoder) and decode (token decoding).
+# Backends hook the stages once at load time; the hooks only record while a
+# measure() block is open on the calling thread, so warm-up and concurrent
+# transcriptions on other threads never mix into a request's numbers.
+
+STAGES = ("decode_audio", "mel", "encode", "decode")
+
+_local = threading.local()
+
+
+@contextmanager
+def measure():
+    """Collect the stage timings of everything run on this thread inside the block"""
+    timing = {stage: 0.0 for stage in STAGES}
+    previous = getattr(_local, "timing", None)
+    _local.timing = timing
+    try:
+        yield timing
+    finally:
+        _local.timing = previous
+
+
+@contextmanager
+def stage(name: str):
+    timing = getattr(_local, "timing", None)
+    if timing is None:
+        yield
+        return
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing[name] = timing.get(name, 0.0) + time.perf_counter() - start_time
+
+
+def timed(name: str, function: Callable) -> Callable:
+    """Wrap a function so each call counts towards a stage"""
+    def wrapper(*args, **kwargs):
+        with stage(name):
+            return function(*args, **kwargs)
+    wrapper.__wrapped__ = function
+    return wrapper
+
+
+class TimedCallable:
+    """Callable object whose calls count towards a stage; other attributes pass through"""
+
+    def __init__(self, name: str, target: Any):
+        self._stage_name = name
+        self._target = target
+
+    def __call__(self, *args, **kwargs):
+        with stage(self._stage_name):
+            return self._target(*args, **kwargs)
+
+    def __getattr__(self, attribute):
+        return getattr(self._target, attribute)
+
+
+def hook_module(name: str, module) -> None:
+    """Time every forward pass of a torch module towards a stage"""
+    def before(module, inputs):
+        if getattr(_local, "timing", None) is None:
+            return
+        starts = getattr(_local, "starts", None)
+        if starts is None:
+            starts = _local.starts = {}
+        starts.setdefault(name, []).append(time.perf_counter())
+
+    def after(module, inputs, output):
+        timing = getattr(_local, "timing", None)
+        starts = getattr(_local, "starts", {}).get(name)
+        if timing is not None and starts:
+            timing[name] = timing.get(name, 0.0) + time.perf_counter() - starts.pop()
+
+    module.register_forward_pre_hook(before)
+    module.register_forward_hook(after)
+
+
+class StageStats:
+    """Running totals per stage over the transcriptions served by this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: Dict[str, Dict[str, float]] = {}
+
+    def record(self, timing: Dict[str, float]):
+        with self._lock:
+            for name, seconds in timing.items():
+                totals = self._totals.setdefault(name, {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+                totals["count"] += 1
+                totals["total_seconds"] += seconds
+                totals["max_seconds"] = max(totals["max_seconds"], seconds)
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            return {
+                name: {
+                    "count": totals["count"],
+                    "mean_seconds": round(totals["total_seconds"] / totals["count"], 4),
+                    "max_seconds": round(totals["max_seconds"], 4)
+                }
+                for name, totals in self._totals.items()
+            }